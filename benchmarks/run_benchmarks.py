@@ -0,0 +1,264 @@
+"""
+A benchmark suite for the algorithms of "Subgame-perfect Cooperation in Networks". Every case is measured phase by
+phase: the construction of the joint state machine (Algorithm 1), the long term utilities (Algorithm 2), the SPE check
+(Algorithm 3) and a best-response (Algorithm 4), and the examples of examples.py are measured end to end. The wall
+times of the runs, their median, the peak memory and the number of joint states of every phase are written to a JSON
+results file, and compared with a stored baseline:
+
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json
+
+The baseline guards the fast paths against slowdowns and memory growth of every phase, see compare_results. It is
+recorded again with --save-baseline when the algorithms change, and the timings are only comparable on the same
+machine, so record it there before comparing.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import examples
+from build_joint_state_machine import construct_joint_state_machine
+from calc_BR_state_machine import calc_BR_state_machine_player_i_ver
+from check_SPE_state_machine import calc_long_term_util, calc_neighborhood_utilities_by_graph, \
+    calculate_single_player_utility_by_graph, check_SPE_state_machine
+from creating_three_players_state_machines import left_state_machine, middle_state_machine, right_state_machine, \
+    three_players_parameters
+from generate_network_state_machines import network_edges, network_games
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+THREE_PLAYERS_PARAMETERS = [(1, 2, 4), (1, 3, 10), (2, 5, 30), (1, 20, 200), (1, 50, 1000)]
+NETWORK_SIZES = [4, 6, 8, 10]
+QUICK_NETWORK_SIZES = [4, 6, 8]
+EPSILON = 0.01
+
+
+def measure(function, repeat):
+    """
+    :param function: A function without arguments.
+    :param repeat: The number of timed runs.
+
+    :return: (result, times, peak_memory), the result of the function, its wall times in seconds in the runs, and the
+    peak memory in bytes that it allocates, measured by tracemalloc in a first run, which also warms up the caches.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times = []
+    for run in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, times, peak_memory
+
+
+def timing(times):
+    """
+    :return: The measurement of the wall times of the runs of a phase, their median as "time" and all of them.
+    """
+    return {"time": float(np.median(times)), "times": times}
+
+
+def grim_trigger_network(family, n, c=3, d=5, l=1):
+    """
+    An n-player network of prisoner's dilemmas, where every player plays grim-trigger with his neighborhood: he
+    cooperates until he or one of his neighbors defects, and then defects forever.
+
+    :return: (n, games, transition_funcs, strategy_funcs), see check_SPE_state_machine_by_graph.
+    """
+    edges = network_edges(family, n)
+    games = network_games(edges, c, d, l)
+    all_actions = ["".join(element) for element in itertools.product("CD", repeat=n)]
+    transition_funcs, strategy_funcs = [], []
+    for i in range(n):
+        watched = [i] + [k for edge in edges for k in edge if i in edge and k != i]
+        transition_funcs.append({0: {ac: 0 if all(ac[k] == "C" for k in watched) else 1 for ac in all_actions},
+                                 1: {ac: 1 for ac in all_actions}})
+        strategy_funcs.append({0: "C", 1: "D"})
+    return n, games, transition_funcs, strategy_funcs
+
+
+def three_players_network(c, d, l):
+    """
+    :return: The network and the strategies of create_three_players_state_machines(c, d, l), see
+    grim_trigger_network.
+    """
+    punish_num, trust_gain_num = three_players_parameters(c, d, l)
+    machines = [machine(punish_num, trust_gain_num)
+                for machine in (left_state_machine, middle_state_machine, right_state_machine)]
+    games = network_games(network_edges("V", 3), c, d, l)
+    return 3, games, [machine[0] for machine in machines], [machine[1] for machine in machines]
+
+
+def benchmark_network(n, games, transition_funcs, strategy_funcs, repeat):
+    """
+    Measure the phases of the algorithms on a network game, see measure.
+
+    :return: A dict from the phases to their measurements.
+    """
+    games = dict(games)
+    for edge in list(games.keys()):
+        games[(edge[1], edge[0])] = games[edge]
+    actions_sets = [{"C", "D"} for i in range(n)]
+    utilities = calc_neighborhood_utilities_by_graph(n, games, actions_sets)
+    single_states = sum(len(transition_func) for transition_func in transition_funcs)
+    phases = {}
+
+    def record(phase, function, states=None):
+        result, times, peak_memory = measure(function, repeat)
+        phases[phase] = {**timing(times), "peak_memory": peak_memory, "single_player_states": single_states,
+                         "joint_states": states}
+        return result
+
+    joint = record("construct", lambda: construct_joint_state_machine(actions_sets, transition_funcs, strategy_funcs))
+    phases["construct"]["joint_states"] = len(joint[0])
+    joint_arrays = record("construct_arrays", lambda: construct_joint_state_machine(
+        actions_sets, transition_funcs, strategy_funcs, as_arrays=True), len(joint[0]))
+    record("long_term_util", lambda: calc_long_term_util(EPSILON, joint[0], utilities, joint[1], joint[2]),
+           len(joint[0]))
+    record("long_term_util_arrays", lambda: calc_long_term_util(EPSILON, joint_arrays, utilities), len(joint[0]))
+    record("check_SPE", lambda: check_SPE_state_machine(*joint, utilities, EPSILON=EPSILON, verbose=False),
+           len(joint[0]))
+    record("check_SPE_arrays", lambda: check_SPE_state_machine(joint_arrays, utils_by_actions=utilities,
+                                                               EPSILON=EPSILON, verbose=False), len(joint[0]))
+
+    # the best-response of player 0 to the strategies of the others
+    full_utilities = [calculate_single_player_utility_by_graph(n, games, i, actions_sets) for i in range(n)]
+    record("best_response", lambda: calc_BR_state_machine_player_i_ver(
+        0, transition_funcs[1:], strategy_funcs[1:], full_utilities, EPSILON=EPSILON, as_arrays=True))
+    return phases
+
+
+def benchmark_examples(repeat, select=None):
+    """
+    Measure the examples of examples.py end to end, with their output suppressed.
+
+    :param select: If given, only run the examples whose case names contain this string.
+
+    :return: A dict from the names of the cases to their measurements.
+    """
+    results = {}
+    for name in sorted(dir(examples)):
+        example = getattr(examples, name)
+        if callable(example) and name[0].isupper() and (select is None or select in "examples/" + name):
+            with contextlib.redirect_stdout(io.StringIO()):
+                times, peak_memory = measure(example, repeat)[1:]
+            results["examples/" + name] = {"run": {**timing(times), "peak_memory": peak_memory}}
+    return results
+
+
+def run_benchmarks(repeat=5, quick=False, select=None):
+    """
+    :param repeat: The number of timed runs of every phase.
+    :param quick: If True, skip the largest cases.
+    :param select: If given, only run the cases whose names contain this string.
+
+    :return: The results, a dict with the "environment" and the measurements of every phase of every case.
+    """
+    cases = {}
+    for c, d, l in THREE_PLAYERS_PARAMETERS[:3] if quick else THREE_PLAYERS_PARAMETERS:
+        cases["three_players/c=%d,d=%d,l=%d" % (c, d, l)] = lambda c=c, d=d, l=l: three_players_network(c, d, l)
+    for family in ("line", "cycle", "star"):
+        for n in QUICK_NETWORK_SIZES if quick else NETWORK_SIZES:
+            cases["%s/n=%d" % (family, n)] = lambda family=family, n=n: grim_trigger_network(family, n)
+
+    results = benchmark_examples(repeat, select)
+    for name, network in cases.items():
+        if select is None or select in name:
+            print(name, file=sys.stderr)
+            results[name] = benchmark_network(*network(), repeat=repeat)
+
+    environment = {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+                   "platform": platform.platform(), "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+    return {"environment": environment, "repeat": repeat, "results": results}
+
+
+def compare_results(results, baseline, tolerance=0.5, min_time=1e-2, min_memory=1 << 20):
+    """
+    Compare the results with a baseline, phase by phase. A phase is slower when its median time grows by more than the
+    tolerance, and also its fastest run is slower than the slowest run of the baseline, so the run-to-run noise, up to
+    30-45% between the runs of a phase of 10-100 ms on a shared machine, doesn't count as a regression.
+
+    :param tolerance: The relative slowdown of the median time or memory growth that counts as a regression.
+    :param min_time: Phases faster than this many seconds are too noisy to count as slowdowns.
+    :param min_memory: Phases that allocate less than this many bytes are too noisy to count as memory growth.
+
+    :return: (rows, regressions), a row (case, phase, time ratio, memory ratio) for every phase in both, and the rows
+    that regressed.
+    """
+    rows, regressions = [], []
+    for case, phases in results["results"].items():
+        for phase, measurement in phases.items():
+            base = baseline["results"].get(case, {}).get(phase)
+            if base is None:
+                continue
+            time_ratio = measurement["time"] / max(base["time"], 1e-12)
+            memory_ratio = measurement["peak_memory"] / max(base["peak_memory"], 1)
+            row = (case, phase, time_ratio, memory_ratio)
+            rows.append(row)
+            slower = min(measurement.get("times", [measurement["time"]])) > max(base.get("times", [base["time"]]))
+            if (time_ratio > 1 + tolerance and slower and measurement["time"] > min_time) or (
+                    memory_ratio > 1 + tolerance and measurement["peak_memory"] > min_memory):
+                regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the algorithms of \"Subgame-perfect Cooperation in "
+                                                 "Networks\".")
+    parser.add_argument("--output", default=os.path.join(BENCHMARKS_DIR, "results.json"),
+                        help="the JSON results file")
+    parser.add_argument("--baseline", help="a results file to compare with, exit status 1 on a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="also save the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="the relative slowdown of the median time that is a regression")
+    parser.add_argument("--min-time", type=float, default=1e-2,
+                        help="phases faster than this many seconds are too noisy to count as slowdowns")
+    parser.add_argument("--repeat", type=int, default=5, help="the number of timed runs of every phase")
+    parser.add_argument("--quick", action="store_true", help="skip the largest cases")
+    parser.add_argument("--select", help="only run the cases whose names contain this string")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.repeat, args.quick, args.select)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=1)
+    if args.save_baseline:
+        with open(os.path.join(BENCHMARKS_DIR, "baseline.json"), "w") as file:
+            json.dump(results, file, indent=1)
+
+    for case, phases in results["results"].items():
+        for phase, measurement in phases.items():
+            print("%-32s %-22s %10.4fs %10.1fMB %8s" % (case, phase, measurement["time"],
+                                                       measurement["peak_memory"] / 2 ** 20,
+                                                       measurement.get("joint_states") or ""))
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    rows, regressions = compare_results(results, baseline, args.tolerance, args.min_time)
+    print("\ncompared with %s (time, memory relative to the baseline):" % args.baseline)
+    for case, phase, time_ratio, memory_ratio in rows:
+        print("%-32s %-22s %6.2fx %6.2fx%s" % (case, phase, time_ratio, memory_ratio,
+                                               "  REGRESSION" if (case, phase, time_ratio, memory_ratio)
+                                               in regressions else ""))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
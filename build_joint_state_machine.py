@@ -1,41 +1,596 @@
-import itertools
-
-
-def construct_joint_state_machine(players_actions: list, transition_funcs: list, strategy_funcs: list):
-    """
-    Algorithm 1 in "Subgame-perfect Cooperation in Networks".
-    Find the joint states, transitions, and actions for the joint strategy state machine.
-
-    :param players_actions: players_actions[i] is a list of possible actions for player i.
-    :param transition_funcs: transition_funcs[i] is a dict so that transition_funcs[i][q][action] when q is a state and
-    'action' is a string returns the state that the state machine of player i goes to from state q after 'action'.
-    :param strategy_funcs: strategy_funcs[i] is a dict so that strategy_funcs[i][q] returns the action from
-    players_actions[i] to play in state q.
-
-    :return: The joint strategy state machine of all the players, as described in the paper.
-    """
-    num_players = len(players_actions)
-    # the initial states of the state machines are 0
-    initial_state = tuple(0 for i in range(num_players))
-    joint_states = [initial_state]
-    states_queue = [initial_state]
-    joint_transition = {}
-    joint_strategy_func = {}
-
-    while len(states_queue) != 0:
-        q = states_queue.pop(0)
-        q_action = "".join([strategy_funcs[i][q[i]] for i in range(num_players)])
-        joint_strategy_func[q] = q_action
-
-        q_transitions = {}
-        for element in itertools.product(*players_actions):
-            action = "".join(element)
-            q_transitions[action] = tuple(transition_funcs[i][q[i]][action] for i in range(num_players))
-        joint_transition[q] = q_transitions
-
-        for state in q_transitions.values():
-            if state not in joint_states:
-                joint_states.append(state)
-                states_queue.append(state)
-
-    return joint_states, joint_transition, joint_strategy_func
+import itertools
+from collections import deque
+from typing import NamedTuple
+
+import numpy as np
+
+from minimize_state_machine import minimize_state_machines, minimize_tables
+from phase_stats import count, phase, record_max
+from run_control import checkpoint, state_budget
+from state_machine_cache import cached
+
+# the number of successor entries that the array-backed construction finds at a time
+_EXPAND_CHUNK = 1 << 20
+# the number of joint states that the dict construction expands between its checkpoints
+_CHECKPOINT_STATES = 256
+
+
+class JointStateMachineArrays(NamedTuple):
+    """
+    An array-backed joint strategy state machine, the alternative output of construct_joint_state_machine.
+
+    Joint states are the integers 0, ..., n_states - 1, where 0 is the initial state. Action profiles are encoded as
+    mixed-radix integers over players_actions, where player 0 is the most significant digit, so the profile code of
+    "CDC" over [("C", "D")] * 3 is 0 * 4 + 1 * 2 + 0 = 2.
+
+    states: int array of shape (n_states, n_players), states[s][i] is the state of player i in joint state s.
+    transitions: int32 array of shape (n_states, n_profiles), transitions[s][a] is the joint state reached from s after
+    the action profile a.
+    strategy: int array of shape (n_states,), strategy[s] is the action profile played in joint state s.
+    players_actions: players_actions[i] is the ordered tuple of possible actions for player i.
+    unilateral: If True, only the on-path profile and the unilateral deviations from it are stored, and transitions
+    has the shape (n_states, 1 + n_deviations): column 0 is the on-path profile, and the other columns are the
+    profiles of deviation_profiles(strategy, players_actions).
+    """
+    states: np.ndarray
+    transitions: np.ndarray
+    strategy: np.ndarray
+    players_actions: tuple
+    unilateral: bool = False
+
+
+class LocalStateMachine(NamedTuple):
+    """
+    A single-player strategy state machine in a compact array form, whose transitions depend only on the actions of
+    the players it watches, like a player of a network game that watches his neighborhood. The states are
+    0, ..., n_states - 1, where 0 is the initial state. It can replace the transition and strategy functions of a
+    player in construct_joint_state_machine.
+
+    player: The player whose strategy it is.
+    watched: int array, the players whose actions the transitions depend on, in increasing order.
+    transitions: int32 array of shape (n_states, n_local_profiles), transitions[q][a] is the state reached from q after
+    the action profile a of the watched players, encoded like the action profiles of all the players, see
+    local_action_profiles.
+    strategy: int array of shape (n_states,), the index of the action of the player played in every state.
+    """
+    player: int
+    watched: np.ndarray
+    transitions: np.ndarray
+    strategy: np.ndarray
+
+
+def ordered_actions(players_actions: list):
+    """
+    Fix the order of the actions of each player, which defines the encoding of the action profiles.
+
+    :param players_actions: players_actions[i] is a list (or a set) of possible actions for player i. Sets are sorted,
+    other sequences keep their order.
+
+    :return: A tuple of tuples, the ordered actions of every player.
+    """
+    return tuple(tuple(sorted(actions)) if isinstance(actions, (set, frozenset)) else tuple(actions)
+                 for actions in players_actions)
+
+
+def action_profile_strides(players_actions):
+    """
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+
+    :return: strides[i] is the value of one step in the action of player i in the encoding of the action profiles.
+    """
+    radices = [len(actions) for actions in players_actions]
+    strides = np.ones(len(radices), dtype=np.int64)
+    for i in range(len(radices) - 2, -1, -1):
+        strides[i] = strides[i + 1] * radices[i + 1]
+    return strides
+
+
+def encode_action_profile(action, players_actions):
+    """
+    :param action: An action profile, as a joined string like "CDC" or as a sequence with an action for every player.
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+
+    :return: The integer code of the action profile.
+    """
+    code = 0
+    for i, actions in enumerate(players_actions):
+        code = code * len(actions) + actions.index(action[i])
+    return code
+
+
+def decode_action_profile(code, players_actions, tuple_keys=False):
+    """
+    :param code: The integer code of an action profile.
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+    :param tuple_keys: If True, return the action profile as a tuple of actions.
+
+    :return: The action profile as a joined string, like "CDC", or as a tuple, like ("C", "D", "C").
+    """
+    action = []
+    for actions in reversed(players_actions):
+        code, digit = divmod(int(code), len(actions))
+        action.append(actions[digit])
+    return tuple(reversed(action)) if tuple_keys else "".join(reversed(action))
+
+
+def local_action_profiles(profiles, players_actions, players):
+    """
+    :param profiles: An int array of encoded action profiles of all the players.
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+    :param players: The players of the local action profiles.
+
+    :return: An int array, the action profiles of only the given players, encoded over their actions in their order.
+    """
+    profiles = np.asarray(profiles, dtype=np.int64)
+    strides = action_profile_strides(players_actions)
+    local_profiles = np.zeros(profiles.shape, dtype=np.int64)
+    for j in np.asarray(players).tolist():
+        radix = len(players_actions[j])
+        local_profiles = local_profiles * radix + (profiles // strides[j]) % radix
+    return local_profiles
+
+
+def action_profiles(players_actions, tuple_keys=False):
+    """
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+    :param tuple_keys: If True, return the action profiles as tuples of actions.
+
+    :return: A list of all the action profiles, in the order of their codes when players_actions is ordered. Action
+    profiles are joined strings like "CDC", which requires one-character actions, or tuples like ("C", "D", "C").
+    """
+    profiles = itertools.product(*players_actions)
+    return list(profiles) if tuple_keys else ["".join(element) for element in profiles]
+
+
+def has_tuple_keys(action_dict):
+    """
+    :param action_dict: A dict whose keys are action profiles, like a row of a transition function or the utilities
+    of a player.
+
+    :return: True if the action profiles are tuples of actions, and False if they are joined strings.
+    """
+    return isinstance(next(iter(action_dict)), tuple)
+
+
+def replace_action(action, i, other_action):
+    """
+    :param action: An action profile, as a joined string or as a tuple.
+    :param i: A player.
+    :param other_action: An action of player i.
+
+    :return: The action profile where player i plays other_action instead, in the same form as action.
+    """
+    if isinstance(action, str):
+        return action[:i] + other_action + action[i + 1:]
+    return tuple(action[:i]) + (other_action,) + tuple(action[i + 1:])
+
+
+def deviation_players(players_actions):
+    """
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+
+    :return: An int array, the deviating player of every column of deviation_profiles.
+    """
+    return np.repeat(np.arange(len(players_actions)), [len(actions) - 1 for actions in players_actions])
+
+
+def deviation_profiles(strategy, players_actions):
+    """
+    Find the unilateral deviations from the on-path action profiles. For every player i there is a column for each of
+    his other actions, in the order of players_actions[i].
+
+    :param strategy: An int array of encoded on-path action profiles.
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+
+    :return: An int array of shape (len(strategy), n_deviations), the encoded profiles where exactly one player plays
+    a different action than in strategy. The deviating player of each column is given by deviation_players.
+    """
+    strategy = np.asarray(strategy, dtype=np.int64)
+    strides = action_profile_strides(players_actions)
+    columns = []
+    for i, actions in enumerate(players_actions):
+        own_action = (strategy // strides[i]) % len(actions)
+        for rank in range(len(actions) - 1):
+            # the rank-th action of player i other than his own action
+            other_action = rank + (rank >= own_action)
+            columns.append(strategy + (other_action - own_action) * strides[i])
+    return np.stack(columns, axis=-1) if columns else np.empty((len(strategy), 0), dtype=np.int64)
+
+
+def on_path_next_states(joint: JointStateMachineArrays):
+    """
+    :param joint: An array-backed joint strategy state machine.
+
+    :return: An int array, the joint state that follows every joint state when the players play their strategies.
+    """
+    if joint.unilateral:
+        return joint.transitions[:, 0]
+    return joint.transitions[np.arange(len(joint.strategy)), joint.strategy]
+
+
+def deviation_next_states(joint: JointStateMachineArrays):
+    """
+    :param joint: An array-backed joint strategy state machine.
+
+    :return: (profiles, next_states), int arrays of shape (n_states, n_deviations), the unilateral deviations from
+    every joint state as in deviation_profiles, and the joint states they lead to.
+    """
+    profiles = deviation_profiles(joint.strategy, joint.players_actions)
+    if joint.unilateral:
+        return profiles, joint.transitions[:, 1:]
+    return profiles, joint.transitions[np.arange(len(joint.strategy))[:, None], profiles]
+
+
+def construct_joint_state_machine(players_actions: list, transition_funcs: list, strategy_funcs: list,
+                                  as_arrays=False, unilateral=False, minimize=False, cache=None, stats=None,
+                                  control=None, return_state_maps=False):
+    """
+    Algorithm 1 in "Subgame-perfect Cooperation in Networks".
+    Find the joint states, transitions, and actions for the joint strategy state machine.
+
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+    :param transition_funcs: transition_funcs[i] is a dict so that transition_funcs[i][q][action] when q is a state and
+    'action' is an action profile returns the state that the state machine of player i goes to from state q after
+    'action'. Action profiles are either joined strings like "CDC" or tuples of actions, see action_profiles.
+    :param strategy_funcs: strategy_funcs[i] is a dict so that strategy_funcs[i][q] returns the action from
+    players_actions[i] to play in state q.
+    :param as_arrays: If True, return the joint machine as a JointStateMachineArrays instead of dicts.
+    :param unilateral: If True, only the on-path action profile and the deviations of a single player from it are
+    explored and stored in every joint state, instead of all the action profiles. This is all that
+    check_SPE_state_machine looks at, but joint states that are reachable only after a simultaneous deviation of
+    several players are not explored.
+    :param minimize: If True, first minimize the state machine of every player, see minimize_state_machines. The
+    joint states are then made of the states that represent the merged states, which keep their original ids.
+    :param cache: An optional StateMachineCache, see state_machine_cache. The joint machine is cached by all the
+    arguments but stats and control, so constructing it again for the same strategies skips the BFS. Nothing is
+    recorded in stats when it comes from the cache.
+    :param return_state_maps: If True, also return the state maps of the minimization, see
+    minimize_players_state_machines, which map the states of the players to the states in the joint states, or None
+    if minimize is False.
+
+    :param stats: An optional PhaseStats, that records the "minimize" and "construct" phases, the number of
+    "joint_states" discovered and the high-water mark of the BFS queue, "bfs_queue_max", see phase_stats.
+    :param control: An optional RunControl, that gets the progress of the BFS and stops it with RunAborted when it is
+    cancelled or over its time or state budget, see run_control. The partial result of RunAborted is the joint machine
+    found so far, where only the joint states that were expanded have transitions.
+
+    transition_funcs[i] may also be a LocalStateMachine, in which case strategy_funcs[i] is ignored and strategy_funcs
+    may be None. Local state machines stay compact only with as_arrays=True, and are expanded to dicts otherwise.
+
+    :return: The joint strategy state machine of all the players, as described in the paper, or (joint machine,
+    state_maps) if return_state_maps is True.
+    """
+    if cache is not None:
+        key = ("construct_joint_state_machine", players_actions, transition_funcs, strategy_funcs, as_arrays,
+               unilateral, minimize, return_state_maps)
+        return cached(cache, key, lambda: construct_joint_state_machine(
+            players_actions, transition_funcs, strategy_funcs, as_arrays, unilateral, minimize, stats=stats,
+            control=control, return_state_maps=return_state_maps))
+    if strategy_funcs is None:
+        strategy_funcs = [None] * len(transition_funcs)
+    if not as_arrays:
+        transition_funcs, strategy_funcs = state_machines_to_dicts(players_actions, transition_funcs, strategy_funcs)
+    state_maps = None
+    if minimize:
+        with phase(stats, "minimize"):
+            transition_funcs, strategy_funcs, state_maps = minimize_players_state_machines(transition_funcs,
+                                                                                           strategy_funcs)
+    if as_arrays:
+        joint = construct_joint_state_machine_arrays(players_actions, transition_funcs, strategy_funcs,
+                                                     unilateral=unilateral, stats=stats, control=control)
+    else:
+        with phase(stats, "construct"):
+            joint = _construct_joint_state_machine_dicts(players_actions, transition_funcs, strategy_funcs,
+                                                         unilateral, stats, control)
+        count(stats, "joint_states", len(joint[0]))
+    if return_state_maps:
+        return joint, state_maps
+    return joint
+
+
+def _construct_joint_state_machine_dicts(players_actions, transition_funcs, strategy_funcs, unilateral, stats,
+                                        control):
+    """
+    The BFS of construct_joint_state_machine, with the joint machine as dicts. The control and the high-water mark of
+    the queue are checked every _CHECKPOINT_STATES expanded joint states, and the state budget whenever it is exceeded.
+    """
+    if unilateral:
+        players_actions = ordered_actions(players_actions)
+
+    num_players = len(players_actions)
+    tuple_keys = has_tuple_keys(transition_funcs[0][0])
+    # the initial states of the state machines are 0
+    initial_state = tuple(0 for i in range(num_players))
+    joint_states = [initial_state]
+    states_queue = [initial_state]
+    joint_transition = {}
+    joint_strategy_func = {}
+
+    def partial():
+        return joint_states, joint_transition, joint_strategy_func
+
+    max_states = state_budget(control)
+    while len(states_queue) != 0:
+        if len(joint_transition) % _CHECKPOINT_STATES == 0 or len(joint_states) > max_states:
+            record_max(stats, "bfs_queue_max", len(states_queue))
+            checkpoint(control, "construct", len(joint_transition), len(states_queue), len(joint_states), partial)
+        q = states_queue.pop(0)
+        q_action = tuple(strategy_funcs[i][q[i]] for i in range(num_players))
+        q_action = q_action if tuple_keys else "".join(q_action)
+        joint_strategy_func[q] = q_action
+
+        q_transitions = {}
+        if unilateral:
+            q_profiles = [q_action] + [replace_action(q_action, i, other) for i in range(num_players)
+                                       for other in players_actions[i] if other != q_action[i]]
+        else:
+            q_profiles = action_profiles(players_actions, tuple_keys)
+        for action in q_profiles:
+            q_transitions[action] = tuple(transition_funcs[i][q[i]][action] for i in range(num_players))
+        joint_transition[q] = q_transitions
+
+        for state in q_transitions.values():
+            if state not in joint_states:
+                joint_states.append(state)
+                states_queue.append(state)
+
+    checkpoint(control, "construct", len(joint_transition), 0, len(joint_states))
+    return joint_states, joint_transition, joint_strategy_func
+
+
+def joint_state_machine_to_arrays(players_actions: list, joint_Q: list, joint_f: dict, joint_s: dict):
+    """
+    Convert a joint strategy state machine from the dicts of construct_joint_state_machine to arrays.
+
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+    :param joint_Q: The states of the joint strategy state machine, where joint_Q[0] is the initial state, and the
+    states of the players are integers.
+    :param joint_f: The transitions function of the joint strategy state machine, with every action profile, or with
+    the on-path profile and the unilateral deviations as built by construct_joint_state_machine(..., unilateral=True).
+    :param joint_s: The strategy function of the joint strategy state machine.
+
+    :return: The same joint strategy state machine as a JointStateMachineArrays, with the joint states in the order of
+    joint_Q.
+    """
+    players_actions = ordered_actions(players_actions)
+    position = {state: k for k, state in enumerate(joint_Q)}
+    profiles = action_profiles(players_actions, has_tuple_keys(joint_f[joint_Q[0]]))
+    unilateral = len(joint_f[joint_Q[0]]) != len(profiles)
+
+    # the unilateral transitions are built in the order of deviation_profiles, so they are stored in their order
+    transitions = np.array([[position[joint_f[state][action]] for action in profiles] if not unilateral else
+                            [position[next_state] for next_state in joint_f[state].values()] for state in joint_Q],
+                           dtype=np.int32).reshape(len(joint_Q), -1)
+    strategy = np.array([encode_action_profile(joint_s[state], players_actions) for state in joint_Q], dtype=np.int64)
+    return JointStateMachineArrays(np.array(joint_Q, dtype=np.int64), transitions, strategy, players_actions,
+                                   unilateral)
+
+
+def local_state_machine_to_dicts(machine: LocalStateMachine, players_actions, tuple_keys=False):
+    """
+    Expand a LocalStateMachine to the dict form, with a transition for every action profile of all the players.
+
+    :param machine: The local state machine.
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+    :param tuple_keys: If True, the action profiles are tuples instead of joined strings, see action_profiles.
+
+    :return: (transition_func, strategy_func), see construct_joint_state_machine.
+    """
+    players_actions = ordered_actions(players_actions)
+    profiles = action_profiles(players_actions, tuple_keys)
+    columns = local_action_profiles(np.arange(len(profiles)), players_actions, machine.watched)
+    transition_func = {q: dict(zip(profiles, row)) for q, row in enumerate(machine.transitions[:, columns].tolist())}
+    own_actions = players_actions[machine.player]
+    return transition_func, {q: own_actions[action] for q, action in enumerate(np.asarray(machine.strategy).tolist())}
+
+
+def state_machines_to_dicts(players_actions, transition_funcs: list, strategy_funcs: list):
+    """
+    Expand the LocalStateMachines among the state machines of the players to the dict form, see
+    local_state_machine_to_dicts, with the same kind of action profiles as the dicts.
+
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+    :param transition_funcs: The transition functions of the single player state machines, or LocalStateMachines.
+    :param strategy_funcs: The strategy functions of the single player state machines, or None.
+
+    :return: (transition_funcs, strategy_funcs), lists of the dict state machines.
+    """
+    if strategy_funcs is None:
+        strategy_funcs = [None] * len(transition_funcs)
+    local = [isinstance(transition_func, LocalStateMachine) for transition_func in transition_funcs]
+    if not any(local):
+        return list(transition_funcs), list(strategy_funcs)
+    tuple_keys = not all(local) and has_tuple_keys(transition_funcs[local.index(False)][0])
+    machines = [local_state_machine_to_dicts(transition_func, players_actions, tuple_keys) if is_local else
+                (transition_func, strategy_func)
+                for transition_func, strategy_func, is_local in zip(transition_funcs, strategy_funcs, local)]
+    return [machine[0] for machine in machines], [machine[1] for machine in machines]
+
+
+def minimize_local_state_machine(machine: LocalStateMachine):
+    """
+    :return: (machine, state_map), the minimized LocalStateMachine, with the states renumbered in BFS order, and an
+    int array, the state that every state is merged into, or -1 if it is unreachable, see minimize_tables.
+    """
+    transitions, strategy, state_map = minimize_tables(machine.transitions, machine.strategy)[:3]
+    return machine._replace(transitions=transitions.astype(np.int32), strategy=strategy), state_map
+
+
+def minimize_players_state_machines(transition_funcs: list, strategy_funcs: list):
+    """
+    Minimize the state machines of all the players, the dicts with minimize_state_machines, which keeps the ids of the
+    states, and the LocalStateMachines with minimize_local_state_machine.
+
+    :return: (transition_funcs, strategy_funcs, state_maps), the minimized state machines, and state_maps[i], the
+    state that every reachable state of player i is merged into, a dict for the dicts and an int array for the
+    LocalStateMachines, where the unreachable states are -1.
+    """
+    transition_funcs = list(transition_funcs)
+    strategy_funcs = list(strategy_funcs) if strategy_funcs is not None else [None] * len(transition_funcs)
+    dict_players = [i for i, transition_func in enumerate(transition_funcs)
+                    if not isinstance(transition_func, LocalStateMachine)]
+    minimized = minimize_state_machines([transition_funcs[i] for i in dict_players],
+                                        [strategy_funcs[i] for i in dict_players])
+    state_maps = [None] * len(transition_funcs)
+    for i, transition_func, strategy_func, state_map in zip(dict_players, *minimized):
+        transition_funcs[i], strategy_funcs[i], state_maps[i] = transition_func, strategy_func, state_map
+    for i, transition_func in enumerate(transition_funcs):
+        if isinstance(transition_func, LocalStateMachine):
+            transition_funcs[i], state_maps[i] = minimize_local_state_machine(transition_func)
+    return transition_funcs, strategy_funcs, state_maps
+
+
+def single_player_tables(players_actions, transition_funcs: list, strategy_funcs: list):
+    """
+    Convert the state machines of the players to arrays indexed by the position of each state.
+
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+    :param transition_funcs: The transition functions of the single player state machines, or LocalStateMachines.
+    :param strategy_funcs: The strategy functions of the single player state machines.
+
+    :return: (state_ids, tables, actions, watched), where state_ids[i] is the list of the states of player i,
+    tables[i][k][a] is the position of the state that player i goes to from state_ids[i][k] after the action profile a,
+    actions[i][k] is the index of the action player i plays in state_ids[i][k], and watched[i] is None, or the watched
+    players of a LocalStateMachine, whose tables are indexed by the local action profiles, see
+    single_player_successors.
+    """
+    dict_funcs = [transition_func for transition_func in transition_funcs
+                  if not isinstance(transition_func, LocalStateMachine)]
+    if dict_funcs:
+        profiles = action_profiles(players_actions, has_tuple_keys(next(iter(dict_funcs[0].values()))))
+    state_ids, tables, actions, watched = [], [], [], []
+    for i in range(len(players_actions)):
+        if isinstance(transition_funcs[i], LocalStateMachine):
+            machine = transition_funcs[i]
+            state_ids.append(list(range(len(machine.transitions))))
+            tables.append(np.asarray(machine.transitions, dtype=np.int32))
+            actions.append(np.asarray(machine.strategy, dtype=np.int64))
+            watched.append(np.asarray(machine.watched, dtype=np.int64))
+            continue
+        ids = list(transition_funcs[i].keys())
+        position = {q: k for k, q in enumerate(ids)}
+        table = np.empty((len(ids), len(profiles)), dtype=np.int32)
+        for k, q in enumerate(ids):
+            table[k] = [position[transition_funcs[i][q][action]] for action in profiles]
+        state_ids.append(ids)
+        tables.append(table)
+        actions.append(np.array([players_actions[i].index(strategy_funcs[i][q]) for q in ids], dtype=np.int64))
+        watched.append(None)
+    return state_ids, tables, actions, watched
+
+
+def single_player_successors(players_actions, tables, watched, local_states, profiles):
+    """
+    :param players_actions: The ordered actions of every player.
+    :param tables: watched: The tables of the players, see single_player_tables.
+    :param local_states: An int array of shape (n_rows, n_players), the positions of the states of the players.
+    :param profiles: An int array of shape (n_rows, n_columns) or (1, n_columns), the action profiles after which to
+    find the successors.
+
+    :return: An int32 array of shape (n_rows, n_columns, n_players), the positions of the states that the players go to.
+    """
+    return np.stack([tables[i][local_states[:, i, None], profiles if watched[i] is None else
+                               local_action_profiles(profiles, players_actions, watched[i])]
+                     for i in range(len(tables))], axis=-1)
+
+
+def construct_joint_state_machine_arrays(players_actions: list, transition_funcs: list, strategy_funcs: list,
+                                         unilateral=False, stats=None, control=None):
+    """
+    Algorithm 1 in "Subgame-perfect Cooperation in Networks", with an array-backed output.
+    The joint states are discovered in BFS order, so joint state 0 is the initial state.
+
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+    :param transition_funcs: transition_funcs[i] is a dict so that transition_funcs[i][q][action] when q is a state and
+    'action' is an action profile returns the state that the state machine of player i goes to from state q after
+    'action', see construct_joint_state_machine.
+    :param strategy_funcs: strategy_funcs[i] is a dict so that strategy_funcs[i][q] returns the action from
+    players_actions[i] to play in state q.
+    :param unilateral: If True, explore and store only the on-path action profile and the unilateral deviations from
+    it in every joint state, see construct_joint_state_machine.
+    :param stats: An optional PhaseStats, see construct_joint_state_machine.
+    :param control: An optional RunControl, see construct_joint_state_machine, which is checked between the chunks of
+    the BFS.
+    The transitions of the partial result of RunAborted have rows only for the first joint states, that were expanded.
+
+    :return: The joint strategy state machine as a JointStateMachineArrays.
+    """
+    with phase(stats, "construct"):
+        joint = _construct_joint_state_machine_arrays(players_actions, transition_funcs, strategy_funcs, unilateral,
+                                                      stats, control)
+    count(stats, "joint_states", len(joint.strategy))
+    return joint
+
+
+def _construct_joint_state_machine_arrays(players_actions, transition_funcs, strategy_funcs, unilateral, stats,
+                                          control):
+    """
+    The BFS of construct_joint_state_machine_arrays, which expands at most _EXPAND_CHUNK successor entries at a time,
+    so the memory of a step and the time between the checkpoints are bounded even when a level of the BFS is huge.
+    The state budget is checked as the new joint states of a chunk are added, so the BFS stops at the first joint
+    state over it.
+    """
+    players_actions = ordered_actions(players_actions)
+    num_players = len(players_actions)
+    strides = action_profile_strides(players_actions)
+    state_ids, tables, actions, watched = single_player_tables(players_actions, transition_funcs, strategy_funcs)
+    all_profiles = np.arange(np.prod([len(actions) for actions in players_actions]))[None] if not unilateral else None
+    num_columns = 1 + len(deviation_players(players_actions)) if unilateral else all_profiles.shape[1]
+
+    step = max(1, _EXPAND_CHUNK // (num_columns * num_players))
+
+    # the initial states of the state machines are 0
+    initial_state = np.array([[state_ids[i].index(0) for i in range(num_players)]], dtype=np.int32)
+    key_dtype = np.dtype((np.void, 4 * num_players))
+    known = {initial_state[0].tobytes(): 0}
+    local_states = [initial_state]
+    queue = deque(local_states)
+    transition_rows = []
+    expanded = 0
+    max_states = state_budget(control)
+
+    def joint_machine():
+        found_states = np.concatenate(local_states)
+        states = np.stack([np.asarray(state_ids[i])[found_states[:, i]] for i in range(num_players)], axis=-1)
+        strategy = sum(actions[i][found_states[:, i]] * strides[i] for i in range(num_players))
+        transitions = np.concatenate(transition_rows) if transition_rows else np.empty((0, num_columns), np.int32)
+        return JointStateMachineArrays(states, transitions, strategy, players_actions, unilateral)
+
+    while len(queue) != 0:
+        record_max(stats, "bfs_queue_max", len(known) - expanded)
+        checkpoint(control, "construct", expanded, len(known) - expanded, len(known), joint_machine)
+        frontier = queue.popleft()
+        if len(frontier) > step:
+            queue.appendleft(frontier[step:])
+            frontier = frontier[:step]
+        if unilateral:
+            profiles = sum(actions[i][frontier[:, i]] * strides[i] for i in range(num_players))
+            profiles = np.column_stack([profiles, deviation_profiles(profiles, players_actions)])
+        else:
+            profiles = all_profiles
+        successors = single_player_successors(players_actions, tables, watched, frontier, profiles)
+        rows = np.ascontiguousarray(successors.reshape(-1, num_players))
+        unique_rows, inverse = np.unique(rows.view(key_dtype).ravel(), return_inverse=True)
+
+        unique_ids = np.empty(len(unique_rows), dtype=np.int32)
+        new_states = []
+        for k, key in enumerate(unique_rows.tolist()):
+            state = known.get(key)
+            if state is None:
+                state = known[key] = len(known)
+                new_states.append(key)
+                if len(known) > max_states:
+                    break
+            unique_ids[k] = state
+        if len(new_states) != 0:
+            local_states.append(np.frombuffer(b"".join(new_states), dtype=np.int32).reshape(-1, num_players))
+        if len(known) > max_states:
+            # the chunk isn't expanded, and the partial result has the joint states found until the budget ran out
+            checkpoint(control, "construct", expanded, len(known) - expanded, len(known), joint_machine)
+        transition_rows.append(unique_ids[inverse.ravel()].reshape(successors.shape[:2]))
+        expanded += len(frontier)
+        if len(new_states) != 0:
+            queue.append(local_states[-1])
+
+    checkpoint(control, "construct", len(known), 0, len(known))
+    return joint_machine()
@@ -1,52 +1,191 @@
-from check_SPE_state_machine import calc_long_term_util
-from build_joint_state_machine import construct_joint_state_machine
-import itertools
-
-
-def calc_BR_state_machine_player_i_ver(player_i, transitions_funcs: list, strategy_funcs: list,
-                                       utilities_by_actions: list, EPSILON=0.01):
-    """
-    Algorithm 4 in "Subgame-perfect Cooperation in Networks".
-
-    :param player_i: the player to calculate his best-response.
-    :param transitions_funcs: a list of the transitions functions without one for player_i.
-    :param strategy_funcs: a list of the strategy functions without one for player_i.
-    :param utilities_by_actions: The utilities of the players in the one-step game.
-    :param EPSILON: 1-DELTA.
-
-    :return: The joint strategy state machine that gives each player his original strategy, except player_i, that
-    the joint machine gives him his best-response strategy to the other players' strategies.
-    """
-    N = len(utilities_by_actions)  # number of players
-    actions_sets = [{"C", "D"} for i in range(N)]  # the possible actions for each player are "C" and "D"
-    single_transition = {}
-    for element in itertools.product(*actions_sets):
-        action = "".join(element)
-        single_transition[action] = 0
-
-    transitions_funcs = transitions_funcs[:player_i] + [{0: single_transition}] + transitions_funcs[player_i:]
-    strategy_funcs = strategy_funcs[:player_i] + [{0: "D"}] + strategy_funcs[player_i:]
-
-    joint_Q, joint_f, joint_s = construct_joint_state_machine(actions_sets, transitions_funcs, strategy_funcs)
-
-    dif_act = {
-        "C": "D",
-        "D": "C",
-    }
-
-    # the iteration that improves player_i strategy each step
-    for cnt in range(len(joint_Q)):
-        DELTA = 1 - EPSILON
-        long_term_utilities = calc_long_term_util(EPSILON, joint_Q, utilities_by_actions, joint_f, joint_s)
-        for state in joint_Q:
-            curr_util = long_term_utilities[state][player_i]  # the utility of the current action
-            action = joint_s[state]
-            action = action[:player_i] + dif_act[action[player_i]] + action[player_i + 1:]
-
-            one_move_util = utilities_by_actions[player_i][action]
-            rest_game_util = long_term_utilities[joint_f[state][action]][player_i]
-            diff_util = one_move_util + DELTA * rest_game_util  # the utility of the different action
-            if diff_util > curr_util:
-                joint_s[state] = action  # change player_i action to the new action
-
-    return joint_Q, joint_f, joint_s
+from check_SPE_state_machine import on_path_ancestors, on_path_predecessors, on_path_structure, \
+    propagate_long_term_util, update_long_term_util, utilities_to_array
+from build_joint_state_machine import construct_joint_state_machine, action_profile_strides, action_profiles, \
+    has_tuple_keys, ordered_actions, replace_action
+from minimize_state_machine import minimize_state_machine, minimize_tables
+from phase_stats import count, phase
+from run_control import RunAborted, checkpoint
+import numpy as np
+
+
+def calc_BR_state_machine_player_i_ver(player_i, transitions_funcs: list, strategy_funcs: list,
+                                       utilities_by_actions: list, EPSILON=0.01, as_arrays=False,
+                                       players_actions=None, single_player=False, stats=None, control=None):
+    """
+    Algorithm 4 in "Subgame-perfect Cooperation in Networks".
+
+    :param player_i: the player to calculate his best-response.
+    :param transitions_funcs: a list of the transitions functions without one for player_i.
+    :param strategy_funcs: a list of the strategy functions without one for player_i.
+    :param utilities_by_actions: The utilities of the players in the one-step game.
+    :param EPSILON: 1-DELTA.
+    :param as_arrays: If True, build and return the joint machine as a JointStateMachineArrays.
+    :param players_actions: players_actions[i] is the list of possible actions for player i, "C" and "D" for every
+    player by default. Player_i starts from his last action, in the order of ordered_actions.
+    :param single_player: If True, return only the best-response of player_i, as a minimized single-player state
+    machine in the same format as the other players' state machines, see best_response_state_machine.
+    :param stats: An optional PhaseStats, that records the "best_response" phase, the number of "br_iterations" until
+    the best-response converged and of "br_switches" of an action in a joint state, besides the phases and counters of
+    construct_joint_state_machine, see phase_stats.
+    :param control: An optional RunControl, that gets the progress of the construction and of the iterations, and
+    stops them with RunAborted when they are cancelled or over budget, see run_control. If the iterations stop, the
+    partial result of RunAborted is the joint strategy state machine with the actions of player_i improved so far.
+
+    :return: The joint strategy state machine that gives each player his original strategy, except player_i, that
+    the joint machine gives him his best-response strategy to the other players' strategies. If single_player is
+    True, (transition_func, strategy_func), the state machine of player_i's best-response.
+    """
+    N = len(utilities_by_actions)  # number of players
+    if players_actions is None:
+        players_actions = [{"C", "D"} for i in range(N)]  # the possible actions for each player are "C" and "D"
+    actions_sets = ordered_actions(players_actions)
+    tuple_keys = len(transitions_funcs) != 0 and has_tuple_keys(next(iter(transitions_funcs[0].values())))
+    single_transition = {action: 0 for action in action_profiles(actions_sets, tuple_keys)}
+
+    transitions_funcs = transitions_funcs[:player_i] + [{0: single_transition}] + transitions_funcs[player_i:]
+    strategy_funcs = strategy_funcs[:player_i] + [{0: actions_sets[player_i][-1]}] + strategy_funcs[player_i:]
+
+    if as_arrays:
+        joint = construct_joint_state_machine(actions_sets, transitions_funcs, strategy_funcs, as_arrays=True,
+                                              stats=stats, control=control)
+        with phase(stats, "best_response"):
+            joint = _calc_BR_joint_arrays(player_i, joint, utilities_by_actions, EPSILON, stats, control)
+        return best_response_state_machine_arrays(player_i, joint, tuple_keys) if single_player else joint
+
+    joint_Q, joint_f, joint_s = construct_joint_state_machine(actions_sets, transitions_funcs, strategy_funcs,
+                                                              stats=stats, control=control)
+
+    # every action of player_i in every state, and where it leads
+    own_actions = actions_sets[player_i]
+    position = {s: k for k, s in enumerate(joint_Q)}
+    state_actions = [[replace_action(joint_s[state], player_i, own_action) for own_action in own_actions]
+                     for state in joint_Q]
+    next_states = np.array([[position[joint_f[state][action]] for action in actions]
+                            for state, actions in zip(joint_Q, state_actions)], dtype=np.int64)
+    stage_utils = np.array([[utilities_by_actions[player_i][action] for action in actions]
+                            for actions in state_actions], dtype=float)
+    current = np.array([own_actions.index(joint_s[state][player_i]) for state in joint_Q], dtype=np.int64)
+
+    def improve(best):
+        for k in np.flatnonzero(best != current):
+            joint_s[joint_Q[k]] = state_actions[k][best[k]]  # change player_i action to the new action
+        return joint_Q, joint_f, joint_s
+
+    with phase(stats, "best_response"):
+        try:
+            best = _best_response_actions(EPSILON, len(joint_Q), current, next_states, stage_utils, stats, control)
+        except RunAborted as aborted:
+            aborted.partial = improve(aborted.partial)
+            raise
+    improve(best)
+
+    if single_player:
+        return best_response_state_machine(player_i, joint_Q, joint_f, joint_s)
+    return joint_Q, joint_f, joint_s
+
+
+def best_response_state_machine(player_i, joint_Q, joint_f, joint_s):
+    """
+    Project the joint strategy state machine of a best-response on player_i. The states of player_i's machine are
+    the joint states, which follow the states of the other players, and the result is minimized so it is usually much
+    smaller than the joint machine, see minimize_state_machine.
+
+    :param player_i: The player whose best-response is in the joint strategy state machine.
+    :param joint_Q: The states of the joint strategy state machine, where joint_Q[0] is the initial state.
+    :param joint_f: The transitions function of the joint strategy state machine.
+    :param joint_s: The strategy function of the joint strategy state machine.
+
+    :return: (transition_func, strategy_func), the state machine of player_i with the initial state 0, which can be
+    given to construct_joint_state_machine with the state machines of the other players.
+    """
+    transition_func = {state: joint_f[state] for state in joint_Q}
+    strategy_func = {state: joint_s[state][player_i] for state in joint_Q}
+    return minimize_state_machine(transition_func, strategy_func, joint_Q[0])[:2]
+
+
+def best_response_state_machine_arrays(player_i, joint, tuple_keys=False):
+    """
+    Project an array-backed joint strategy state machine on player_i, see best_response_state_machine.
+
+    :param tuple_keys: If True, the action profiles in the transition function are tuples instead of joined strings.
+
+    :return: (transition_func, strategy_func), the state machine of player_i with the initial state 0.
+    """
+    own_actions = joint.players_actions[player_i]
+    stride = action_profile_strides(joint.players_actions)[player_i]
+    table, outputs = minimize_tables(joint.transitions, (joint.strategy // stride) % len(own_actions))[:2]
+    profiles = action_profiles(joint.players_actions, tuple_keys)
+    transition_func = {q: dict(zip(profiles, row)) for q, row in enumerate(table.tolist())}
+    strategy_func = {q: own_actions[action] for q, action in enumerate(outputs.tolist())}
+    return transition_func, strategy_func
+
+
+def _best_response_actions(EPSILON, max_iterations, actions, next_states, stage_utils, stats=None, control=None):
+    """
+    The iteration of Algorithm 4, where player_i switches to his best other action in every state in which it is
+    better than his current action, until no action switches. All the actions of all the states are compared at once,
+    and after every iteration only the long term utilities of the states whose path of play passes through a switched
+    state are recalculated.
+
+    :param EPSILON: 1-DELTA.
+    :param max_iterations: The maximal number of iterations.
+    :param actions: An int array, the index of the current action of player_i in every joint state.
+    :param next_states: An int array of shape (n_states, n_actions), the joint state that follows every joint state
+    when player_i plays each of his actions.
+    :param stage_utils: An array of shape (n_states, n_actions), the one-step utility of player_i in every joint state
+    when he plays each of his actions.
+    :param stats: An optional PhaseStats for the "br_iterations" and "br_switches" counters.
+    :param control: An optional RunControl, which is checked before every iteration. The partial result of
+    RunAborted is the actions of player_i improved so far.
+
+    :return: An int array, the index of the action of player_i in every joint state in his best-response.
+    """
+    DELTA = 1 - EPSILON
+    states = np.arange(len(actions))
+    actions = actions.copy()
+    long_term_util = propagate_long_term_util([EPSILON], stage_utils[states, actions, None],
+                                              on_path_structure(next_states[states, actions], stats))[0]
+
+    # the iteration that improves player_i strategy each step
+    for cnt in range(max_iterations):
+        checkpoint(control, "best_response", cnt, partial=actions.copy)
+        count(stats, "br_iterations")
+        curr_util = long_term_util[:, 0]  # the utility of the current action
+        diff_util = stage_utils + DELTA * long_term_util[next_states, 0]  # the utilities of all the actions
+        diff_util[states, actions] = -np.inf
+        best = np.argmax(diff_util, axis=1)
+        better = np.flatnonzero(diff_util[states, best] > curr_util)
+        if len(better) == 0:
+            checkpoint(control, "best_response", cnt + 1, 0)
+            break
+
+        count(stats, "br_switches", len(better))
+        actions[better] = best[better]
+        on_path = next_states[states, actions]
+        affected = on_path_ancestors(better, on_path_predecessors(on_path))
+        update_long_term_util(EPSILON, long_term_util, on_path, stage_utils[states, actions, None], affected)
+
+    return actions
+
+
+def _calc_BR_joint_arrays(player_i, joint, utilities_by_actions, EPSILON, stats=None, control=None):
+    """
+    Algorithm 4 on an array-backed joint strategy state machine, see _best_response_actions.
+
+    :return: The joint strategy state machine with the best-response actions of player_i, as a JointStateMachineArrays.
+    """
+    utilities = utilities_to_array(utilities_by_actions, joint.players_actions)
+    stride = action_profile_strides(joint.players_actions)[player_i]
+    num_actions = len(joint.players_actions[player_i])
+    states = np.arange(len(joint.strategy))
+    own_action = (joint.strategy // stride) % num_actions
+
+    # the action profile of every joint state with each action of player_i
+    profiles = joint.strategy[:, None] + (np.arange(num_actions) - own_action[:, None]) * stride
+    try:
+        best = _best_response_actions(EPSILON, len(states), own_action, joint.transitions[states[:, None], profiles],
+                                      utilities[player_i][profiles], stats, control)
+    except RunAborted as aborted:  # the partial result is the joint machine with the actions improved so far
+        aborted.partial = joint._replace(strategy=profiles[states, aborted.partial])
+        raise
+    return joint._replace(strategy=profiles[states, best])
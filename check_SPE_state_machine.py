@@ -1,183 +1,1148 @@
-import numpy as np
-import itertools
-from build_joint_state_machine import construct_joint_state_machine
-
-
-def find_cycles(graph):
-    """
-    Finds cycles in a directed graph, using DFS.
-
-    :param graph:  The directed graph represented as a dictionary where keys are nodes and values are their neighbors.
-    :return:  A list of lists where each sublist represents a cycle in the graph.
-    """
-    visited_nodes = set()
-    current_path = []
-    cycles = []  # The final result, a list of cycles
-
-    def depth_first_search(node):
-        """
-        Depth-first search.
-        """
-        if node in visited_nodes:
-            # If the node has already been visited, it means we have found a cycle
-            if node in current_path:
-                start_index = current_path.index(node)
-                cycles.append(current_path[start_index:])
-            return
-
-        # Mark the node as visited
-        visited_nodes.add(node)
-
-        current_path.append(node)
-        depth_first_search(graph[node])
-        current_path.pop()
-
-    for node_out in graph:
-        if node_out not in visited_nodes:
-            depth_first_search(node_out)
-
-    return cycles
-
-
-def calc_long_term_util(EPSILON, joint_states, utilities_by_actions, transition_funcs, strategy_funcs):
-    """
-    Algorithm 2 in "Subgame-perfect Cooperation in Networks".
-    The function calculate the long term utility as was defined in the paper.
-
-    :param EPSILON: 1-DELTA.
-    :param joint_states: The states of the joint strategy state machine.
-    :param utilities_by_actions: The utilities for the players in the one-step game.
-    :param strategy_funcs: The strategy functions of the joint strategy state machine.
-    :param transition_funcs: The transitions function of the joint strategy state machine.
-
-    :return: The long term utility function.
-    """
-    num_players = len(joint_states[0])
-    DELTA = 1 - EPSILON
-    graph = {s: transition_funcs[s][strategy_funcs[s]] for s in joint_states}
-    cycles = find_cycles(graph)
-
-    long_term_util = {s: np.zeros(3) for s in joint_states}
-    remaining_states = joint_states.copy()
-    calculated_states = []
-    # Need to calculate the utilities of the cycles... (A + delta * B + delta ^ 2 * C + ...) / (1 - delta ^ length)
-    for c in cycles:
-        init_node = c[0]
-        util_sum = np.zeros(num_players)
-        for node in range(len(c)):
-            util_sum += (DELTA ** node) * np.array(
-                [utilities_by_actions[i][strategy_funcs[c[node]]] for i in range(num_players)])
-        long_term_util[init_node] = util_sum / (1 - (DELTA ** len(c)))
-        remaining_states.remove(init_node)
-        calculated_states.append(init_node)
-
-    # calculate the long term utilities of each player in each state
-    while len(remaining_states) != 0:
-        for state in remaining_states:
-            action = strategy_funcs[state]
-            if transition_funcs[state][action] not in calculated_states:
-                continue
-            cur_action_util = [utilities_by_actions[i][action] for i in range(num_players)]
-            long_term_util[state] = np.array(cur_action_util) + DELTA * long_term_util[transition_funcs[state][action]]
-            remaining_states.remove(state)
-            calculated_states.append(state)
-    return long_term_util
-
-
-def check_SPE_state_machine(joint_states: list, transition_funcs: dict, strategy_funcs: dict,
-                            utils_by_actions: list, EPSILON=0.01):
-    """
-    Given a joint strategy state machine, when each player has the same set of actions: {"C", "D"}, check whether the
-    strategies of the joint state machine represent a subgame perfect equilibrium, and if not print the possible
-    deviations in the state machine.
-
-    :param joint_states: The state of the joint strategy state machine.
-    :param transition_funcs: A list of state transition functions for each player.
-    :param strategy_funcs: A list of state-action mappings for each player.
-    :param utils_by_actions: The utilities of the players in the one-step game.
-    :param EPSILON: 1-DELTA.
-
-    :return: True if the strategies are SPE, otherwise False.
-    """
-    DELTA = 1 - EPSILON
-    long_term_util = calc_long_term_util(EPSILON, joint_states, utils_by_actions, transition_funcs, strategy_funcs)
-    num_players = len(joint_states[0])
-
-    # check deviations in each state for each player
-    dif_act = {
-        "C": "D",
-        "D": "C",
-    }
-
-    SPE = True
-    for state in joint_states:
-        eq_utility = long_term_util[state]
-
-        for i in range(num_players):
-            action = strategy_funcs[state]
-            action = action[:i] + dif_act[action[i]] + action[i + 1:]
-            dif_act_utility = [utils_by_actions[j][action] for j in range(num_players)]
-            if dif_act_utility[i] + DELTA * long_term_util[transition_funcs[state][action]][i] > eq_utility[i]:
-                print("in state:", state, "player", i, "dont play BR")
-                SPE = False
-
-    if SPE:
-        print("SPE")
-    else:
-        print("not SPE")
-    return SPE
-
-
-def calculate_single_player_utility_by_graph(n: int, games: dict, player: int, players_actions):
-    """
-    Given a graph, a player, and the games on each of his nodes, calculate the utilities matching for every possible
-    combinations of actions of all the players in the (one shot) game.
-
-    :param n: The number of players.
-    :param games: A dictionary mapping  edges to the matching two player game.
-    :param player: The player we want to calculate his utilities.
-    :param players_actions: players_actions[i] is a list of possible actions for player i.
-
-    :return: The utilities for the given player for every possible combination of actions in the one shot game.
-    """
-    utilities = {}
-    for element in itertools.product(*players_actions):
-        action = "".join(element)
-        act_utility = 0
-        for k in range(n):
-            if k != player and (k, player) in games:
-                act_utility += games[(k, player)][action[player] + action[k]]
-        utilities[action] = act_utility
-
-    return utilities
-
-
-def check_SPE_state_machine_by_graph(n: int, games: dict, transition_funcs, strategy_funcs, EPSILON=0.01):
-    """
-    Algorithm 3 in "Subgame-perfect Cooperation in Networks".
-    Given n players, a dictionary that contains the edges in the graph of the players and the two player game
-    for every edge, also given a joint strategy state machine, the function returns whether the strategies are SPE
-    in the repeated game on the graph.
-
-    :param n: the number of players.
-    :param games: a dict with keys as edges (i,j) in the graph, and the values are the utility 'matrices' of player i from
-    the symmetric game where each of i,j choose an action from {C,D}.
-    The 'matrices' are also dicts with the entries as "CC", "CD", "DC" and "DD".
-    meaning: games[(1, 2)]["CD"] gives the utility for a player when he plays C and the other player plays D.
-    :param transition_funcs: the transitions of the single player state machine strategy.
-    :param strategy_funcs: the actions of the single player state machine strategy.
-    :param EPSILON: 1 - DELTA, the discount factor.
-
-    :return: True if the strategies are SPE in the DELTA-discounted game of the game constructed from the sum of the
-    utilities of the games on each edge.
-    """
-    run_on = list(games.keys())
-    for edge in run_on:
-        games[(edge[1], edge[0])] = games[edge]
-
-    actions_sets = [{"C", "D"} for i in range(n)]
-    utilities = [calculate_single_player_utility_by_graph(n, games, i, actions_sets) for i in range(n)]
-
-    joint_Q, joint_f, joint_s = construct_joint_state_machine(actions_sets, transition_funcs, strategy_funcs)
-
-    return check_SPE_state_machine(joint_Q, joint_f, joint_s, utilities, EPSILON=EPSILON)
+import numpy as np
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple
+from build_joint_state_machine import (JointStateMachineArrays, action_profiles, construct_joint_state_machine,
+                                       deviation_players, deviation_next_states, deviation_profiles,
+                                       encode_action_profile, has_tuple_keys, local_action_profiles,
+                                       on_path_next_states, ordered_actions)
+from minimize_state_machine import refine_partition
+from phase_stats import count, phase, record_histogram
+from run_control import RunAborted, checkpoint
+from reduce_symmetric_state_machine import OrbitStateMachine, construct_orbit_state_machine, strategy_automorphisms
+from state_machine_cache import cached
+
+
+def find_cycles(graph):
+    """
+    Finds cycles in a directed graph where every node has a single neighbor, by walking from every node until a
+    visited node is reached. The walk is iterative, so long paths don't hit the recursion limit.
+
+    :param graph:  The directed graph represented as a dictionary where keys are nodes and values are their neighbors.
+    :return:  A list of lists where each sublist represents a cycle in the graph.
+    """
+    visited_nodes = set()
+    cycles = []  # The final result, a list of cycles
+
+    for node_out in graph:
+        current_path = {}  # the nodes of the current walk and their positions in it
+        node = node_out
+        while node not in visited_nodes:
+            visited_nodes.add(node)
+            current_path[node] = len(current_path)
+            node = graph[node]
+        # If the walk reached a node of its own path, it means we have found a cycle
+        if node in current_path:
+            cycles.append(list(current_path)[current_path[node]:])
+
+    return cycles
+
+
+class NeighborhoodUtilities(NamedTuple):
+    """
+    The utilities of the players in a one-step network game, where the utility of every player depends only on his
+    own action and the actions of his neighbors. Every player has a table over the action profiles of his neighborhood,
+    instead of a dict over all the action profiles.
+
+    players_actions: The ordered actions of every player, as in JointStateMachineArrays.players_actions.
+    neighbors: neighbors[i] is an int array, player i followed by the players his utility depends on.
+    tables: tables[i] is an array of the utilities of player i, indexed by the action profiles of neighbors[i],
+    encoded like the action profiles of all the players, see encode_action_profile.
+    """
+    players_actions: tuple
+    neighbors: tuple
+    tables: tuple
+
+    def evaluate(self, players, profiles):
+        """
+        :param players: An int array of players.
+        :param profiles: An int array of encoded action profiles of all the players, broadcast with players.
+
+        :return: An array, the utility of every player from the matching action profile.
+        """
+        players, profiles = np.broadcast_arrays(np.asarray(players), np.asarray(profiles, dtype=np.int64))
+        utilities = np.empty(players.shape)
+        for i in np.unique(players).tolist():
+            mask = players == i
+            utilities[mask] = self.tables[i][local_action_profiles(profiles[mask], self.players_actions,
+                                                                   self.neighbors[i])]
+        return utilities
+
+
+def utilities_to_array(utilities_by_actions, players_actions):
+    """
+    Convert the utilities of the one-step game to an array indexed by the encoded action profiles.
+
+    :param utilities_by_actions: utilities_by_actions[i] is a dict from action profiles (joined strings like "CDC" or
+    tuples of actions) to the utility of player i, or a NeighborhoodUtilities, or an array of shape
+    (n_players, n_profiles) that is returned as is.
+    :param players_actions: The ordered actions of every player, as in JointStateMachineArrays.players_actions.
+
+    :return: An array of shape (n_players, n_profiles), so that [i][a] is the utility of player i from the profile a.
+    """
+    if isinstance(utilities_by_actions, np.ndarray):
+        return utilities_by_actions
+    if isinstance(utilities_by_actions, NeighborhoodUtilities):
+        num_profiles = int(np.prod([len(actions) for actions in players_actions]))
+        return utilities_by_actions.evaluate(np.arange(len(players_actions))[:, None], np.arange(num_profiles))
+    return np.array([[utility[action] for action in action_profiles(players_actions, has_tuple_keys(utility))]
+                     for utility in utilities_by_actions], dtype=float)
+
+
+def profile_utilities(utilities_by_actions, players_actions, players, profiles):
+    """
+    Find the utilities of some players from some action profiles, without a table over all the action profiles when
+    the utilities are NeighborhoodUtilities.
+
+    :param utilities_by_actions: The utilities of the players in the one-step game, see utilities_to_array.
+    :param players_actions: The ordered actions of every player, as in JointStateMachineArrays.players_actions.
+    :param players: An int array of players.
+    :param profiles: An int array of encoded action profiles, broadcast with players.
+
+    :return: An array, the utility of every player from the matching action profile.
+    """
+    if isinstance(utilities_by_actions, NeighborhoodUtilities):
+        return utilities_by_actions.evaluate(players, profiles)
+    return utilities_to_array(utilities_by_actions, players_actions)[players, profiles]
+
+
+class OnPathStructure(NamedTuple):
+    """
+    The on-path graph of a joint strategy state machine, where every joint state has a single edge to the joint state
+    that follows it when the players play their strategies. The structure doesn't depend on DELTA, so it is found once
+    and reused for every discount factor.
+
+    Every state leads to exactly one cycle, whose smallest state is its root. Cutting the edge that leaves every root
+    turns the graph into trees that hang from the roots, and depths[s] is the number of steps from s to its root.
+
+    next_states: int array, next_states[s] is the joint state that follows s.
+    roots: int array, the root of every cycle.
+    cycle_lengths: int array, the length of every cycle.
+    depths: int array, the number of steps from every state to the root of its cycle, 0 for the roots.
+    """
+    next_states: np.ndarray
+    roots: np.ndarray
+    cycle_lengths: np.ndarray
+    depths: np.ndarray
+
+
+def on_path_structure(next_states, stats=None):
+    """
+    Decompose the on-path graph, a functional graph, into its cycles and the trees that lead into them.
+    Every step below follows all the states at once and doubles the number of steps it looks ahead, so long chains
+    cost O(n_states * log(length)) array operations, without recursion and without a Python loop over the states.
+    The peak memory is a few int arrays of n_states, 32 MB at 10^6 states.
+
+    :param next_states: An int array, next_states[s] is the joint state that follows s on the path of play.
+    :param stats: An optional PhaseStats, that records the "on_path_structure" phase, the number of "cycles" and the
+    histogram of the "cycle_lengths", see phase_stats.
+
+    :return: The OnPathStructure of the graph.
+    """
+    with phase(stats, "on_path_structure"):
+        next_states = np.asarray(next_states, dtype=np.int64)
+        num_states = len(next_states)
+
+        # after at least num_states steps every state is on a cycle, and every state of a cycle is reached this way
+        jump = next_states
+        steps = 1
+        while steps < num_states:
+            jump = jump[jump]
+            steps *= 2
+        on_cycle = np.zeros(num_states, dtype=bool)
+        on_cycle[jump] = True
+        cycle_states = np.flatnonzero(on_cycle)
+
+        # the root of every cycle is its smallest state
+        label = np.arange(num_states)
+        jump = next_states.copy()
+        steps = 1
+        while steps < len(cycle_states):
+            label[cycle_states] = np.minimum(label[cycle_states], label[jump[cycle_states]])
+            jump[cycle_states] = jump[jump[cycle_states]]
+            steps *= 2
+        roots = cycle_states[label[cycle_states] == cycle_states]
+
+        # the number of steps to the root, summed along doubling jumps that stop at the roots
+        jump = next_states.copy()
+        jump[roots] = roots
+        depths = np.ones(num_states, dtype=np.int64)
+        depths[roots] = 0
+        while len(roots) != 0 and not np.all(depths[jump] == 0):
+            depths = depths + depths[jump]
+            jump = jump[jump]
+
+        cycle_lengths = depths[next_states[roots]] + 1
+    count(stats, "cycles", len(roots))
+    record_histogram(stats, "cycle_lengths", cycle_lengths)
+    return OnPathStructure(next_states, roots, cycle_lengths, depths)
+
+
+def propagate_long_term_util(EPSILONS, stage_utils, structure: OnPathStructure):
+    """
+    Algorithm 2 in "Subgame-perfect Cooperation in Networks", for many discount factors at once.
+
+    The utility along the path from every state to its root, A(s) = u(s) + DELTA * u(next(s)) + ..., is built by
+    doubling: joining the sums of two consecutive paths gives the sum of a path twice as long. The long term utilities
+    of the roots are the sums over their cycles divided by (1 - DELTA ^ length), and those of the other states are
+    A(s) + DELTA ^ depth(s) * long_term_util(root).
+
+    The doubling takes O(n_states * log(max depth)) operations, and is done in place on rows of n_eps * n_players
+    values, so the peak memory is about two arrays of the size of the result and two of shape (n_states, n_eps). At
+    10^6 states and 3 players it was measured at 76 MB for one discount factor (0.5 s) and 496 MB for 8 (3-5 s),
+    besides the 32 MB of on_path_structure, both for a random on-path graph and for a single chain of 10^6 states.
+
+    :param EPSILONS: A vector of values of 1-DELTA.
+    :param stage_utils: An array of shape (n_states, n_players), the utilities of the players in the one-step game
+    from the actions played in each state.
+    :param structure: The OnPathStructure of the joint strategy state machine.
+
+    :return: An array of shape (n_eps, n_states, n_players), the long term utility of each player in each state for
+    each discount factor.
+    """
+    DELTAS = 1 - np.asarray(EPSILONS, dtype=float).reshape(-1)
+    roots = structure.roots
+    num_states = len(stage_utils)
+
+    # the states are the rows, so following the jumps moves whole rows of n_eps * n_players values
+    path_util = np.repeat(np.asarray(stage_utils, dtype=float)[:, None, :], len(DELTAS), axis=1)
+    path_util[roots] = 0
+    path_discount = np.repeat(DELTAS[None, :], num_states, axis=0)
+    path_discount[roots] = 1
+    jump = structure.next_states.copy()
+    jump[roots] = roots
+
+    # mode="clip" lets np.take write to out without buffering, all the indices are valid
+    scratch = np.empty_like(path_util)
+    steps = 1
+    max_depth = structure.depths.max(initial=0)
+    while steps < max_depth:
+        np.take(path_util, jump, axis=0, out=scratch, mode="clip")
+        scratch *= path_discount[:, :, None]
+        path_util += scratch
+        path_discount *= path_discount[jump]
+        jump = jump[jump]
+        steps *= 2
+
+    # Need to calculate the utilities of the cycles... (A + delta * B + delta ^ 2 * C + ...) / (1 - delta ^ length)
+    cycle_util = stage_utils[roots][:, None, :] + DELTAS[None, :, None] * path_util[structure.next_states[roots]]
+    root_util = cycle_util / (1 - DELTAS[None, :] ** structure.cycle_lengths[:, None])[:, :, None]
+
+    # calculate the long term utilities of each player in each state, where every jump now ends at its root
+    root_index = np.zeros(num_states, dtype=np.int64)
+    root_index[roots] = np.arange(len(roots))
+    np.take(root_util, root_index[jump], axis=0, out=scratch, mode="clip")
+    scratch *= path_discount[:, :, None]
+    path_util += scratch
+    return path_util.transpose(1, 0, 2)
+
+
+def propagate_long_term_util_permuted(EPSILONS, stage_utils, next_states, permutations):
+    """
+    Algorithm 2 for a machine whose on-path transitions also permute the players, like an OrbitStateMachine, where
+    long_term_util(s) = stage_utils(s) + DELTA * long_term_util(next(s))[permutations(s)].
+
+    The paths to the roots are joined by doubling as in propagate_long_term_util, composing their permutations along
+    the way. Going around a cycle permutes the players of the root by some permutation P, so the long term utilities of
+    the root solve (I - DELTA ^ length * P) U = A, where A is the utility along the cycle.
+
+    :param EPSILONS: A vector of values of 1-DELTA.
+    :param stage_utils: An array of shape (n_states, n_players), see propagate_long_term_util.
+    :param next_states: An int array, next_states[s] is the state that follows s on the path of play.
+    :param permutations: An int array of shape (n_states, n_players), the permutation of the on-path transition of s.
+
+    :return: An array of shape (n_eps, n_states, n_players), the long term utility of each player in each state for
+    each discount factor.
+    """
+    DELTAS = 1 - np.asarray(EPSILONS, dtype=float).reshape(-1)
+    structure = on_path_structure(next_states)
+    roots = structure.roots
+    num_players = stage_utils.shape[1]
+    path_util = np.broadcast_to(stage_utils, (len(DELTAS),) + stage_utils.shape).copy()
+    path_util[:, roots] = 0
+    path_discount = np.repeat(DELTAS[:, None], len(stage_utils), axis=1)
+    path_discount[:, roots] = 1
+    path_perm = np.array(permutations, dtype=np.int64)
+    path_perm[roots] = np.arange(num_players)
+    jump = structure.next_states.copy()
+    jump[roots] = roots
+
+    steps = 1
+    max_depth = structure.depths.max(initial=0)
+    while steps < max_depth:
+        path_util += path_discount[:, :, None] * np.take_along_axis(path_util[:, jump], path_perm[None], axis=2)
+        path_discount *= path_discount[:, jump]
+        path_perm = np.take_along_axis(path_perm[jump], path_perm, axis=1)
+        jump = jump[jump]
+        steps *= 2
+
+    # around the cycle of every root: U = A + DELTA ^ length * U[P]
+    root_next = structure.next_states[roots]
+    root_perm = permutations[roots]
+    cycle_util = stage_utils[roots] + DELTAS[:, None, None] * np.take_along_axis(path_util[:, root_next],
+                                                                                 root_perm[None], axis=2)
+    cycle_perm = np.take_along_axis(path_perm[root_next], root_perm, axis=1)
+    cycle_matrix = np.zeros((len(roots), num_players, num_players))
+    cycle_matrix[np.arange(len(roots))[:, None], np.arange(num_players), cycle_perm] = 1
+    cycle_discount = DELTAS[:, None] * path_discount[:, root_next]
+    root_util = np.linalg.solve(np.eye(num_players) - cycle_discount[:, :, None, None] * cycle_matrix,
+                                cycle_util[..., None])[..., 0]
+
+    long_term_util = np.zeros(path_util.shape)
+    long_term_util[:, roots] = root_util
+    return path_util + path_discount[:, :, None] * np.take_along_axis(long_term_util[:, jump], path_perm[None], axis=2)
+
+
+def on_path_predecessors(next_states):
+    """
+    Index the on-path graph backwards.
+
+    :param next_states: An int array, next_states[s] is the joint state that follows s on the path of play.
+
+    :return: (order, starts), int arrays so that the states followed by s are order[starts[s]:starts[s + 1]].
+    """
+    next_states = np.asarray(next_states, dtype=np.int64)
+    order = np.argsort(next_states, kind="stable")
+    starts = np.searchsorted(next_states[order], np.arange(len(next_states) + 1))
+    return order, starts
+
+
+def on_path_ancestors(states, predecessors):
+    """
+    Walk the on-path graph backwards from states, visiting only the states that are found.
+
+    :param states: An int array of joint states.
+    :param predecessors: The (order, starts) index of on_path_predecessors.
+
+    :return: A sorted int array, the joint states whose path of play passes through one of states, including them.
+    """
+    order, starts = predecessors
+    reached = np.zeros(len(starts) - 1, dtype=bool)
+    frontier = np.unique(states)
+    reached[frontier] = True
+    while len(frontier) != 0:
+        counts = starts[frontier + 1] - starts[frontier]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        parents = order[np.repeat(starts[frontier], counts) + offsets]
+        frontier = np.unique(parents[~reached[parents]])
+        reached[frontier] = True
+    return np.flatnonzero(reached)
+
+
+def update_long_term_util(EPSILON, long_term_util, next_states, stage_utils, states):
+    """
+    Recalculate the long term utilities of some of the states in place, keeping those of all the other states.
+    The path of play from states is solved on its own, where every state outside of states it leads to is replaced
+    by an absorbing state with the same long term utility.
+
+    :param EPSILON: 1-DELTA.
+    :param long_term_util: An array of shape (n_states, n_players), the long term utilities to update.
+    :param next_states: An int array, next_states[s] is the joint state that follows s on the path of play.
+    :param stage_utils: An array of shape (n_states, n_players), see propagate_long_term_util.
+    :param states: An int array of the joint states to recalculate, usually the on_path_ancestors of the states
+    whose actions changed.
+    """
+    states = np.asarray(states, dtype=np.int64)
+    DELTA = 1 - float(EPSILON)
+    local = np.full(len(next_states), -1, dtype=np.int64)
+    local[states] = np.arange(len(states))
+    sub_next_states = local[next_states[states]]
+    leaving = sub_next_states < 0
+    exits, exit_ids = np.unique(next_states[states][leaving], return_inverse=True)
+    sub_next_states[leaving] = len(states) + exit_ids.ravel()
+
+    # an absorbing state that gets (1 - DELTA) * U every step has the long term utility U
+    sub_next_states = np.concatenate([sub_next_states, len(states) + np.arange(len(exits))])
+    sub_stage_utils = np.concatenate([stage_utils[states], (1 - DELTA) * long_term_util[exits]])
+    sub_util = propagate_long_term_util([EPSILON], sub_stage_utils, on_path_structure(sub_next_states))[0]
+    long_term_util[states] = sub_util[:len(states)]
+
+
+def joint_machine_on_path(joint_states, utilities_by_actions, transition_funcs=None, strategy_funcs=None):
+    """
+    Find the on-path graph and the one-step utilities of a joint strategy state machine, with the joint states
+    numbered by their position in joint_states (or by their ids in a JointStateMachineArrays).
+
+    :return: (next_states, stage_utils), see OnPathStructure and propagate_long_term_util.
+    """
+    if isinstance(joint_states, JointStateMachineArrays):
+        players = np.arange(len(joint_states.players_actions))
+        return on_path_next_states(joint_states), profile_utilities(utilities_by_actions, joint_states.players_actions,
+                                                                    players, joint_states.strategy[:, None])
+
+    num_players = len(joint_states[0])
+    position = {s: k for k, s in enumerate(joint_states)}
+    next_states = np.array([position[transition_funcs[s][strategy_funcs[s]]] for s in joint_states], dtype=np.int64)
+    if isinstance(utilities_by_actions, NeighborhoodUtilities):
+        players_actions = utilities_by_actions.players_actions
+        strategy = np.array([encode_action_profile(strategy_funcs[s], players_actions) for s in joint_states],
+                            dtype=np.int64)
+        return next_states, utilities_by_actions.evaluate(np.arange(num_players), strategy[:, None])
+    stage_utils = np.array([[utilities_by_actions[i][strategy_funcs[s]] for i in range(num_players)]
+                            for s in joint_states], dtype=float)
+    return next_states, stage_utils
+
+
+def joint_machine_deviations(joint_states, utilities_by_actions, transition_funcs=None, strategy_funcs=None,
+                             players_actions=None):
+    """
+    Find the one-shot deviations of a joint strategy state machine, with the joint states numbered as in
+    joint_machine_on_path. Every player deviates to each of his other actions, in the order of deviation_profiles.
+
+    :param players_actions: For dict machines, players_actions[i] is the list of possible actions for player i. By
+    default the actions of every player are those of the NeighborhoodUtilities, or those that appear in the
+    transitions of the first joint state.
+
+    :return: (dif_players, dif_next_states, dif_utils): dif_players[k] is the deviating player of the k-th deviation,
+    and dif_next_states[s][k], dif_utils[s][k] are the state that the k-th deviation leads to from state s and the
+    one-step utility of the deviating player from it.
+    """
+    if isinstance(joint_states, JointStateMachineArrays):
+        dif_players = deviation_players(joint_states.players_actions)
+        dif_actions, dif_next_states = deviation_next_states(joint_states)
+        return dif_players, dif_next_states, profile_utilities(utilities_by_actions, joint_states.players_actions,
+                                                               dif_players, dif_actions)
+
+    first_transitions = transition_funcs[joint_states[0]]
+    if players_actions is None and isinstance(utilities_by_actions, NeighborhoodUtilities):
+        players_actions = utilities_by_actions.players_actions
+    elif players_actions is None:
+        players_actions = [{action[i] for action in first_transitions} for i in range(len(joint_states[0]))]
+    players_actions = ordered_actions(players_actions)
+    profiles = action_profiles(players_actions, has_tuple_keys(first_transitions))
+    codes = {action: code for code, action in enumerate(profiles)}
+    position = {s: k for k, s in enumerate(joint_states)}
+
+    strategy = np.array([codes[strategy_funcs[s]] for s in joint_states], dtype=np.int64)
+    dif_players = deviation_players(players_actions)
+    dif_actions = deviation_profiles(strategy, players_actions)
+    dif_next_states = np.array([[position[transition_funcs[s][profiles[a]]] for a in row]
+                                for s, row in zip(joint_states, dif_actions.tolist())], dtype=np.int64)
+    dif_utils = profile_utilities(utilities_by_actions, players_actions, dif_players, dif_actions)
+    return dif_players, dif_next_states.reshape(dif_actions.shape), dif_utils
+
+
+def joint_machine_quotient(next_states, stage_utils, dif_next_states=None, dif_utils=None):
+    """
+    Merge the bisimilar joint states of a joint strategy state machine: the states that give the players the same
+    one-step utilities, on the path of play and from every deviation, and that lead to bisimilar states on the path of
+    play and after every deviation. Bisimilar states have the same long term utilities and the same deviation gains
+    for every discount factor, so they only need to be calculated once.
+
+    :param next_states: An int array, next_states[s] is the joint state that follows s on the path of play.
+    :param stage_utils: An array of shape (n_states, n_players), the one-step utilities on the path of play.
+    :param dif_next_states: The states that the deviations lead to, as returned by joint_machine_deviations. If not
+    given, the states are merged by the path of play only.
+    :param dif_utils: The one-step utilities of the deviations, as returned by joint_machine_deviations.
+
+    :return: (labels, representatives), where labels[s] is the state of the quotient machine that s is merged into,
+    and representatives[k] is the first joint state merged into k.
+    """
+    table, payoffs = next_states[:, None], stage_utils
+    if dif_next_states is not None:
+        table = np.column_stack([table, dif_next_states])
+        payoffs = np.column_stack([payoffs, dif_utils])
+    labels = refine_partition(table, np.unique(payoffs, axis=0, return_inverse=True)[1].ravel())
+    return labels, np.unique(labels, return_index=True)[1]
+
+
+def calc_long_term_util_batch(EPSILONS, joint_states, utilities_by_actions, transition_funcs=None,
+                              strategy_funcs=None, structure: OnPathStructure = None, quotient=False, cache=None,
+                              stats=None):
+    """
+    Algorithm 2 in "Subgame-perfect Cooperation in Networks", for a vector of discount factors. The cycles and the
+    order of the on-path graph are found once for all of them.
+
+    :param EPSILONS: A vector of values of 1-DELTA.
+    :param joint_states: The states of the joint strategy state machine, or a JointStateMachineArrays, in which case
+    transition_funcs and strategy_funcs are not given.
+    :param utilities_by_actions: The utilities for the players in the one-step game.
+    :param transition_funcs: The transitions function of the joint strategy state machine.
+    :param strategy_funcs: The strategy functions of the joint strategy state machine.
+    :param structure: The OnPathStructure of the joint machine, if it is already known.
+    :param quotient: If True, and structure is not given, calculate the long term utilities once for every group of
+    joint states with the same utilities along the path of play, see joint_machine_quotient.
+    :param cache: An optional StateMachineCache for the OnPathStructure of the joint machine.
+    :param stats: An optional PhaseStats, that records the "on_path", "quotient" and "long_term_util" phases, see
+    on_path_structure and phase_stats.
+
+    :return: An array of shape (n_eps, n_states, n_players), where the states are ordered as in joint_states.
+    """
+    with phase(stats, "on_path"):
+        next_states, stage_utils = joint_machine_on_path(joint_states, utilities_by_actions, transition_funcs,
+                                                         strategy_funcs)
+    if quotient and structure is None:
+        with phase(stats, "quotient"):
+            labels, representatives = joint_machine_quotient(next_states, stage_utils)
+        quotient_structure = on_path_structure(labels[next_states[representatives]], stats)
+        with phase(stats, "long_term_util"):
+            return propagate_long_term_util(EPSILONS, stage_utils[representatives], quotient_structure)[:, labels]
+    if structure is None:
+        structure = cached(cache, ("on_path_structure", next_states), lambda: on_path_structure(next_states, stats))
+    with phase(stats, "long_term_util"):
+        return propagate_long_term_util(EPSILONS, stage_utils, structure)
+
+
+def calc_long_term_util_arrays(EPSILON, joint: JointStateMachineArrays, utilities_by_actions, cache=None,
+                               stats=None):
+    """
+    Algorithm 2 in "Subgame-perfect Cooperation in Networks", for an array-backed joint strategy state machine.
+
+    :param EPSILON: 1-DELTA.
+    :param joint: The joint strategy state machine, as returned by construct_joint_state_machine(..., as_arrays=True).
+    :param utilities_by_actions: The utilities for the players in the one-step game, see utilities_to_array.
+    :param cache: An optional StateMachineCache, see calc_long_term_util_batch.
+    :param stats: An optional PhaseStats, see calc_long_term_util_batch.
+
+    :return: An array of shape (n_states, n_players), the long term utility of each player in each joint state.
+    """
+    return calc_long_term_util_batch([EPSILON], joint, utilities_by_actions, cache=cache, stats=stats)[0]
+
+
+def calc_long_term_util(EPSILON, joint_states, utilities_by_actions, transition_funcs=None, strategy_funcs=None,
+                        cache=None, stats=None):
+    """
+    Algorithm 2 in "Subgame-perfect Cooperation in Networks".
+    The function calculate the long term utility as was defined in the paper.
+
+    :param EPSILON: 1-DELTA.
+    :param joint_states: The states of the joint strategy state machine, or a JointStateMachineArrays, in which case
+    transition_funcs and strategy_funcs are not given.
+    :param utilities_by_actions: The utilities for the players in the one-step game.
+    :param strategy_funcs: The strategy functions of the joint strategy state machine.
+    :param transition_funcs: The transitions function of the joint strategy state machine.
+    :param cache: An optional StateMachineCache for the OnPathStructure of the joint machine, see
+    calc_long_term_util_batch.
+    :param stats: An optional PhaseStats, see calc_long_term_util_batch.
+
+    :return: The long term utility function, a dict from the joint states to arrays with the utility of every player.
+    For a JointStateMachineArrays, an array of shape (n_states, n_players).
+    """
+    if isinstance(joint_states, JointStateMachineArrays):
+        return calc_long_term_util_arrays(EPSILON, joint_states, utilities_by_actions, cache, stats)
+
+    long_term_util = calc_long_term_util_batch([EPSILON], joint_states, utilities_by_actions, transition_funcs,
+                                               strategy_funcs, cache=cache, stats=stats)[0]
+    return {s: long_term_util[k] for k, s in enumerate(joint_states)}
+
+
+class SPEResult(NamedTuple):
+    """
+    The result of check_SPE_state_machine for one discount factor. It is true if the strategies are SPE, so it can be
+    used like the boolean verdict.
+
+    SPE: True if no player can gain by a one-shot deviation in any state.
+    violations: A list of (state, player) pairs where the player doesn't play a best-response.
+    margins: An array of shape (n_states, n_players), the largest gain of each player from a one-shot deviation in
+    each state, with the states ordered as the joint states. The player doesn't play a best-response where it is > 0.
+    NaN for the states that weren't checked because of stop_at_first.
+    EPSILON: 1-DELTA.
+    """
+    SPE: bool
+    violations: list
+    margins: np.ndarray
+    EPSILON: float
+
+    def __bool__(self):
+        return bool(self.SPE)
+
+
+def report_SPE(result: SPEResult):
+    """
+    Print the deviations found in an SPEResult, followed by the verdict.
+    """
+    for state, i in result.violations:
+        print("in state:", state, "player", i, "dont play BR")
+    if result.SPE:
+        print("SPE")
+    else:
+        print("not SPE")
+
+
+def deviation_gains(DELTAS, long_term_util, dif_players, dif_next_states, dif_utils, states=slice(None)):
+    """
+    :param DELTAS: A vector of discount factors.
+    :param long_term_util: An array of shape (n_eps, n_states, n_players), see propagate_long_term_util.
+    :param dif_players: dif_next_states, dif_utils: The deviations, see joint_machine_deviations, in the given states.
+    :param states: The states of the deviations, all of them by default.
+
+    :return: An array of shape (n_eps, n_deviating_states, n_deviations), how much the deviating player gains from
+    each deviation in each state, for each discount factor.
+    """
+    dif_utility = dif_utils + DELTAS[:, None, None] * long_term_util[:, dif_next_states, dif_players]
+    return dif_utility - long_term_util[:, states][:, :, dif_players]
+
+
+def player_deviation_gains(gains, dif_players, num_players):
+    """
+    :param gains: An array of shape (n_eps, n_states, n_deviations), see deviation_gains.
+    :param dif_players: The deviating player of every deviation.
+    :param num_players: The number of players.
+
+    :return: An array of shape (n_eps, n_states, n_players), the largest gain of each player, -inf if he has no
+    other actions.
+    """
+    player_gains = np.full(gains.shape[:2] + (num_players,), -np.inf)
+    for i in range(num_players):
+        if np.any(dif_players == i):
+            player_gains[:, :, i] = gains[:, :, dif_players == i].max(axis=2)
+    return player_gains
+
+
+def calc_deviation_gains(EPSILONS, joint_states, utils_by_actions, transition_funcs=None, strategy_funcs=None):
+    """
+    Calculate how much each player can gain by a one-shot deviation in each state of a joint strategy state machine,
+    for all the states, players and discount factors at once.
+
+    :param EPSILONS: A vector of values of 1-DELTA.
+    :param joint_states: The states of the joint strategy state machine, or a JointStateMachineArrays, in which case
+    transition_funcs and strategy_funcs are not given.
+    :param utils_by_actions: The utilities of the players in the one-step game.
+    :param transition_funcs: The transitions function of the joint strategy state machine.
+    :param strategy_funcs: The strategy functions of the joint strategy state machine.
+
+    :return: An array of shape (n_eps, n_states, n_players), the largest gain of each player from deviating in each
+    state, where the states are ordered as in joint_states. The strategies are SPE where all the gains are <= 0.
+    """
+    DELTAS = 1 - np.asarray(EPSILONS, dtype=float).reshape(-1)
+    long_term_util = calc_long_term_util_batch(1 - DELTAS, joint_states, utils_by_actions, transition_funcs,
+                                               strategy_funcs)
+    dif_players, dif_next_states, dif_utils = joint_machine_deviations(joint_states, utils_by_actions,
+                                                                       transition_funcs, strategy_funcs)
+    gains = deviation_gains(DELTAS, long_term_util, dif_players, dif_next_states, dif_utils)
+    return player_deviation_gains(gains, dif_players, long_term_util.shape[2])
+
+
+# the arrays shared with the worker processes of check_SPE_state_machine, by name
+_shared_arrays = {}
+
+
+def share_array(array):
+    """
+    Copy an array to a new shared memory block.
+
+    :return: (shared_memory, descriptor), where the descriptor attaches to the array with attach_shared_array.
+    """
+    shared_memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shared_memory.buf)[...] = array
+    return shared_memory, (shared_memory.name, array.shape, array.dtype.str)
+
+
+def attach_shared_array(descriptor):
+    """
+    :return: (shared_memory, array), the array of a descriptor returned by share_array.
+    """
+    name, shape, dtype = descriptor
+    shared_memory = SharedMemory(name=name)
+    return shared_memory, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shared_memory.buf)
+
+
+def _init_deviation_worker(descriptors):
+    """
+    Attach a worker process to the shared arrays of check_SPE_state_machine.
+    """
+    for key, descriptor in descriptors.items():
+        _shared_arrays[key] = attach_shared_array(descriptor)
+
+
+def _deviation_worker(first, last):
+    """
+    Calculate the deviation margins of the states first, ..., last - 1 into the shared margins array.
+
+    :return: True if a player can gain by deviating in one of the states, for every discount factor.
+    """
+    arrays = {key: array for key, (shared_memory, array) in _shared_arrays.items()}
+    states = slice(first, last)
+    gains = deviation_gains(arrays["DELTAS"], arrays["long_term_util"], arrays["dif_players"],
+                            arrays["dif_next_states"][states], arrays["dif_utils"][states], states)
+    arrays["margins"][:, states] = player_deviation_gains(gains, arrays["dif_players"], arrays["margins"].shape[2])
+    return bool(np.all(np.any(arrays["margins"][:, states] > 0, axis=(1, 2))))
+
+
+def parallel_deviation_margins(DELTAS, long_term_util, dif_players, dif_next_states, dif_utils, processes,
+                               chunk_size, stop_at_first=False, control=None):
+    """
+    Calculate the deviation margins of check_SPE_state_machine in a pool of worker processes. The long term
+    utilities and the deviation tables are put in shared memory once, and every worker checks disjoint ranges of
+    chunk_size states and writes their margins into a shared margins array.
+
+    :param processes: The number of worker processes.
+    :param stop_at_first: If True, cancel the ranges that haven't started once a profitable deviation is found.
+    :param control: An optional RunControl, which is checked whenever a range is done. If it stops the check, the
+    ranges that haven't started are cancelled, and the partial result of RunAborted is the margins so far.
+
+    :return: An array of shape (n_eps, n_states, n_players), the margins, NaN for the states that weren't checked.
+    """
+    margins = np.full(long_term_util.shape, np.nan)
+    arrays = {"DELTAS": DELTAS, "long_term_util": long_term_util, "dif_players": dif_players,
+              "dif_next_states": dif_next_states, "dif_utils": dif_utils, "margins": margins}
+    shared = {key: share_array(np.ascontiguousarray(array)) for key, array in arrays.items()}
+    try:
+        descriptors = {key: descriptor for key, (shared_memory, descriptor) in shared.items()}
+        shared_margins = np.ndarray(margins.shape, dtype=margins.dtype, buffer=shared["margins"][0].buf)
+        num_states = long_term_util.shape[1]
+        with ProcessPoolExecutor(processes, initializer=_init_deviation_worker, initargs=(descriptors,)) as pool:
+            futures = [pool.submit(_deviation_worker, first, first + chunk_size)
+                       for first in range(0, num_states, chunk_size)]
+            for done, future in enumerate(as_completed(futures), 1):
+                if not future.cancelled() and future.result() and stop_at_first:
+                    for other in futures:
+                        other.cancel()
+                try:
+                    checkpoint(control, "check_SPE", min(done * chunk_size, num_states),
+                               max(num_states - done * chunk_size, 0), partial=lambda: shared_margins.copy())
+                except RunAborted:
+                    for other in futures:
+                        other.cancel()
+                    raise
+        margins = shared_margins.copy()
+    finally:
+        shared_margins = None  # the view of the shared memory has to go before it is closed
+        for shared_memory, descriptor in shared.values():
+            shared_memory.close()
+            shared_memory.unlink()
+    return margins
+
+
+def check_SPE_state_machine_arrays(joint: JointStateMachineArrays, utils_by_actions, EPSILON=0.01, verbose=True,
+                                   stop_at_first=False, processes=None, stats=None, control=None):
+    """
+    Check whether the strategies of an array-backed joint strategy state machine represent a subgame perfect
+    equilibrium, and if not print the possible deviations in the state machine. Every other action of each player is
+    checked, so the players may have any number of actions.
+
+    :param joint: The joint strategy state machine, as returned by construct_joint_state_machine(..., as_arrays=True).
+    :param utils_by_actions: The utilities of the players in the one-step game, see utilities_to_array.
+    :param EPSILON: 1-DELTA, or a vector of values of 1-DELTA.
+    :param verbose: see check_SPE_state_machine.
+    :param stop_at_first: see check_SPE_state_machine.
+    :param processes: see check_SPE_state_machine.
+    :param stats: see check_SPE_state_machine.
+    :param control: see check_SPE_state_machine.
+
+    :return: An SPEResult, or a list of them if EPSILON is a vector.
+    """
+    return check_SPE_state_machine(joint, utils_by_actions=utils_by_actions, EPSILON=EPSILON, verbose=verbose,
+                                   stop_at_first=stop_at_first, processes=processes, stats=stats, control=control)
+
+
+def check_SPE_state_machine(joint_states: list, transition_funcs: dict = None, strategy_funcs: dict = None,
+                            utils_by_actions: list = None, EPSILON=0.01, verbose=True, stop_at_first=False,
+                            chunk_size=4096, processes=None, players_actions=None, quotient=False, cache=None,
+                            stats=None, control=None):
+    """
+    Given a joint strategy state machine, check whether the strategies of the joint state machine represent a subgame
+    perfect equilibrium, and if not print the possible deviations in the state machine.
+    The gains of all the deviations are calculated at once, see calc_deviation_gains, and printed only after the check.
+
+    :param joint_states: The state of the joint strategy state machine, or a JointStateMachineArrays, in which case
+    transition_funcs and strategy_funcs are not given, e.g. check_SPE_state_machine(joint, utils_by_actions=utils).
+    The players may have any number of actions, and every player deviates to each of his other actions.
+    :param transition_funcs: A list of state transition functions for each player.
+    :param strategy_funcs: A list of state-action mappings for each player.
+    :param utils_by_actions: The utilities of the players in the one-step game.
+    :param EPSILON: 1-DELTA, or a vector of values of 1-DELTA that are all checked with the same long term utility
+    calculation.
+    :param verbose: If True, print the deviations and the verdict.
+    :param stop_at_first: If True, check the states chunk_size at a time, and stop after the first chunk in which a
+    profitable deviation is found (for every value of EPSILON).
+    :param chunk_size: The number of states checked at a time when stop_at_first is True, and by each task of the
+    worker processes.
+    :param processes: If more than 1, check the deviations in a pool of this many worker processes, with the joint
+    machine's deviation table and the long term utilities in shared memory, see parallel_deviation_margins.
+    :param players_actions: players_actions[i] is the list of possible actions for player i in a dict machine, see
+    joint_machine_deviations.
+    :param quotient: If True, check the quotient of the joint machine by bisimulation, where the joint states that
+    have the same utilities and deviations are checked once, and map the margins back to all the joint states, see
+    joint_machine_quotient.
+    :param cache: An optional StateMachineCache for the OnPathStructure of the joint machine, see state_machine_cache.
+    :param stats: An optional PhaseStats, that records the "on_path", "deviations" (the deviation tables),
+    "quotient", "long_term_util" and "deviation_gains" phases, the numbers of "states_checked" and of
+    "deviations_checked" (a one-shot deviation in a state for a discount factor), and the counters of
+    on_path_structure, see phase_stats.
+    :param control: An optional RunControl, that gets the progress of the deviation check, which then goes chunk_size
+    states at a time, and stops it with RunAborted when it is cancelled or over its time budget, see run_control. The
+    partial result of RunAborted is the margins so far, of shape (n_eps, n_states, n_players), NaN for the states that
+    weren't checked, and in the states of the quotient machine if quotient is True.
+
+    :return: An SPEResult, which is true if the strategies are SPE. A list of them if EPSILON is a vector.
+    """
+    DELTAS = 1 - np.asarray(EPSILON, dtype=float).reshape(-1)
+    with phase(stats, "on_path"):
+        next_states, stage_utils = joint_machine_on_path(joint_states, utils_by_actions, transition_funcs,
+                                                         strategy_funcs)
+    with phase(stats, "deviations"):
+        dif_players, dif_next_states, dif_utils = joint_machine_deviations(joint_states, utils_by_actions,
+                                                                           transition_funcs, strategy_funcs,
+                                                                           players_actions)
+    if quotient:
+        with phase(stats, "quotient"):
+            labels, representatives = joint_machine_quotient(next_states, stage_utils, dif_next_states, dif_utils)
+        next_states, stage_utils = labels[next_states[representatives]], stage_utils[representatives]
+        dif_next_states, dif_utils = labels[dif_next_states[representatives]], dif_utils[representatives]
+    structure = cached(cache, ("on_path_structure", next_states), lambda: on_path_structure(next_states, stats))
+    with phase(stats, "long_term_util"):
+        long_term_util = propagate_long_term_util(1 - DELTAS, stage_utils, structure)
+    num_states, num_players = long_term_util.shape[1:]
+
+    with phase(stats, "deviation_gains"):
+        if processes is not None and processes > 1:
+            margins = parallel_deviation_margins(DELTAS, long_term_util, dif_players, dif_next_states, dif_utils,
+                                                 processes, chunk_size, stop_at_first=stop_at_first, control=control)
+        else:
+            margins = np.full(long_term_util.shape, np.nan)
+            step = chunk_size if stop_at_first or control is not None else max(num_states, 1)
+            for first in range(0, num_states, step):
+                checkpoint(control, "check_SPE", first, num_states - first, partial=margins.copy)
+                states = slice(first, first + step)
+                gains = deviation_gains(DELTAS, long_term_util, dif_players, dif_next_states[states],
+                                        dif_utils[states], states)
+                margins[:, states] = player_deviation_gains(gains, dif_players, num_players)
+                if stop_at_first and np.all(np.any(margins[:, states] > 0, axis=(1, 2))):
+                    break
+            checkpoint(control, "check_SPE", num_states, 0)
+    if stats is not None:
+        states_checked = np.count_nonzero(~np.isnan(margins[0, :, 0])) if num_players else 0
+        stats.count("states_checked", states_checked)
+        stats.count("deviations_checked", states_checked * len(dif_players) * len(DELTAS))
+    if quotient:
+        margins = margins[:, labels]
+
+    if isinstance(joint_states, JointStateMachineArrays):
+        state_names = [tuple(state) for state in joint_states.states.tolist()]
+    else:
+        state_names = joint_states
+    results = collect_SPE_results(np.asarray(EPSILON, dtype=float).reshape(-1), margins, state_names, verbose)
+    return results if np.ndim(EPSILON) else results[0]
+
+
+def collect_SPE_results(EPSILONS, margins, state_names, verbose=True):
+    """
+    :param EPSILONS: A vector of values of 1-DELTA.
+    :param margins: An array of shape (n_eps, n_states, n_players), the largest gains from deviating.
+    :param state_names: The name of every state in the violations.
+    :param verbose: If True, print the deviations and the verdict of every discount factor.
+
+    :return: A list with the SPEResult of every discount factor.
+    """
+    results = []
+    for e, EPSILON_e in enumerate(EPSILONS):
+        violations = [(state_names[state], int(i)) for state, i in zip(*np.nonzero(margins[e] > 0))]
+        results.append(SPEResult(len(violations) == 0, violations, margins[e], float(EPSILON_e)))
+        if verbose:
+            report_SPE(results[-1])
+    return results
+
+
+def check_SPE_orbit_state_machine(orbit: OrbitStateMachine, utils_by_actions, EPSILON=0.01, verbose=True,
+                                  stop_at_first=False, chunk_size=4096, stats=None, control=None):
+    """
+    Check whether the strategies of a joint state machine that is reduced by its symmetries are SPE. The joint states
+    of an orbit are SPE together, so only the representatives are checked, see check_SPE_state_machine.
+
+    :param orbit: The OrbitStateMachine of the strategies.
+    :param utils_by_actions: The utilities of the players in the one-step game, see utilities_to_array.
+    :param EPSILON: 1-DELTA, or a vector of values of 1-DELTA.
+    :param verbose: If True, print the deviations in the representatives and the verdict.
+    :param stop_at_first: If True, check the representatives chunk_size at a time, and stop after the first chunk in
+    which a deviation is profitable for every discount factor, see check_SPE_state_machine.
+    :param chunk_size: The number of representatives checked at a time when stop_at_first is True or control is given.
+    :param stats: An optional PhaseStats, that records the "long_term_util" and "deviation_gains" phases and the
+    numbers of "states_checked" and "deviations_checked" of the representatives, see check_SPE_state_machine.
+    :param control: An optional RunControl, that gets the progress of the deviation check and stops it with
+    RunAborted, whose partial result is the margins so far, NaN for the representatives that weren't checked, see
+    check_SPE_state_machine.
+
+    :return: An SPEResult whose violations and margins are those of the representatives, or a list of them if EPSILON
+    is a vector.
+    """
+    DELTAS = 1 - np.asarray(EPSILON, dtype=float).reshape(-1)
+    players_actions = orbit.players_actions
+    players = np.arange(len(players_actions))
+    with phase(stats, "long_term_util"):
+        stage_utils = profile_utilities(utils_by_actions, players_actions, players, orbit.strategy[:, None])
+        long_term_util = propagate_long_term_util_permuted(1 - DELTAS, stage_utils, orbit.transitions[:, 0],
+                                                           orbit.permutations[:, 0])
+
+    # the deviating player is player perm[i] of the representative of the joint state he deviates to
+    with phase(stats, "deviation_gains"):
+        dif_players = deviation_players(players_actions)
+        dif_actions = deviation_profiles(orbit.strategy, players_actions)
+        dif_utils = profile_utilities(utils_by_actions, players_actions, dif_players, dif_actions)
+        dif_perm_players = orbit.permutations[:, 1:][:, np.arange(len(dif_players)), dif_players]
+        num_states = len(orbit.strategy)
+        margins = np.full(long_term_util.shape, np.nan)
+        step = chunk_size if stop_at_first or control is not None else max(num_states, 1)
+        for first in range(0, num_states, step):
+            checkpoint(control, "check_SPE", first, num_states - first, partial=margins.copy)
+            states = slice(first, first + step)
+            dif_utility = dif_utils[states] + DELTAS[:, None, None] * long_term_util[
+                :, orbit.transitions[states, 1:], dif_perm_players[states]]
+            gains = dif_utility - long_term_util[:, states][:, :, dif_players]
+            margins[:, states] = player_deviation_gains(gains, dif_players, len(players))
+            if stop_at_first and np.all(np.any(margins[:, states] > 0, axis=(1, 2))):
+                break
+        checkpoint(control, "check_SPE", num_states, 0)
+    if stats is not None:
+        states_checked = np.count_nonzero(~np.isnan(margins[0, :, 0])) if len(players) else 0
+        stats.count("states_checked", states_checked)
+        stats.count("deviations_checked", states_checked * len(dif_players) * len(DELTAS))
+
+    state_names = [tuple(state) for state in orbit.states.tolist()]
+    results = collect_SPE_results(np.asarray(EPSILON, dtype=float).reshape(-1), margins, state_names, verbose)
+    return results if np.ndim(EPSILON) else results[0]
+
+
+class CriticalDiscountFactors(NamedTuple):
+    """
+    The discount factors above which the strategies of a joint strategy state machine have no profitable one-shot
+    deviations.
+
+    thresholds: An array of shape (n_states, n_players), thresholds[s][i] is the smallest DELTA such that player i
+    can't gain by deviating in state s for any larger DELTA. 0 if he never gains, 1 if he gains for DELTA close to 1.
+    critical_DELTA: The largest threshold, above which the strategies are SPE.
+    state: A state with the largest threshold.
+    player: The player with the largest threshold in that state.
+    """
+    thresholds: np.ndarray
+    critical_DELTA: float
+    state: object
+    player: int
+
+
+def calc_long_term_util_at(states, players, DELTAS, stage_utils, structure: OnPathStructure):
+    """
+    Calculate single long term utilities, each with its own discount factor, by summing the utilities along the path
+    from the state to its cycle and along the cycle.
+
+    :param states: An int array of states.
+    :param players: An int array, the player of every state in states.
+    :param DELTAS: An array, the discount factor of every state in states.
+    :param stage_utils: An array of shape (n_states, n_players), see propagate_long_term_util.
+    :param structure: The OnPathStructure of the joint strategy state machine.
+
+    :return: An array, the long term utility of players[k] in states[k] with the discount factor DELTAS[k].
+    """
+    util = np.zeros(len(states))
+    discount = np.ones(len(states))
+    states = np.array(states)
+    walking = np.flatnonzero(structure.depths[states] > 0)
+    while len(walking) != 0:
+        util[walking] += discount[walking] * stage_utils[states[walking], players[walking]]
+        discount[walking] *= DELTAS[walking]
+        states[walking] = structure.next_states[states[walking]]
+        walking = walking[structure.depths[states[walking]] > 0]
+
+    # the states are now roots, sum the utilities along their cycles
+    lengths = structure.cycle_lengths[np.searchsorted(structure.roots, states)]
+    cycle_util = np.zeros(len(states))
+    cycle_discount = np.ones(len(states))
+    for step in range(lengths.max(initial=0)):
+        walking = np.flatnonzero(step < lengths)
+        cycle_util[walking] += cycle_discount[walking] * stage_utils[states[walking], players[walking]]
+        cycle_discount[walking] *= DELTAS[walking]
+        states[walking] = structure.next_states[states[walking]]
+    return util + discount * cycle_util / (1 - cycle_discount)
+
+
+def calc_critical_discount_factors(joint_states, utils_by_actions, transition_funcs=None, strategy_funcs=None,
+                                   num_grid=64, min_EPSILON=1e-9, num_bisections=60):
+    """
+    Find, for every state and player, the DELTA above which the one-shot deviations of the player in the state are
+    unprofitable, and the critical DELTA above which the strategies are SPE, in a single pass.
+
+    The gains of all the deviations are first calculated for num_grid values of EPSILON, spaced evenly on a log scale
+    between 1 and min_EPSILON, with one long term utility calculation. The last sign change of every gain is then
+    narrowed down by bisection, where the gain at each DELTA is calculated exactly from the sums of the utilities
+    along the path and cycle of the states.
+
+    This is a numerical approximation bounded by the grid, not the exact root of the rational gain functions: a gain
+    whose last sign change is in a grid cell is located to the floating point precision, but a profitable interval
+    of DELTA that opens and closes inside a single grid cell, between 1 - EPSILONS[k] and 1 - EPSILONS[k + 1], isn't
+    seen. With the defaults the cells are EPSILON ranges whose ends differ by a factor of
+    min_EPSILON ** (-1 / (num_grid - 1)) = 1.39, e.g. DELTA in (0.9, 0.928) or (0.99, 0.9928); a larger num_grid
+    makes them narrower. For the strategies of create_three_players_state_machines(1, 2, 4) the critical DELTA is
+    0.9563525, and the SPE verdict of check_SPE_state_machine changes between DELTA +- 1e-7.
+
+    :param joint_states: The states of the joint strategy state machine, or a JointStateMachineArrays, in which case
+    transition_funcs and strategy_funcs are not given.
+    :param utils_by_actions: The utilities of the players in the one-step game.
+    :param transition_funcs: The transitions function of the joint strategy state machine.
+    :param strategy_funcs: The strategy functions of the joint strategy state machine.
+    :param num_grid: The number of values of EPSILON where the gains are first calculated.
+    :param min_EPSILON: The smallest value of EPSILON checked, gains that are still positive there give threshold 1.
+    :param num_bisections: The number of bisection steps for each threshold.
+
+    :return: A CriticalDiscountFactors.
+    """
+    next_states, stage_utils = joint_machine_on_path(joint_states, utils_by_actions, transition_funcs, strategy_funcs)
+    dif_players, dif_next_states, dif_utils = joint_machine_deviations(joint_states, utils_by_actions,
+                                                                       transition_funcs, strategy_funcs)
+    structure = on_path_structure(next_states)
+    num_states, num_players = stage_utils.shape
+
+    # the largest DELTA of the grid where each deviation is profitable, -1 if there is none
+    EPSILONS = np.geomspace(1, min_EPSILON, num_grid)
+    last_profitable = np.full(dif_next_states.shape, -1)
+    for first in range(0, num_grid, 8):
+        long_term_util = propagate_long_term_util(EPSILONS[first:first + 8], stage_utils, structure)
+        gains = deviation_gains(1 - EPSILONS[first:first + 8], long_term_util, dif_players, dif_next_states, dif_utils)
+        profitable = gains > 0
+        for k in range(len(profitable)):
+            last_profitable[profitable[k]] = first + k
+
+    # bisection between the last profitable DELTA of the grid and the next one
+    deviation_thresholds = np.where(last_profitable == num_grid - 1, 1.0, 0.0)
+    states, columns = np.nonzero((last_profitable >= 0) & (last_profitable < num_grid - 1))
+    players = dif_players[columns]
+    low = 1 - EPSILONS[last_profitable[states, columns]]
+    high = 1 - EPSILONS[last_profitable[states, columns] + 1]
+    for step in range(num_bisections):
+        middle = (low + high) / 2
+        dif_utility = dif_utils[states, columns] + middle * calc_long_term_util_at(
+            dif_next_states[states, columns], players, middle, stage_utils, structure)
+        profitable = dif_utility > calc_long_term_util_at(states, players, middle, stage_utils, structure)
+        low = np.where(profitable, middle, low)
+        high = np.where(profitable, high, middle)
+    deviation_thresholds[states, columns] = high
+
+    thresholds = np.zeros((num_states, num_players))
+    np.maximum.at(thresholds, (slice(None), dif_players), deviation_thresholds)
+    state, player = np.unravel_index(np.argmax(thresholds), thresholds.shape)
+    if not isinstance(joint_states, JointStateMachineArrays):
+        state = joint_states[state]
+    return CriticalDiscountFactors(thresholds, float(thresholds.max(initial=0)), state, int(player))
+
+
+def calculate_single_player_utility_by_graph(n: int, games: dict, player: int, players_actions):
+    """
+    Given a graph, a player, and the games on each of his nodes, calculate the utilities matching for every possible
+    combinations of actions of all the players in the (one shot) game.
+
+    :param n: The number of players.
+    :param games: A dictionary mapping  edges to the matching two player game.
+    :param player: The player we want to calculate his utilities.
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+
+    :return: The utilities for the given player for every possible combination of actions in the one shot game.
+    """
+    utilities = {}
+    for element in itertools.product(*players_actions):
+        action = "".join(element)
+        act_utility = 0
+        for k in range(n):
+            if k != player and (k, player) in games:
+                act_utility += games[(k, player)][action[player] + action[k]]
+        utilities[action] = act_utility
+
+    return utilities
+
+
+def calc_neighborhood_utilities_by_graph(n: int, games: dict, players_actions):
+    """
+    Given a graph and the games on each of its edges, calculate the utilities of every player for the combinations of
+    actions of him and his neighbors only, so the tables are as large as the neighborhoods and not 2^n.
+
+    :param n: The number of players.
+    :param games: A dictionary mapping edges to the matching two player game, with both directions of every edge.
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+
+    :return: The NeighborhoodUtilities of the one shot game.
+    """
+    players_actions = ordered_actions(players_actions)
+    neighbors, tables = [], []
+    for player in range(n):
+        others = sorted(k for (k, j) in games if j == player and k != player)
+        local_actions = [players_actions[k] for k in [player] + others]
+        table = [sum(games[(k, player)][element[0] + element[m + 1]] for m, k in enumerate(others))
+                 for element in itertools.product(*local_actions)]
+        neighbors.append(np.array([player] + others, dtype=np.int64))
+        tables.append(np.array(table, dtype=float))
+    return NeighborhoodUtilities(players_actions, tuple(neighbors), tuple(tables))
+
+
+def check_SPE_state_machine_by_graph(n: int, games: dict, transition_funcs, strategy_funcs, EPSILON=0.01,
+                                     unilateral=False, verbose=True, stop_at_first=False, symmetric=False,
+                                     cache=None, stats=None, control=None, max_automorphisms=256):
+    """
+    Algorithm 3 in "Subgame-perfect Cooperation in Networks".
+    Given n players, a dictionary that contains the edges in the graph of the players and the two player game
+    for every edge, also given a joint strategy state machine, the function returns whether the strategies are SPE
+    in the repeated game on the graph.
+
+    :param n: the number of players.
+    :param games: a dict with keys as edges (i,j) in the graph, and the values are the utility 'matrices' of player i from
+    the symmetric game where each of i,j choose an action from {C,D}.
+    The 'matrices' are also dicts with the entries as "CC", "CD", "DC" and "DD".
+    meaning: games[(1, 2)]["CD"] gives the utility for a player when he plays C and the other player plays D.
+    :param transition_funcs: the transitions of the single player state machine strategy, or LocalStateMachines like
+    those of generate_network_state_machines, which stay in array form, see construct_joint_state_machine.
+    Dicts have a transition for every one of the 2^n action profiles in every state, so they limit the check to about
+    16 players, a cycle of 16 grim-trigger players takes 2 s. Only LocalStateMachines with unilateral=True, whose
+    transitions depend on the neighborhoods, reach 20-30 players, e.g. 1 s for a cycle of 24 grim-trigger players and
+    13 s for 30. The number of joint states still depends on the strategies, and punishments with "gaining trust
+    back" on a cycle of 10 players already have about 10^5 joint states.
+    :param strategy_funcs: the actions of the single player state machine strategy, or None with LocalStateMachines.
+    :param EPSILON: 1 - DELTA, the discount factor.
+    :param unilateral: If True, construct only the on-path and unilateral deviation transitions of the joint machine,
+    see construct_joint_state_machine.
+    :param verbose: If True, print the deviations and the verdict, see check_SPE_state_machine.
+    :param stop_at_first: If True, stop as soon as a profitable deviation is found, see check_SPE_state_machine.
+    :param symmetric: If True, find the automorphisms of the graph that also map the strategies of the players onto
+    each other, and check one representative joint state of every orbit, see check_SPE_orbit_state_machine. The
+    violations are then reported in the representatives only.
+    :param cache: An optional StateMachineCache, see state_machine_cache. The joint machine is cached by the strategies,
+    the utilities by the games, and the results by all the arguments, so repeated checks skip the computation.
+    :param stats: An optional PhaseStats, that records the "utilities" and "check_SPE" phases besides those of
+    construct_joint_state_machine and check_SPE_state_machine, see phase_stats. Nothing is recorded for the parts that
+    come from the cache.
+    :param control: An optional RunControl, that gets the progress of the construction and of the check, and stops
+    them with RunAborted when they are cancelled or over budget, see run_control.
+    :param max_automorphisms: With symmetric=True, the number of automorphisms of the graph that are tried, see
+    strategy_automorphisms, since a clique of n players has n! of them.
+
+    :return: The SPEResult of check_SPE_state_machine, which is true if the strategies are SPE in the DELTA-discounted
+    game of the game constructed from the sum of the utilities of the games on each edge.
+    """
+    games = dict(games)
+    run_on = list(games.keys())
+    for edge in run_on:
+        games[(edge[1], edge[0])] = games[edge]
+
+    actions_sets = [{"C", "D"} for i in range(n)]
+    machines = (actions_sets, transition_funcs, strategy_funcs, unilateral)
+
+    def check():
+        with phase(stats, "utilities"):
+            utilities = cached(cache, ("neighborhood_utilities", n, games),
+                               lambda: calc_neighborhood_utilities_by_graph(n, games, actions_sets))
+        if symmetric:
+            def orbit_state_machine():
+                symmetries = strategy_automorphisms(n, games, transition_funcs, strategy_funcs, actions_sets,
+                                                    max_automorphisms)
+                return construct_orbit_state_machine(actions_sets, transition_funcs, strategy_funcs, symmetries,
+                                                     unilateral, control)
+
+            with phase(stats, "construct"):
+                orbit = cached(cache, ("orbit_state_machine", n, games, max_automorphisms) + machines,
+                               orbit_state_machine)
+            count(stats, "orbit_states", len(orbit.strategy))
+            with phase(stats, "check_SPE"):
+                return check_SPE_orbit_state_machine(orbit, utilities, EPSILON=EPSILON, verbose=False,
+                                                     stop_at_first=stop_at_first, stats=stats, control=control)
+
+        joint = construct_joint_state_machine(actions_sets, transition_funcs, strategy_funcs, as_arrays=True,
+                                              unilateral=unilateral, cache=cache, stats=stats, control=control)
+        with phase(stats, "check_SPE"):
+            return check_SPE_state_machine(joint, utils_by_actions=utilities, EPSILON=EPSILON, verbose=False,
+                                           stop_at_first=stop_at_first, cache=cache, stats=stats,
+                                           control=control)
+
+    key = ("check_SPE_state_machine_by_graph", n, games, EPSILON, stop_at_first, symmetric,
+           max_automorphisms) + machines
+    results = cached(cache, key, check)
+    if verbose:
+        for result in results if np.ndim(EPSILON) else [results]:
+            report_SPE(result)
+    return results
@@ -1,4 +1,12 @@
-from check_SPE_state_machine import check_SPE_state_machine_by_graph
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from build_joint_state_machine import construct_joint_state_machine
+from check_SPE_state_machine import calc_neighborhood_utilities_by_graph, check_SPE_state_machine_by_graph, \
+    deviation_gains, joint_machine_deviations, joint_machine_on_path, on_path_structure, player_deviation_gains, \
+    propagate_long_term_util
 
 all_actions = ["CCC", "CCD", "CDC", "CDD", "DCC", "DCD", "DDC", "DDD"]
 
@@ -214,7 +222,19 @@ def middle_state_machine(punish_num, trust_gain_num):
     return middle_f, middle_s
 
 
-def create_three_players_state_machines(c, d, l, EPSILON=0.01):
+def three_players_parameters(c, d, l):
+    """
+    :param c: The utility for each of the players in the PD when they both cooperate.
+    :param d: The utility for a deviating player when the other player hasn't deviated in the PD.
+    :param l: The utility for a cooperating player when the other player has deviated in the PD.
+
+    :return: (punish_num, trust_gain_num), the number of steps of punishment and "gaining trust back", which are all
+    that the strategy state machines depend on.
+    """
+    return max([(d // c) + 1, 3]), (l // (d - c)) + 1
+
+
+def create_three_players_state_machines(c, d, l, EPSILON=0.01, verbose=True, return_result=False):
     """
     Section 5.2.1 in "Subgame-perfect Cooperation in Networks".
     This function returns three single player strategy state machines, so that this strategies are SPE in the V graph
@@ -225,12 +245,13 @@ def create_three_players_state_machines(c, d, l, EPSILON=0.01):
     :param d: The utility for a deviating player when the other player hasn't deviated in the PD.
     :param l: The utility for a cooperating player when the other player has deviated in the PD.
     :param EPSILON: 1 - DELTA.
+    :param verbose: If True, print the deviations and the verdict of the SPE check.
+    :param return_result: If True, also return the SPEResult of the SPE check.
 
-    :return: The single player strategy state machine of the three players.
+    :return: The single player strategy state machine of the three players, and the SPEResult if return_result is
+    True.
     """
-    # the number of steps of punishment and "gaining trust back".
-    punish_num = max([(d // c) + 1, 3])
-    trust_gain_num = (l // (d - c)) + 1
+    punish_num, trust_gain_num = three_players_parameters(c, d, l)
 
     # the strategies of the players
     left_state_transition, left_state_action = left_state_machine(punish_num, trust_gain_num)
@@ -245,9 +266,116 @@ def create_three_players_state_machines(c, d, l, EPSILON=0.01):
         (0, 1): {"CC": c, "CD": -l, "DC": d, "DD": 0},
         (1, 2): {"CC": c, "CD": -l, "DC": d, "DD": 0},
     }
-    check_SPE_state_machine_by_graph(3, games, transitions_funcs, strategy_funcs)
+    result = check_SPE_state_machine_by_graph(3, games, transitions_funcs, strategy_funcs, EPSILON=EPSILON,
+                                              verbose=verbose)
 
+    if return_result:
+        return transitions_funcs, strategy_funcs, result
     return transitions_funcs, strategy_funcs
 
 
-create_three_players_state_machines(1, 2, 4)
+class SweepResult(NamedTuple):
+    """
+    The result of sweep_three_players_state_machines, a table with a row for every point of the sweep.
+
+    c, d, l, EPSILON: Arrays, the parameters of every point.
+    punish_num, trust_gain_num: Int arrays, the parameters of the strategies of every point.
+    SPE: A bool array, True where the strategies are SPE.
+    margin: An array, the largest gain of a player from a one-shot deviation in a joint state, see SPEResult. The
+    strategies are SPE where it is <= 0.
+    """
+    c: np.ndarray
+    d: np.ndarray
+    l: np.ndarray
+    EPSILON: np.ndarray
+    punish_num: np.ndarray
+    trust_gain_num: np.ndarray
+    SPE: np.ndarray
+    margin: np.ndarray
+
+
+def _sweep_group(punish_num, trust_gain_num, points, batch_size):
+    """
+    Check the points of a sweep that share the strategy state machines of (punish_num, trust_gain_num). The joint
+    machine, its on-path structure and its deviations are built once. The one-step utilities are linear in (c, d, l),
+    so they are combined from the utilities of the three payoffs, and the long term utilities of all the points with
+    the same EPSILON are propagated together as the columns of one array.
+
+    :param points: An array of shape (n_points, 4), the (c, d, l, EPSILON) of every point.
+
+    :return: An array of shape (n_points,), the largest deviation gain of every point.
+    """
+    machines = [left_state_machine(punish_num, trust_gain_num), middle_state_machine(punish_num, trust_gain_num),
+                right_state_machine(punish_num, trust_gain_num)]
+    actions_sets = [{"C", "D"} for i in range(3)]
+    joint = construct_joint_state_machine(actions_sets, [machine[0] for machine in machines],
+                                          [machine[1] for machine in machines], as_arrays=True)
+
+    # the utilities of c, d and l on their own, the games on the edges of the V graph are those of
+    # create_three_players_state_machines
+    stage_utils, dif_utils = [], []
+    for game in ({"CC": 1, "CD": 0, "DC": 0, "DD": 0}, {"CC": 0, "CD": 0, "DC": 1, "DD": 0},
+                 {"CC": 0, "CD": -1, "DC": 0, "DD": 0}):
+        games = {edge: game for edge in [(0, 1), (1, 2), (1, 0), (2, 1)]}
+        utilities = calc_neighborhood_utilities_by_graph(3, games, actions_sets)
+        next_states, basis_stage_utils = joint_machine_on_path(joint, utilities)
+        dif_players, dif_next_states, basis_dif_utils = joint_machine_deviations(joint, utilities)
+        stage_utils.append(basis_stage_utils)
+        dif_utils.append(basis_dif_utils)
+    stage_utils, dif_utils = np.stack(stage_utils, axis=-1), np.stack(dif_utils, axis=-1)
+    structure = on_path_structure(next_states)
+
+    margins = np.empty(len(points))
+    for EPSILON in np.unique(points[:, 3]):
+        selected = np.flatnonzero(points[:, 3] == EPSILON)
+        for first in range(0, len(selected), batch_size):
+            batch = selected[first:first + batch_size]
+            payoffs = points[batch, :3]
+            # the stage utilities of the batch are the columns (point, player) of one array
+            batch_stage_utils = (stage_utils[:, None] * payoffs[:, None]).sum(axis=-1).reshape(len(stage_utils), -1)
+            long_term_util = propagate_long_term_util([EPSILON], batch_stage_utils, structure)[0]
+            long_term_util = long_term_util.reshape(len(stage_utils), len(batch), 3).transpose(1, 0, 2)
+            batch_dif_utils = (dif_utils[None] * payoffs[:, None, None]).sum(axis=-1)
+            gains = deviation_gains(np.full(len(batch), 1 - EPSILON), long_term_util, dif_players, dif_next_states,
+                                    batch_dif_utils)
+            margins[batch] = player_deviation_gains(gains, dif_players, 3).max(axis=(1, 2))
+    return margins
+
+
+def sweep_three_players_state_machines(points, processes=None, batch_size=256):
+    """
+    Check the strategies of create_three_players_state_machines for many parameters at once. The points are grouped
+    by the (punish_num, trust_gain_num) of their strategies, and every group is checked with a single joint machine,
+    see _sweep_group.
+
+    :param points: A sequence of (c, d, l, EPSILON) points.
+    :param processes: If given, check the groups in a pool of this many worker processes.
+    :param batch_size: The number of points whose long term utilities are propagated together.
+
+    :return: A SweepResult with the points in the given order.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 4)
+    parameters = np.array([three_players_parameters(c, d, l) for c, d, l, EPSILON in points.tolist()],
+                          dtype=np.int64).reshape(-1, 2)
+    groups, group_of_point = np.unique(parameters, axis=0, return_inverse=True)
+    group_of_point = group_of_point.ravel()
+    members = [np.flatnonzero(group_of_point == k) for k in range(len(groups))]
+
+    arguments = [(punish_num, trust_gain_num, points[member], batch_size)
+                 for (punish_num, trust_gain_num), member in zip(groups.tolist(), members)]
+    if processes is None:
+        group_margins = [_sweep_group(*argument) for argument in arguments]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(_sweep_group, *argument) for argument in arguments]
+            group_margins = [future.result() for future in futures]
+
+    margins = np.empty(len(points))
+    for member, member_margins in zip(members, group_margins):
+        margins[member] = member_margins
+    return SweepResult(points[:, 0], points[:, 1], points[:, 2], points[:, 3], parameters[:, 0], parameters[:, 1],
+                       ~(margins > 0), margins)
+
+
+if __name__ == "__main__":
+    create_three_players_state_machines(1, 2, 4)
@@ -0,0 +1,114 @@
+import numpy as np
+
+from build_joint_state_machine import LocalStateMachine
+
+# The actions of the players in the generated networks are those of the prisoner's dilemma, ordered as by
+# ordered_actions, so "C" is the action 0 and "D" is the action 1.
+PD_ACTIONS = ("C", "D")
+
+
+def network_edges(family, n):
+    """
+    :param family: "line", "cycle", "star" (where player 0 is the center), "clique" or "V" (the three players graph
+    left - middle - right of create_three_players_state_machines).
+    :param n: The number of players.
+
+    :return: A list of the edges (i, j) of the network, one direction of every edge.
+    """
+    if family == "line":
+        return [(i, i + 1) for i in range(n - 1)]
+    if family == "cycle":
+        return [(i, (i + 1) % n) for i in range(n)] if n > 2 else network_edges("line", n)
+    if family == "star":
+        return [(0, i) for i in range(1, n)]
+    if family == "clique":
+        return [(i, j) for i in range(n) for j in range(i + 1, n)]
+    if family == "V":
+        if n != 3:
+            raise ValueError("The V network has 3 players, not %d" % n)
+        return [(0, 1), (1, 2)]
+    raise ValueError("Unknown network family %r" % family)
+
+
+def network_neighbors(n, edges):
+    """
+    :return: A list with an int array of the neighbors of every player, in increasing order.
+    """
+    neighbors = [set() for i in range(n)]
+    for i, j in edges:
+        neighbors[i].add(j)
+        neighbors[j].add(i)
+    return [np.array(sorted(neighbors[i] - {i}), dtype=np.int64) for i in range(n)]
+
+
+def network_games(edges, c, d, l):
+    """
+    :param edges: The edges of the network.
+    :param c, d, l: The parameters of the prisoner's dilemma, see create_three_players_state_machines.
+
+    :return: The games of the edges, see check_SPE_state_machine_by_graph.
+    """
+    return {edge: {"CC": c, "CD": -l, "DC": d, "DD": 0} for edge in edges}
+
+
+def _local_defections(watched):
+    """
+    :return: A bool array of shape (n_local_profiles, n_watched), True where the watched player defects in the local
+    action profile, see local_action_profiles.
+    """
+    codes = np.arange(len(PD_ACTIONS) ** len(watched))
+    digits = (codes[:, None] // len(PD_ACTIONS) ** np.arange(len(watched) - 1, -1, -1)) % len(PD_ACTIONS)
+    return digits == PD_ACTIONS.index("D")
+
+
+def grim_trigger_state_machines(n, edges):
+    """
+    Grim-trigger in a network: every player cooperates until he or one of his neighbors defects, and then defects
+    forever.
+
+    :param n: The number of players.
+    :param edges: The edges of the network, see network_edges.
+
+    :return: A list with the LocalStateMachine of every player.
+    """
+    machines = []
+    for i, neighbors in enumerate(network_neighbors(n, edges)):
+        watched = np.union1d([i], neighbors)
+        defected = _local_defections(watched).any(axis=1)
+        transitions = np.stack([defected, np.ones(len(defected), dtype=bool)]).astype(np.int32)
+        machines.append(LocalStateMachine(i, watched, transitions, np.array([0, 1], dtype=np.int64)))
+    return machines
+
+
+def punish_trust_gain_state_machines(n, edges, punish_num, trust_gain_num):
+    """
+    Punishment and "gaining trust back" in a network, like the strategies of create_three_players_state_machines:
+    every player cooperates in state 0 until he or one of his neighbors defects. He then defects for punish_num steps,
+    and then cooperates for trust_gain_num steps in which his neighbors have to cooperate as well, or the punishment
+    starts again, before he returns to state 0. Every player has 1 + punish_num + trust_gain_num states.
+
+    :param n: The number of players.
+    :param edges: The edges of the network, see network_edges.
+    :param punish_num: The number of steps of punishment, at least 1.
+    :param trust_gain_num: The number of steps of "gaining trust back".
+
+    :return: A list with the LocalStateMachine of every player.
+    """
+    if punish_num < 1:
+        raise ValueError("punish_num must be at least 1, not %d" % punish_num)
+    num_states = 1 + punish_num + trust_gain_num
+    trust_states = np.arange(1 + punish_num, num_states)
+    strategy = np.full(num_states, PD_ACTIONS.index("D"), dtype=np.int64)
+    strategy[0] = strategy[trust_states] = PD_ACTIONS.index("C")
+
+    machines = []
+    for i, neighbors in enumerate(network_neighbors(n, edges)):
+        watched = np.union1d([i], neighbors)
+        defections = _local_defections(watched)
+        # every state goes on to the next one, and the last one back to state 0
+        transitions = np.repeat(((np.arange(num_states) + 1) % num_states)[:, None], len(defections), axis=1)
+        transitions[0] = np.where(defections.any(axis=1), 1, 0)
+        neighbor_defected = defections[:, watched != i].any(axis=1)
+        transitions[trust_states] = np.where(neighbor_defected, 1, transitions[trust_states])
+        machines.append(LocalStateMachine(i, watched, transitions.astype(np.int32), strategy))
+    return machines
@@ -0,0 +1,119 @@
+import json
+import os
+
+import numpy as np
+
+from build_joint_state_machine import JointStateMachineArrays
+
+# The file starts with MAGIC, the version and the length of a JSON header as little-endian uint64, then the header,
+# which gives the players' actions, whether the machine is unilateral and the dtype, shape and offset of every array,
+# and then the raw arrays in C order, each aligned to ALIGNMENT bytes.
+MAGIC = b"SPEJOINT"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREFIX = np.dtype([("magic", "S8"), ("version", "<u8"), ("header_size", "<u8")])
+_ARRAYS = ("states", "transitions", "strategy")
+_ROWS_PER_CHUNK = 1 << 16
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_arrays(path, metadata: dict, arrays: dict):
+    """
+    Write arrays in the joint machine file format. The arrays are written a chunk of rows at a time, so they may be
+    memory-mapped arrays larger than the memory.
+
+    :param path: The path of the file.
+    :param metadata: A dict of JSON values to keep in the header.
+    :param arrays: A dict from names to arrays.
+    """
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": np.dtype(array.dtype).newbyteorder("<").str, "shape": list(array.shape),
+                        "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps(dict(metadata, arrays=layout)).encode()
+    data_start = _aligned(_PREFIX.itemsize + len(header))
+
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "wb") as file:
+        np.array((MAGIC, FORMAT_VERSION, len(header)), dtype=_PREFIX).tofile(file)
+        file.write(header)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]["offset"])
+            rows = array if np.ndim(array) != 0 else np.reshape(array, 1)
+            for first in range(0, len(rows), _ROWS_PER_CHUNK):
+                chunk = np.asarray(rows[first:first + _ROWS_PER_CHUNK], dtype=layout[name]["dtype"])
+                file.write(np.ascontiguousarray(chunk).data)
+        file.truncate(data_start + offset)
+    os.replace(temp_path, path)
+
+
+def read_arrays(path, mmap=True):
+    """
+    Read a file written by write_arrays.
+
+    :param path: The path of the file.
+    :param mmap: If True, the arrays are read-only memory maps of the file, which open instantly no matter the size of
+    the file, and are shared between all the processes that open the same file. Otherwise they are read to memory.
+
+    :return: (metadata, arrays), the header and a dict from names to arrays.
+    """
+    prefix = np.fromfile(path, dtype=_PREFIX, count=1)
+    if len(prefix) == 0 or prefix["magic"][0] != MAGIC:
+        raise ValueError("%s is not a joint state machine file" % path)
+    if prefix["version"][0] > FORMAT_VERSION:
+        raise ValueError("%s has version %d, newer than the supported version %d"
+                         % (path, prefix["version"][0], FORMAT_VERSION))
+    with open(path, "rb") as file:
+        file.seek(_PREFIX.itemsize)
+        metadata = json.loads(file.read(int(prefix["header_size"][0])))
+    data_start = _aligned(_PREFIX.itemsize + int(prefix["header_size"][0]))
+
+    arrays = {}
+    for name, layout in metadata.pop("arrays").items():
+        dtype, shape, offset = np.dtype(layout["dtype"]), tuple(layout["shape"]), data_start + layout["offset"]
+        if int(np.prod(shape)) == 0:  # memmap can't map an empty range
+            arrays[name] = np.empty(shape, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        else:
+            arrays[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    return metadata, arrays
+
+
+def save_joint_state_machine(path, joint: JointStateMachineArrays, values=None):
+    """
+    Save an array-backed joint strategy state machine in a compact binary file, see load_joint_state_machine.
+
+    :param path: The path of the file.
+    :param joint: The joint strategy state machine, as returned by construct_joint_state_machine(..., as_arrays=True)
+    or joint_state_machine_to_arrays.
+    :param values: An optional array to keep with the machine, like the long term utilities of its joint states.
+    """
+    arrays = {name: getattr(joint, name) for name in _ARRAYS}
+    if values is not None:
+        arrays["values"] = np.asarray(values)
+    metadata = {"players_actions": [list(actions) for actions in joint.players_actions],
+                "unilateral": bool(joint.unilateral)}
+    write_arrays(path, metadata, arrays)
+
+
+def load_joint_state_machine(path, mmap=True):
+    """
+    Load a joint strategy state machine saved by save_joint_state_machine. By default the arrays are memory-mapped
+    read-only, so a large machine opens instantly, its pages are read only when they are used, and the processes that
+    check the same file share them.
+
+    :param path: The path of the file.
+    :param mmap: If False, read the arrays to memory instead.
+
+    :return: (joint, values), the JointStateMachineArrays, and the values saved with it or None.
+    """
+    metadata, arrays = read_arrays(path, mmap)
+    players_actions = tuple(tuple(actions) for actions in metadata["players_actions"])
+    joint = JointStateMachineArrays(*(arrays[name] for name in _ARRAYS), players_actions, metadata["unilateral"])
+    return joint, arrays.get("values")
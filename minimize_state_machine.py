@@ -0,0 +1,217 @@
+import numpy as np
+
+
+def bfs_order(table, initial_state=0):
+    """
+    :param table: An int array of shape (n_states, n_profiles), table[q][a] is the state that the state machine goes
+    to from state q after the action profile a.
+    :param initial_state: The state to start from.
+
+    :return: An int array, the states reachable from initial_state in BFS order, where the successors of every level
+    are discovered in the order of the states and the profiles.
+    """
+    seen = np.zeros(len(table), dtype=bool)
+    frontier = np.array([initial_state], dtype=np.int64)
+    seen[frontier] = True
+    order = [frontier]
+    while len(frontier) != 0:
+        successors, first = np.unique(table[frontier].ravel(), return_index=True)
+        successors = successors[np.argsort(first)]
+        frontier = successors[~seen[successors]]
+        seen[frontier] = True
+        order.append(frontier)
+    return np.concatenate(order)
+
+
+def refine_partition(table, outputs):
+    """
+    Hopcroft's partition refinement. The states start grouped by the action they play, and a worklist of splitter
+    groups splits the groups whose states go into a splitter after different sets of action profiles. Only the states
+    that go into a splitter are touched, and of the pieces of a split group only the smaller ones become splitters,
+    so long chains of states, like those of punishments, take O(n log n) steps instead of a round per state.
+
+    :param table: An int array of shape (n_states, n_profiles), see bfs_order.
+    :param outputs: An int array, the action played in every state.
+
+    :return: An int array, the group of every state, where the groups are numbered in the order of their first
+    states. Two states are in the same group if and only if they play the same actions after every sequence of action
+    profiles.
+    """
+    table = np.asarray(table, dtype=np.int64)
+    num_states, num_profiles = table.shape
+    labels = np.unique(outputs, return_inverse=True)[1].ravel().astype(np.int64)
+    if num_states == 0:
+        return labels
+
+    # the states of every group are elements[starts[g]:ends[g]], and positions is the inverse of elements
+    elements = np.argsort(labels, kind="stable")
+    positions = np.empty(num_states, dtype=np.int64)
+    positions[elements] = np.arange(num_states)
+    sizes = np.bincount(labels)
+    ends = np.cumsum(sizes).tolist()
+    starts = [end - size for end, size in zip(ends, sizes.tolist())]
+
+    # the transitions into every state, as positions in table.ravel()
+    targets = table.ravel()
+    into = np.argsort(targets, kind="stable")
+    into_starts = np.concatenate([[0], np.cumsum(np.bincount(targets, minlength=num_states))])
+
+    # every group but a largest one is a splitter at first, since the rest of the states is split by the others
+    pending = [group for group in range(len(starts)) if group != int(np.argmax(sizes))]
+    is_pending = [True] * len(starts)
+    is_pending[int(np.argmax(sizes))] = False
+    marked = np.zeros(num_states, dtype=bool)
+    while pending:
+        splitter = pending.pop()
+        is_pending[splitter] = False
+        members = elements[starts[splitter]:ends[splitter]]
+        counts = into_starts[members + 1] - into_starts[members]
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        offsets = np.arange(total) + np.repeat(into_starts[members] - (np.cumsum(counts) - counts), counts)
+        sources = np.unique(into[offsets] // num_profiles)
+
+        # group the sources by their group and by the action profiles that lead them into the splitter
+        marked[members] = True
+        signatures = np.packbits(marked[table[sources]], axis=1)
+        marked[members] = False
+        groups = labels[sources]
+        order = np.lexsort(tuple(signatures.T) + (groups,))
+        sources, groups, signatures = sources[order], groups[order], signatures[order]
+        boundaries = np.flatnonzero((groups[1:] != groups[:-1]) | np.any(signatures[1:] != signatures[:-1], axis=1)) + 1
+        boundaries = np.concatenate([[0], boundaries, [len(sources)]]).tolist()
+
+        first = 0
+        while first < len(boundaries) - 1:
+            group = int(groups[boundaries[first]])
+            last = first + 1
+            while last < len(boundaries) - 1 and groups[boundaries[last]] == group:
+                last += 1
+            low, high = boundaries[first], boundaries[last]
+            split = [boundaries[k] - low for k in range(first, last + 1)]
+            first = last
+            start, end = starts[group], ends[group]
+            if high - low == end - start and len(split) == 2:
+                continue
+
+            # move the sources to the end of the group, ordered by their signatures
+            moved = sources[low:high]
+            tail = end - len(moved)
+            holes = positions[moved]
+            holes = holes[holes < tail]
+            if len(holes) != 0:
+                marked[moved] = True
+                intruders = elements[tail:end]
+                intruders = intruders[~marked[intruders]]
+                marked[moved] = False
+                elements[holes] = intruders
+                positions[intruders] = holes
+            elements[tail:end] = moved
+            positions[moved] = np.arange(tail, end)
+
+            pieces = [(tail + split[k], tail + split[k + 1]) for k in range(len(split) - 1)]
+            if tail > start:
+                pieces.insert(0, (start, tail))
+            ends[group] = pieces[0][1]
+            ids = [group]
+            for piece_start, piece_end in pieces[1:]:
+                ids.append(len(starts))
+                labels[elements[piece_start:piece_end]] = len(starts)
+                starts.append(piece_start)
+                ends.append(piece_end)
+                is_pending.append(False)
+            if not is_pending[group]:
+                largest = max(range(len(pieces)), key=lambda k: pieces[k][1] - pieces[k][0])
+                ids.pop(largest)
+            for piece in ids:
+                if not is_pending[piece]:
+                    is_pending[piece] = True
+                    pending.append(piece)
+
+    # number the groups in the order of their first states
+    rename = np.empty(len(starts), dtype=np.int64)
+    rename[np.argsort(np.unique(labels, return_index=True)[1])] = np.arange(len(starts))
+    return rename[labels]
+
+
+def minimize_tables(table, outputs, initial_state=0):
+    """
+    Minimize a strategy state machine given as arrays: drop the states that are unreachable from initial_state and
+    merge the states that play the same actions after every sequence of action profiles.
+
+    :param table: An int array of shape (n_states, n_profiles), see bfs_order.
+    :param outputs: An int array, the action played in every state.
+    :param initial_state: The initial state of the state machine.
+
+    :return: (min_table, min_outputs, state_map, representatives), the minimized state machine, whose states are
+    numbered in BFS order so that 0 is the initial state, state_map[q], the state of the minimized machine that q is
+    merged into, or -1 if q is unreachable, and representatives[k], the first state in BFS order merged into k.
+    """
+    table = np.asarray(table, dtype=np.int64)
+    outputs = np.asarray(outputs)
+    reachable = bfs_order(table, initial_state)
+    position = np.full(len(table), -1, dtype=np.int64)
+    position[reachable] = np.arange(len(reachable))
+    sub_table = position[table[reachable]]
+    labels = refine_partition(sub_table, outputs[reachable])
+
+    # every group is represented by its first state in BFS order, and the groups are numbered in BFS order as well
+    representatives = np.unique(labels, return_index=True)[1]
+    group_table = labels[sub_table[representatives]]
+    order = bfs_order(group_table, labels[0])
+    rename = np.empty(len(order), dtype=np.int64)
+    rename[order] = np.arange(len(order))
+
+    state_map = np.full(len(table), -1, dtype=np.int64)
+    state_map[reachable] = rename[labels]
+    representatives = representatives[order]
+    return rename[group_table[order]], outputs[reachable][representatives], state_map, reachable[representatives]
+
+
+def minimize_state_machine(transition_func: dict, strategy_func: dict, initial_state=0, keep_ids=False):
+    """
+    Minimize a single-player strategy state machine, see minimize_tables.
+
+    :param transition_func: A dict so that transition_func[q][action] when q is a state and 'action' is an action
+    profile returns the state that the state machine goes to from state q after 'action'.
+    :param strategy_func: A dict so that strategy_func[q] returns the action to play in state q.
+    :param initial_state: The initial state of the state machine.
+    :param keep_ids: If True, every state of the minimized machine keeps the id of the first original state in BFS
+    order that is merged into it, so initial_state keeps its id, instead of renumbering the states 0, ..., n - 1.
+
+    :return: (transition_func, strategy_func, state_map), the minimized state machine in the same format, with the
+    states 0, ..., n - 1 where 0 is the initial state, and state_map[q], the state of the minimized machine that
+    every reachable state q of the original machine is merged into.
+    """
+    states = list(transition_func.keys())
+    position = {q: k for k, q in enumerate(states)}
+    profiles = list(transition_func[initial_state].keys())
+    actions = list(dict.fromkeys(strategy_func[q] for q in states))
+    action_codes = {action: k for k, action in enumerate(actions)}
+    table = np.array([[position[transition_func[q][action]] for action in profiles] for q in states], dtype=np.int64)
+    outputs = np.array([action_codes[strategy_func[q]] for q in states], dtype=np.int64)
+
+    min_table, min_outputs, state_map, representatives = minimize_tables(table, outputs, position[initial_state])
+    ids = [states[q] for q in representatives.tolist()] if keep_ids else list(range(len(min_table)))
+    min_transition = {ids[q]: {action: ids[k] for action, k in zip(profiles, row)}
+                      for q, row in enumerate(min_table.tolist())}
+    min_strategy = {ids[q]: actions[action] for q, action in enumerate(min_outputs.tolist())}
+    return min_transition, min_strategy, {q: ids[state] for q, state in zip(states, state_map.tolist()) if state >= 0}
+
+
+def minimize_state_machines(transition_funcs: list, strategy_funcs: list):
+    """
+    Minimize the state machines of all the players before constructing their joint state machine, keeping the ids of
+    the original states, see minimize_state_machine.
+
+    :param transition_funcs: transition_funcs[i] is the transition function of player i, with the initial state 0.
+    :param strategy_funcs: strategy_funcs[i] is the strategy function of player i.
+
+    :return: (transition_funcs, strategy_funcs, state_maps), the minimized state machines, and state_maps[i][q], the
+    state that the state q of player i is merged into.
+    """
+    minimized = [minimize_state_machine(transition_func, strategy_func, keep_ids=True)
+                 for transition_func, strategy_func in zip(transition_funcs, strategy_funcs)]
+    return [machine[0] for machine in minimized], [machine[1] for machine in minimized], \
+        [machine[2] for machine in minimized]
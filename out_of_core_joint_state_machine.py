@@ -0,0 +1,281 @@
+import os
+import tempfile
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from build_joint_state_machine import (JointStateMachineArrays, action_profile_strides, deviation_profiles,
+                                       minimize_players_state_machines, ordered_actions, single_player_successors,
+                                       single_player_tables)
+from joint_state_machine_file import load_joint_state_machine, save_joint_state_machine
+from phase_stats import count, phase, record_max
+from run_control import checkpoint, state_budget
+
+_MERGE_CHUNK = 1 << 20
+
+
+class SpillArray:
+    """
+    An array that rows are appended to, kept in memory until they take more than budget bytes, and then appended to
+    a raw file on disk, so only the last rows are in memory.
+    """
+
+    def __init__(self, path, dtype, row_shape=(), budget=1 << 26):
+        """
+        :param path: The path of the file to spill to.
+        :param dtype: The dtype of the array.
+        :param row_shape: The shape of every row.
+        :param budget: The maximal size in bytes of the rows kept in memory.
+        """
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.budget = budget
+        self.length = 0
+        self._spilled = 0
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        self._buffer.append(rows)
+        self._buffered_bytes += rows.nbytes
+        self.length += len(rows)
+        if self._buffered_bytes > self.budget:
+            self._spill()
+
+    def _spill(self):
+        with open(self.path, "ab") as file:
+            for rows in self._buffer:
+                file.write(np.ascontiguousarray(rows).data)
+        self._spilled = self.length
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def _file_rows(self, first, last):
+        row_size = self.dtype.itemsize * int(np.prod(self.row_shape))
+        count = (last - first) * int(np.prod(self.row_shape))
+        return np.fromfile(self.path, dtype=self.dtype, count=count, offset=first * row_size).reshape(
+            (-1,) + self.row_shape)
+
+    def read(self, first, last):
+        """
+        :return: The rows first, ..., last - 1, read from the disk or from memory.
+        """
+        parts = []
+        if first < self._spilled:
+            parts.append(self._file_rows(first, min(last, self._spilled)))
+        if last > self._spilled:
+            if len(self._buffer) > 1:
+                self._buffer = [np.concatenate(self._buffer)]
+            parts.append(self._buffer[0][max(first - self._spilled, 0):last - self._spilled])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def array(self):
+        """
+        :return: All the rows, in memory if they were never spilled, and otherwise as a read-only memory map of the
+        file.
+        """
+        if self._spilled == 0:
+            return np.concatenate(self._buffer) if self._buffer else np.empty((0,) + self.row_shape, self.dtype)
+        if self._buffer:
+            self._spill()
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.length,) + self.row_shape)
+
+
+def merge_sorted_runs(runs, keys_out, ids_out):
+    """
+    Merge sorted runs of (keys, ids) into keys_out and ids_out a chunk at a time, so the runs and the output may be
+    memory-mapped arrays larger than the memory. The keys of the runs must be disjoint.
+    """
+    positions = [0] * len(runs)
+    written = 0
+    while written < len(keys_out):
+        # every step takes the keys up to the smallest chunk boundary, which is at most _MERGE_CHUNK keys of every run
+        bounds = [keys[position + _MERGE_CHUNK - 1] for (keys, ids), position in zip(runs, positions)
+                  if position + _MERGE_CHUNK <= len(keys)]
+        ends = [int(np.searchsorted(keys, min(bounds), side="right")) if bounds else len(keys) for keys, ids in runs]
+        keys = np.concatenate([run[0][position:end] for run, position, end in zip(runs, positions, ends)])
+        ids = np.concatenate([run[1][position:end] for run, position, end in zip(runs, positions, ends)])
+        order = np.argsort(keys, kind="stable")
+        keys_out[written:written + len(keys)] = keys[order]
+        ids_out[written:written + len(keys)] = ids[order]
+        written += len(keys)
+        positions = ends
+
+
+class StateIndex:
+    """
+    The visited joint states of the out-of-core construction, as a map from integer keys to joint state ids. New
+    states are added in small sorted runs in memory, which are merged into a sorted run on disk when they take more
+    than budget bytes. Runs of similar sizes on disk are merged, so there are only logarithmically many runs to search.
+    """
+
+    def __init__(self, directory, budget=1 << 26):
+        """
+        :param directory: The directory of the runs on disk.
+        :param budget: The maximal size in bytes of the runs kept in memory.
+        """
+        self.directory = directory
+        self.budget = budget
+        self._memory_runs = []
+        self._memory_bytes = 0
+        self._disk_runs = []
+        self._num_files = 0
+
+    def lookup(self, keys):
+        """
+        :param keys: A sorted int64 array of distinct keys.
+
+        :return: An int64 array, the id of every key, or -1 for the keys that were never added.
+        """
+        ids = np.full(len(keys), -1, dtype=np.int64)
+        for run_keys, run_ids in self._disk_runs + self._memory_runs:
+            if len(run_keys) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(run_keys, keys), len(run_keys) - 1)
+            found = run_keys[positions] == keys
+            ids[found] = run_ids[positions[found]]
+        return ids
+
+    def add(self, keys, ids):
+        """
+        :param keys: A sorted int64 array of keys that aren't in the index.
+        :param ids: The ids of the keys.
+        """
+        self._memory_runs.append((keys, ids))
+        self._memory_bytes += keys.nbytes + ids.nbytes
+        if len(self._memory_runs) > 16:
+            self._memory_runs = [self._merge(self._memory_runs, on_disk=False)]
+        if self._memory_bytes > self.budget:
+            self._disk_runs.append(self._merge(self._memory_runs, on_disk=True))
+            self._memory_runs = []
+            self._memory_bytes = 0
+            while len(self._disk_runs) > 1 and len(self._disk_runs[-2][0]) <= 2 * len(self._disk_runs[-1][0]):
+                self._disk_runs[-2:] = [self._merge(self._disk_runs[-2:], on_disk=True)]
+
+    def _merge(self, runs, on_disk):
+        size = sum(len(keys) for keys, ids in runs)
+        if not on_disk:
+            keys_out, ids_out = np.empty(size, dtype=np.int64), np.empty(size, dtype=np.int64)
+        else:
+            self._num_files += 1
+            paths = [os.path.join(self.directory, "index_%d_%s.npy" % (self._num_files, name))
+                     for name in ("keys", "ids")]
+            keys_out, ids_out = (open_memmap(path, mode="w+", dtype=np.int64, shape=(size,)) for path in paths)
+        merge_sorted_runs(runs, keys_out, ids_out)
+        for keys, ids in runs:
+            if isinstance(keys, np.memmap):
+                os.remove(keys.filename)
+                os.remove(ids.filename)
+        if on_disk:
+            keys_out.flush()
+            ids_out.flush()
+        return keys_out, ids_out
+
+
+def construct_joint_state_machine_out_of_core(players_actions: list, transition_funcs: list, strategy_funcs: list,
+                                              path, unilateral=False, minimize=False, memory_budget=1 << 30,
+                                              work_directory=None, stats=None, control=None, return_state_maps=False):
+    """
+    Algorithm 1 in "Subgame-perfect Cooperation in Networks" for joint state machines that don't fit in memory, see
+    construct_joint_state_machine_arrays. The joint states are explored in BFS order a chunk at a time. The BFS queue,
+    which is the joint states found so far, and the transition rows spill to disk once they outgrow their share of
+    the memory budget, and the visited joint states are kept in a StateIndex. The result is written to path in the
+    format of save_joint_state_machine.
+
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+    :param transition_funcs: The transition functions of the single player state machines, see
+    construct_joint_state_machine.
+    :param strategy_funcs: The strategy functions of the single player state machines, see
+    construct_joint_state_machine.
+    :param path: The path of the output file.
+    :param unilateral: see construct_joint_state_machine.
+    :param minimize: see construct_joint_state_machine.
+    :param return_state_maps: see construct_joint_state_machine.
+    :param memory_budget: The approximate number of bytes of memory to use, besides the single player state machines.
+    :param work_directory: The directory of the temporary files, the directory of path by default.
+    :param stats: An optional PhaseStats, that records the "minimize", "construct" and "save" phases, the number of
+    "joint_states" and the high-water mark of the BFS queue, "bfs_queue_max", see phase_stats.
+    :param control: An optional RunControl, that gets the progress of the BFS and stops it with RunAborted when it is
+    cancelled or over its time or state budget, see run_control. It is checked between the chunks, and the temporary
+    files are removed when it stops, so RunAborted has no partial result.
+
+    :return: The joint strategy state machine as a JointStateMachineArrays, memory-mapped from path, see
+    load_joint_state_machine, or (joint machine, state_maps) if return_state_maps is True.
+    """
+    state_maps = None
+    if minimize:
+        with phase(stats, "minimize"):
+            transition_funcs, strategy_funcs, state_maps = minimize_players_state_machines(transition_funcs,
+                                                                                           strategy_funcs)
+    players_actions = ordered_actions(players_actions)
+    num_players = len(players_actions)
+    strides = action_profile_strides(players_actions)
+    state_ids, tables, actions, watched = single_player_tables(players_actions, transition_funcs, strategy_funcs)
+
+    # a joint state is keyed by the mixed-radix integer of the positions of the states of the players
+    radices = [len(ids) for ids in state_ids]
+    if np.prod(np.array(radices, dtype=float)) >= 2 ** 63:
+        raise ValueError("The joint states can't be keyed by 64 bit integers")
+    key_strides = np.ones(num_players, dtype=np.int64)
+    for i in range(num_players - 2, -1, -1):
+        key_strides[i] = key_strides[i + 1] * radices[i + 1]
+    num_columns = 1 + sum(len(actions) - 1 for actions in players_actions) if unilateral else int(
+        np.prod([len(actions) for actions in players_actions]))
+    # successors, their keys and the temporaries of np.unique for a quarter of the budget
+    chunk_size = max(1, memory_budget // 4 // (num_columns * (4 * num_players + 32)))
+
+    with tempfile.TemporaryDirectory(dir=work_directory or os.path.dirname(os.path.abspath(path))) as directory:
+        spill_budget = memory_budget // 16
+        local_states = SpillArray(os.path.join(directory, "local_states"), np.int32, (num_players,), spill_budget)
+        states = SpillArray(os.path.join(directory, "states"), np.int64, (num_players,), spill_budget)
+        strategy = SpillArray(os.path.join(directory, "strategy"), np.int64, (), spill_budget)
+        transitions = SpillArray(os.path.join(directory, "transitions"), np.int32, (num_columns,), spill_budget)
+        index = StateIndex(directory, memory_budget // 4)
+
+        def add_states(local):
+            local_states.append(local)
+            states.append(np.stack([np.asarray(state_ids[i])[local[:, i]] for i in range(num_players)], axis=-1))
+            strategy.append(sum(actions[i][local[:, i]] * strides[i] for i in range(num_players)))
+
+        # the initial states of the state machines are 0
+        initial_state = np.array([[state_ids[i].index(0) for i in range(num_players)]], dtype=np.int32)
+        index.add(initial_state.astype(np.int64) @ key_strides, np.zeros(1, dtype=np.int64))
+        add_states(initial_state)
+
+        first = 0
+        with phase(stats, "construct"):
+            while first < local_states.length:
+                record_max(stats, "bfs_queue_max", local_states.length - first)
+                checkpoint(control, "construct", first, local_states.length - first, local_states.length)
+                frontier = local_states.read(first, min(first + chunk_size, local_states.length))
+                first += len(frontier)
+                if unilateral:
+                    profiles = sum(actions[i][frontier[:, i]] * strides[i] for i in range(num_players))
+                    profiles = np.column_stack([profiles, deviation_profiles(profiles, players_actions)])
+                else:
+                    profiles = np.arange(num_columns)[None]
+                successors = single_player_successors(players_actions, tables, watched, frontier, profiles)
+                keys = successors.astype(np.int64) @ key_strides
+                unique_keys, inverse = np.unique(keys, return_inverse=True)
+
+                ids = index.lookup(unique_keys)
+                new = np.flatnonzero(ids < 0)
+                ids[new] = local_states.length + np.arange(len(new))
+                index.add(unique_keys[new], ids[new])
+                transitions.append(ids[inverse.ravel()].reshape(keys.shape))
+                add_states(((unique_keys[new, None] // key_strides) % radices).astype(np.int32))
+                if local_states.length > state_budget(control):
+                    checkpoint(control, "construct", first, local_states.length - first, local_states.length)
+            checkpoint(control, "construct", first, 0, local_states.length)
+
+        joint = JointStateMachineArrays(states.array(), transitions.array(), strategy.array(), players_actions,
+                                        unilateral)
+        count(stats, "joint_states", len(joint.strategy))
+        with phase(stats, "save"):
+            save_joint_state_machine(path, joint)
+        del joint
+    if return_state_maps:
+        return load_joint_state_machine(path)[0], state_maps
+    return load_joint_state_machine(path)[0]
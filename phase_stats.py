@@ -0,0 +1,120 @@
+import contextlib
+import json
+import time
+
+import numpy as np
+
+# the context of the phases when there are no stats, which is reentrant so a single one serves every phase
+_NO_PHASE = contextlib.nullcontext()
+
+
+class PhaseStats:
+    """
+    Opt-in instrumentation of the algorithms: the wall time and number of runs of every phase, like the construction
+    of the joint machine, the on-path structure, the long term utilities, the deviations and the best-response
+    iterations, and counters like the number of joint states discovered, the high-water mark of the BFS queue, the
+    cycles of the path of play and their lengths, the deviations checked and the best-response iterations.
+
+    The algorithms take it as stats=None, and don't record anything (or pay for the recording) unless it is given.
+    Phases may be nested, e.g. "long_term_util" is timed inside "check_SPE", and a phase that runs several times adds
+    up its times.
+    """
+
+    def __init__(self, callback=None):
+        """
+        :param callback: If given, a function that is called as callback(name, seconds) whenever a phase ends.
+        """
+        self.callback = callback
+        self.phases = {}
+        self.counters = {}
+        self.histograms = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        A context manager that times a phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            phase = self.phases.setdefault(name, {"time": 0.0, "calls": 0})
+            phase["time"] += seconds
+            phase["calls"] += 1
+            if self.callback is not None:
+                self.callback(name, seconds)
+
+    def count(self, name, value=1):
+        """
+        Add value to a counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def record_max(self, name, value):
+        """
+        Raise a counter to value, if it is smaller, for high-water marks.
+        """
+        self.counters[name] = max(self.counters.get(name, 0), int(value))
+
+    def record_histogram(self, name, values):
+        """
+        Add values, an array of ints, to a histogram from every value to the number of times it was recorded.
+        """
+        histogram = self.histograms.setdefault(name, {})
+        for value, times in zip(*(column.tolist() for column in np.unique(values, return_counts=True))):
+            histogram[value] = histogram.get(value, 0) + times
+
+    def to_dict(self):
+        """
+        :return: The phases, counters and histograms as a dict of plain values, where the keys of the histograms are
+        strings as in JSON.
+        """
+        return {"phases": {name: dict(phase) for name, phase in self.phases.items()},
+                "counters": dict(self.counters),
+                "histograms": {name: {str(value): times for value, times in sorted(histogram.items())}
+                               for name, histogram in self.histograms.items()}}
+
+    def to_json(self, **kwargs):
+        """
+        :param kwargs: Passed to json.dumps, e.g. indent.
+
+        :return: The stats as a JSON string, see to_dict.
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def phase(stats, name):
+    """
+    :param stats: A PhaseStats, or None to record nothing.
+    :param name: The name of the phase.
+
+    :return: A context manager that times the phase in stats.
+    """
+    if stats is None:
+        return _NO_PHASE
+    return stats.phase(name)
+
+
+def count(stats, name, value=1):
+    """
+    Add value to a counter of stats, if it isn't None.
+    """
+    if stats is not None:
+        stats.count(name, value)
+
+
+def record_max(stats, name, value):
+    """
+    Raise a counter of stats to value, if stats isn't None.
+    """
+    if stats is not None:
+        stats.record_max(name, value)
+
+
+def record_histogram(stats, name, values):
+    """
+    Add values to a histogram of stats, if it isn't None.
+    """
+    if stats is not None:
+        stats.record_histogram(name, values)
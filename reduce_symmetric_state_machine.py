@@ -0,0 +1,329 @@
+import itertools
+from collections import Counter, deque
+from typing import NamedTuple
+
+import numpy as np
+
+from build_joint_state_machine import (action_profile_strides, deviation_players, deviation_profiles,
+                                       local_action_profiles, ordered_actions, single_player_successors,
+                                       single_player_tables)
+from run_control import checkpoint, state_budget
+
+# the number of successor entries and their images that the orbit construction canonicalizes at a time
+_EXPAND_CHUNK = 1 << 20
+
+
+class OrbitStateMachine(NamedTuple):
+    """
+    A joint strategy state machine reduced by the symmetries of the game and the strategies, with one joint state for
+    every orbit of joint states, see construct_orbit_state_machine.
+
+    states: int array of shape (n_orbits, n_players), the representative joint state of every orbit, made of the
+    original states of the players. The orbit 0 is the initial joint state.
+    strategy: int array of shape (n_orbits,), the action profile played in the representative of every orbit.
+    transitions: int array of shape (n_orbits, 1 + n_deviations), the orbits of the joint states that the
+    representatives go to after the on-path profile (column 0) and after the profiles of
+    deviation_profiles(strategy, players_actions).
+    permutations: int array of shape (n_orbits, 1 + n_deviations, n_players), the symmetries that map the joint states
+    reached to the representatives of their orbits: player i in the joint state reached is in the same situation as
+    player permutations[s][k][i] in the representative, so he has the same long term utility.
+    players_actions: players_actions[i] is the ordered tuple of possible actions for player i.
+    """
+    states: np.ndarray
+    transitions: np.ndarray
+    strategy: np.ndarray
+    permutations: np.ndarray
+    players_actions: tuple
+
+
+def _graph_automorphisms(n, games, players_actions, compatible):
+    """
+    The backtracking of game_graph_automorphisms, which yields the automorphisms one at a time.
+    """
+    perm = []
+    candidates = [iter(range(n))]
+    while len(candidates) != 0:
+        j = next(candidates[-1], None)
+        if j is None:
+            candidates.pop()
+            if len(perm) != 0:
+                perm.pop()
+            continue
+
+        i = len(perm)
+        if j in perm or players_actions[i] != players_actions[j] or (compatible is not None and not compatible[i][j]):
+            continue
+        if games.get((i, i)) != games.get((j, j)) or any(
+                games.get((k, i)) != games.get((perm[k], j)) or games.get((i, k)) != games.get((j, perm[k]))
+                for k in range(i)):
+            continue
+
+        perm.append(j)
+        if len(perm) == n:
+            yield np.array(perm, dtype=np.int64)
+            perm.pop()
+        else:
+            candidates.append(iter(range(n)))
+
+
+def game_graph_automorphisms(n: int, games: dict, players_actions, compatible=None, max_automorphisms=None):
+    """
+    Find the permutations of the players that map the graph of the players onto itself, with the same game on every
+    edge and its image, by backtracking over the image of one player at a time.
+
+    :param n: The number of players.
+    :param games: A dictionary mapping edges to the matching two player game, with both directions of every edge.
+    :param players_actions: The ordered actions of every player.
+    :param compatible: An optional bool array of shape (n, n), False where player i can't be mapped to player j.
+    :param max_automorphisms: If given, stop after finding this many automorphisms, e.g. a clique of n players has n!.
+
+    :return: A list of int arrays, where perm[i] is the player that player i is mapped to. The first one is the
+    identity.
+    """
+    return list(itertools.islice(_graph_automorphisms(n, games, players_actions, compatible), max_automorphisms))
+
+
+def permute_action_profiles(profiles, perm, players_actions):
+    """
+    :param profiles: An int array of encoded action profiles.
+    :param perm: A permutation of the players, that keeps their actions.
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+
+    :return: An int array, the action profiles where player perm[i] plays the action of player i.
+    """
+    profiles = np.asarray(profiles, dtype=np.int64)
+    strides = action_profile_strides(players_actions)
+    permuted = np.zeros(profiles.shape, dtype=np.int64)
+    for i, j in enumerate(np.asarray(perm).tolist()):
+        permuted += (profiles // strides[i]) % len(players_actions[i]) * strides[j]
+    return permuted
+
+
+def permuted_columns(perm, player, players_actions, watched):
+    """
+    :param perm: A permutation of the players.
+    :param player: A player.
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+    :param watched: The watched players of the tables, see single_player_tables.
+
+    :return: (columns, other_columns), int arrays of the columns of the tables of player and of player perm[player]
+    that are the same action profile before and after the permutation, or None if the two players can't match because
+    they watch players that the permutation doesn't map onto each other.
+    """
+    own, other = watched[player], watched[perm[player]]
+    if own is not None and other is not None:
+        if not np.array_equal(np.sort(perm[own]), other):
+            return None
+        # the local profiles of player, spread over the watched players in the profiles of all the players
+        strides = action_profile_strides(players_actions)
+        profiles = np.zeros(1, dtype=np.int64)
+        for j in own.tolist():
+            profiles = (profiles[:, None] + np.arange(len(players_actions[j])) * strides[j]).ravel()
+        return np.arange(len(profiles)), local_action_profiles(permute_action_profiles(profiles, perm, players_actions),
+                                                               players_actions, other)
+    profiles = np.arange(np.prod([len(actions) for actions in players_actions]))
+    permuted = permute_action_profiles(profiles, perm, players_actions)
+    return (profiles if own is None else local_action_profiles(profiles, players_actions, own),
+            permuted if other is None else local_action_profiles(permuted, players_actions, other))
+
+
+def machine_isomorphism(perm, player, players_actions, tables, actions, watched, initial_states):
+    """
+    Check whether player perm[player] plays in the permuted game like player plays in the original game, by walking
+    on both state machines together from their initial states, a BFS level at a time.
+
+    :param perm: A permutation of the players.
+    :param player: A player.
+    :param players_actions: The ordered actions of every player, as returned by ordered_actions.
+    :param tables: actions: watched: The tables of the players, see single_player_tables.
+    :param initial_states: The position of the initial state of every player in his table.
+
+    :return: An int array from the positions of the states of player to the positions of the matching states of
+    player perm[player], -1 for the states that aren't reachable, or None if the state machines don't match.
+    """
+    other_player = perm[player]
+    columns = permuted_columns(perm, player, players_actions, watched)
+    num_states = len(tables[player])
+    if columns is None or num_states != len(tables[other_player]):
+        return None
+    mapping = np.full(num_states, -1, dtype=np.int64)
+    mapped = np.zeros(num_states, dtype=bool)
+    mapping[initial_states[player]] = initial_states[other_player]
+    mapped[initial_states[other_player]] = True
+    frontier = np.array([initial_states[player]])
+    while len(frontier) != 0:
+        if np.any(actions[player][frontier] != actions[other_player][mapping[frontier]]):
+            return None
+        # the pairs of states that the two machines go to together, as sorted codes state * num_states + other_state
+        pairs = np.unique(tables[player][frontier][:, columns[0]].astype(np.int64) * num_states +
+                          tables[other_player][mapping[frontier]][:, columns[1]])
+        states, other_states = np.divmod(pairs, num_states)
+        # a state can only match one state, and the other way around
+        if np.any(states[1:] == states[:-1]) or np.bincount(other_states, minlength=num_states).max() > 1:
+            return None
+        known = mapping[states] != -1
+        if np.any(mapping[states[known]] != other_states[known]) or np.any(mapped[other_states[~known]]):
+            return None
+        frontier = states[~known]
+        mapping[frontier] = other_states[~known]
+        mapped[other_states[~known]] = True
+    return mapping
+
+
+def strategy_automorphisms(n: int, games: dict, transition_funcs: list, strategy_funcs: list, players_actions,
+                           max_automorphisms=None):
+    """
+    Find the symmetries of a network game and the strategies of its players: the automorphisms of the graph of the
+    game that also map the state machine of every player onto the state machine of his image. The state machines are
+    compared in the array form of single_player_tables, so LocalStateMachines aren't expanded.
+
+    :param n: The number of players.
+    :param games: A dictionary mapping edges to the matching two player game, with both directions of every edge.
+    :param transition_funcs: The transition functions of the single player state machines, or LocalStateMachines.
+    :param strategy_funcs: The strategy functions of the single player state machines, or None with
+    LocalStateMachines.
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+    :param max_automorphisms: If given, only try this many automorphisms of the graph, so a clique of n players doesn't
+    enumerate all of its n!. Any subset of the symmetries gives a correct reduction, only a smaller one.
+
+    :return: A list of (perm, state_maps), where perm is a permutation of the players and state_maps[i] maps the
+    positions of the states of player i in single_player_tables to those of player perm[i], with -1 for the states that
+    aren't reachable. The first one is the identity.
+    """
+    players_actions = ordered_actions(players_actions)
+    state_ids, tables, actions, watched = single_player_tables(players_actions, transition_funcs, strategy_funcs)
+    initial_states = [state_ids[i].index(0) for i in range(n)]
+    # players can only be mapped to players with the same number of states and the same actions in them
+    signatures = [(len(tables[i]), sorted(Counter(actions[i].tolist()).items())) for i in range(n)]
+    compatible = [[signatures[i] == signatures[j] for j in range(n)] for i in range(n)]
+
+    symmetries = []
+    for perm in itertools.islice(_graph_automorphisms(n, games, players_actions, compatible), max_automorphisms):
+        state_maps = []
+        for i in range(n):
+            state_maps.append(machine_isomorphism(perm, i, players_actions, tables, actions, watched, initial_states))
+            if state_maps[-1] is None:
+                break
+        else:
+            symmetries.append((perm, state_maps))
+    return symmetries
+
+
+def canonical_joint_states(local_states, symmetries):
+    """
+    :param local_states: An int array of shape (n_rows, n_players), joint states as the positions of the states of
+    the players in single_player_tables.
+    :param symmetries: The symmetries of the game and the strategies, as returned by strategy_automorphisms.
+
+    :return: (representatives, choices), the lexicographically smallest image of every joint state under the
+    symmetries, and the index in symmetries of the symmetry that maps it there.
+    """
+    representatives = np.array(local_states, copy=True)
+    choices = np.zeros(len(local_states), dtype=np.int64)
+    rows = np.arange(len(local_states))
+    for s, (perm, state_maps) in enumerate(symmetries[1:], 1):
+        image = np.empty_like(representatives)
+        for i, j in enumerate(perm.tolist()):
+            image[:, j] = state_maps[i][local_states[:, i]]
+        differs = image != representatives
+        first = np.argmax(differs, axis=1)
+        smaller = differs[rows, first] & (image[rows, first] < representatives[rows, first])
+        representatives[smaller] = image[smaller]
+        choices[smaller] = s
+    return representatives, choices
+
+
+def construct_orbit_state_machine(players_actions: list, transition_funcs: list, strategy_funcs: list, symmetries,
+                                  unilateral=False, control=None):
+    """
+    Algorithm 1 in "Subgame-perfect Cooperation in Networks", where every joint state found is replaced by the
+    representative of its orbit under the symmetries, so only one joint state of every orbit is explored. Like
+    construct_joint_state_machine_arrays, it expands the states a chunk at a time on the tables of
+    single_player_tables, so LocalStateMachines aren't expanded to dicts.
+
+    :param players_actions: players_actions[i] is a list of possible actions for player i.
+    :param transition_funcs: The transition functions of the single player state machines, or LocalStateMachines,
+    see strategy_automorphisms.
+    :param strategy_funcs: The strategy functions of the single player state machines, or None with
+    LocalStateMachines.
+    :param symmetries: The symmetries of the game and the strategies, as returned by strategy_automorphisms.
+    :param unilateral: If True, only explore the on-path action profile and the unilateral deviations from it, see
+    construct_joint_state_machine.
+    :param control: An optional RunControl, which is checked between the chunks of the BFS, and for the state budget
+    as the orbits are added, like in construct_joint_state_machine_arrays. The transitions of the partial result of
+    RunAborted have rows only for the first orbits, that were expanded.
+
+    :return: The OrbitStateMachine of the strategies.
+    """
+    players_actions = ordered_actions(players_actions)
+    num_players = len(players_actions)
+    strides = action_profile_strides(players_actions)
+    state_ids, tables, actions, watched = single_player_tables(players_actions, transition_funcs, strategy_funcs)
+    num_deviations = len(deviation_players(players_actions))
+    all_profiles = np.arange(np.prod([len(actions) for actions in players_actions]))[None]
+    num_columns = 1 + num_deviations if unilateral else all_profiles.shape[1]
+    step = max(1, _EXPAND_CHUNK // (num_columns * num_players * len(symmetries)))
+    perms = np.array([perm for perm, state_maps in symmetries], dtype=np.int64).reshape(-1, num_players)
+
+    # the initial states of the state machines are 0, and the symmetries keep them
+    initial_state = np.array([[state_ids[i].index(0) for i in range(num_players)]], dtype=np.int32)
+    key_dtype = np.dtype((np.void, 4 * num_players))
+    known = {initial_state[0].tobytes(): 0}
+    local_states = [initial_state]
+    queue = deque(local_states)
+    transition_rows, permutation_rows = [], []
+    expanded = 0
+    max_states = state_budget(control)
+
+    def orbit_machine():
+        found_states = np.concatenate(local_states)
+        states = np.stack([np.asarray(state_ids[i])[found_states[:, i]] for i in range(num_players)], axis=-1)
+        strategy = sum(actions[i][found_states[:, i]] * strides[i] for i in range(num_players))
+        transitions = np.concatenate(transition_rows) if transition_rows else np.empty((0, 1 + num_deviations),
+                                                                                       np.int64)
+        permutations = (np.concatenate(permutation_rows) if permutation_rows else
+                        np.empty((0, 1 + num_deviations, num_players), np.int64))
+        return OrbitStateMachine(states, transitions, strategy, permutations, players_actions)
+
+    while len(queue) != 0:
+        checkpoint(control, "construct", expanded, len(known) - expanded, len(known), orbit_machine)
+        frontier = queue.popleft()
+        if len(frontier) > step:
+            queue.appendleft(frontier[step:])
+            frontier = frontier[:step]
+        strategy = sum(actions[i][frontier[:, i]] * strides[i] for i in range(num_players))
+        columns = np.column_stack([strategy, deviation_profiles(strategy, players_actions)])
+        profiles = columns if unilateral else all_profiles
+        successors = single_player_successors(players_actions, tables, watched, frontier, profiles)
+        rows = np.ascontiguousarray(successors.reshape(-1, num_players))
+        unique_rows, inverse = np.unique(rows.view(key_dtype).ravel(), return_inverse=True)
+        unique_states = np.frombuffer(unique_rows.tobytes(), dtype=np.int32).reshape(-1, num_players)
+        representatives, choices = canonical_joint_states(unique_states, symmetries)
+        representatives = np.ascontiguousarray(representatives, dtype=np.int32)
+
+        unique_ids = np.empty(len(unique_rows), dtype=np.int64)
+        new_states = []
+        for k, key in enumerate(representatives.view(key_dtype).ravel().tolist()):
+            state = known.get(key)
+            if state is None:
+                state = known[key] = len(known)
+                new_states.append(key)
+                if len(known) > max_states:
+                    break
+            unique_ids[k] = state
+        if len(new_states) != 0:
+            local_states.append(np.frombuffer(b"".join(new_states), dtype=np.int32).reshape(-1, num_players))
+        if len(known) > max_states:
+            checkpoint(control, "construct", expanded, len(known) - expanded, len(known), orbit_machine)
+        # every profile is explored, but only the on-path profile and the deviations are stored
+        inverse = inverse.reshape(successors.shape[:2])
+        if not unilateral:
+            inverse = np.take_along_axis(inverse, columns, axis=1)
+        transition_rows.append(unique_ids[inverse])
+        permutation_rows.append(perms[choices[inverse]])
+        expanded += len(frontier)
+        if len(new_states) != 0:
+            queue.append(local_states[-1])
+
+    checkpoint(control, "construct", len(known), 0, len(known))
+    return orbit_machine()
@@ -0,0 +1,143 @@
+import threading
+import time
+from typing import NamedTuple
+
+
+class Progress(NamedTuple):
+    """
+    A report of the progress of a long run, see RunControl.
+
+    phase: The phase that runs, "construct", "check_SPE" or "best_response".
+    done: The number of units of work done, the joint states expanded, the states checked or the best-response
+    iterations.
+    pending: The number of units of work known to be left, the BFS frontier of the construction, or None if unknown.
+    states: The number of joint states found so far.
+    elapsed: The seconds since the RunControl was created.
+    estimated_remaining: The seconds that the pending work takes at the rate of the phase so far, or None if unknown.
+    The construction doesn't know the joint states it hasn't found yet, so it is a lower bound there.
+    """
+    phase: str
+    done: int
+    pending: int
+    states: int
+    elapsed: float
+    estimated_remaining: float
+
+
+class RunAborted(RuntimeError):
+    """
+    Raised when a run is cancelled or exceeds its budget, see RunControl.
+
+    reason: "cancelled", "time" or "states".
+    progress: The Progress of the run when it stopped.
+    partial: The partial result of the run, see the function that was stopped.
+    """
+
+    def __init__(self, reason, progress, partial=None):
+        super().__init__("%s stopped (%s) with %d done and %s pending" % (progress.phase, reason, progress.done,
+                                                                         progress.pending))
+        self.reason = reason
+        self.progress = progress
+        self.partial = partial
+
+
+class CancellationToken:
+    """
+    A flag that can be set from another thread to stop the runs that check it, see RunControl.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class RunControl:
+    """
+    Progress reports, budgets and cancellation for long runs. The construction of the joint machine, the deviation
+    check and the best-response iteration take it as control=None, and call checkpoint between units of work, where a
+    run that is cancelled or over its budget stops with RunAborted, which carries its partial result, instead of
+    running for hours or exhausting the memory.
+    """
+
+    def __init__(self, progress=None, max_seconds=None, max_states=None, token=None, interval=1.0):
+        """
+        :param progress: If given, a function that is called as progress(report) with a Progress at most every
+        interval seconds, when a phase ends, and when the run stops.
+        :param max_seconds: If given, the budget of wall time in seconds, counted from the creation of the RunControl,
+        so one control bounds all the phases of a run.
+        :param max_states: If given, the maximal number of joint states that the construction finds.
+        :param token: If given, a CancellationToken that stops the run when it is cancelled.
+        :param interval: The minimal number of seconds between progress reports.
+        """
+        self.progress = progress
+        self.max_seconds = max_seconds
+        self.max_states = max_states
+        self.token = token
+        self.interval = interval
+        self.start = time.monotonic()
+        self._next_report = self.start
+        self._phase_starts = {}
+
+    def checkpoint(self, phase, done, pending=None, states=None, partial=None):
+        """
+        Report the progress of a run, and stop it if it is cancelled or over its budget.
+
+        :param phase: The phase that runs, see Progress.
+        :param done: The number of units of work done.
+        :param pending: The number of units of work known to be left. A checkpoint with pending=0 ends the phase, and
+        only reports it, since stopping the run there would throw its finished work away.
+        :param states: The number of joint states found so far, which counts against max_states.
+        :param partial: A function without arguments that returns the partial result of the run, called only if it
+        stops.
+
+        :raise RunAborted: If the token is cancelled, or the run is over its budget.
+        """
+        now = time.monotonic()
+        elapsed = now - self.start
+        if done == 0 or phase not in self._phase_starts:  # a phase starts with nothing done
+            self._phase_starts[phase] = now
+        phase_start = self._phase_starts[phase]
+        if pending == 0:
+            reason = None
+        elif self.token is not None and self.token.cancelled:
+            reason = "cancelled"
+        elif self.max_seconds is not None and elapsed > self.max_seconds:
+            reason = "time"
+        elif self.max_states is not None and states is not None and states > self.max_states:
+            reason = "states"
+        else:
+            reason = None
+        if reason is None and (self.progress is None or (now < self._next_report and pending != 0)):
+            return
+
+        estimated_remaining = pending * (now - phase_start) / done if pending is not None and done > 0 else None
+        report = Progress(phase, done, pending, states, elapsed, estimated_remaining)
+        if self.progress is not None:
+            self.progress(report)
+            self._next_report = now + self.interval
+        if reason is not None:
+            raise RunAborted(reason, report, partial() if partial is not None else None)
+
+
+def checkpoint(control, phase, done, pending=None, states=None, partial=None):
+    """
+    Call control.checkpoint, if control isn't None, see RunControl.checkpoint.
+    """
+    if control is not None:
+        control.checkpoint(phase, done, pending, states, partial)
+
+
+def state_budget(control):
+    """
+    :return: The maximal number of joint states that control allows, or infinity if there is no state budget, so a
+    construction can stop inside a chunk of its BFS, as soon as it finds one joint state too many.
+    """
+    if control is None or control.max_states is None:
+        return float("inf")
+    return control.max_states
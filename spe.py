@@ -0,0 +1,228 @@
+"""
+The command line entry point of the algorithms of "Subgame-perfect Cooperation in Networks":
+
+    python -m spe check <spec-file>
+    python -m spe br <spec-file>
+    python -m spe sweep <spec-file>
+
+The spec file is JSON ("-" reads it from stdin). The algorithms, and NumPy with them, are imported only by the command
+that runs, so starting the command line costs nothing else.
+
+A check or br spec gives the network game and the strategies:
+    {"players": 3,
+     "games": [{"edge": [0, 1], "game": {"CC": 1, "CD": -4, "DC": 2, "DD": 0}}, ...],
+     "transition_funcs": [{"0": {"CCC": 0, ...}, ...}, ...],
+     "strategy_funcs": [{"0": "C", ...}, ...],
+     "EPSILON": 0.01}
+where the games are given for one direction of every edge, as in check_SPE_state_machine_by_graph. Instead of the
+games and the strategies, {"three_players": {"c": 1, "d": 2, "l": 4}} gives those of
+create_three_players_state_machines. A br spec also has the "player" whose best-response is calculated. With
+--stats, check and br also write the timings and counters of their phases to a JSON file, see phase_stats.
+
+check and br stop cleanly with the exit status 3 when they run over --max-seconds or find more than --max-states
+joint states, or when they get SIGTERM, and --progress reports their progress to stderr, see run_control.
+
+A sweep spec gives the points of sweep_three_players_state_machines, as a list of [c, d, l, EPSILON] "points", as a
+"grid": {"c": [...], "d": [...], "l": [...], "EPSILON": [...]} of which the points with d > c > 0 are taken, or both.
+"""
+
+import argparse
+import json
+import sys
+
+
+def read_spec(path):
+    """
+    :param path: The path of a JSON spec file, or "-" for stdin.
+
+    :return: The spec as a dict.
+    """
+    if path == "-":
+        return json.load(sys.stdin)
+    with open(path) as file:
+        return json.load(file)
+
+
+def _state(key):
+    return int(key) if isinstance(key, str) and key.lstrip("-").isdigit() else key
+
+
+def game_from_spec(spec):
+    """
+    :param spec: A check or br spec, see the documentation of this module.
+
+    :return: (n, games, transition_funcs, strategy_funcs), the network game, with the games of one direction of every
+    edge, and the strategy state machines, whose states are integers again after JSON turned them into strings.
+    """
+    if "three_players" in spec:
+        from creating_three_players_state_machines import left_state_machine, middle_state_machine, \
+            right_state_machine, three_players_parameters
+
+        c, d, l = (spec["three_players"][key] for key in ("c", "d", "l"))
+        punish_num, trust_gain_num = three_players_parameters(c, d, l)
+        machines = [machine(punish_num, trust_gain_num)
+                    for machine in (left_state_machine, middle_state_machine, right_state_machine)]
+        game = {"CC": c, "CD": -l, "DC": d, "DD": 0}
+        return 3, {(0, 1): game, (1, 2): dict(game)}, [machine[0] for machine in machines], \
+            [machine[1] for machine in machines]
+
+    games = {tuple(entry["edge"]): entry["game"] for entry in spec["games"]}
+    transition_funcs = [{_state(q): {action: _state(state) for action, state in transitions.items()}
+                         for q, transitions in transition_func.items()} for transition_func in spec["transition_funcs"]]
+    strategy_funcs = [{_state(q): action for q, action in strategy_func.items()}
+                      for strategy_func in spec["strategy_funcs"]]
+    return spec["players"], games, transition_funcs, strategy_funcs
+
+
+def make_stats(args):
+    """
+    :return: A PhaseStats if the command writes its stats, and None otherwise.
+    """
+    if args.stats is None:
+        return None
+    from phase_stats import PhaseStats
+
+    return PhaseStats()
+
+
+def write_stats(stats, args):
+    """
+    Write the stats of a command to the --stats file as JSON, if it was given.
+    """
+    if stats is not None:
+        with open(args.stats, "w") as file:
+            file.write(stats.to_json(indent=1) + "\n")
+
+
+def make_control(args):
+    """
+    :return: A RunControl with the budgets and the progress reports of the command line, whose token SIGTERM cancels.
+    """
+    import signal
+
+    from run_control import CancellationToken, RunControl
+
+    def report(progress):
+        print("%s: %d done, %s pending, %.1fs" % (progress.phase, progress.done, progress.pending, progress.elapsed),
+              file=sys.stderr)
+
+    token = CancellationToken()
+    signal.signal(signal.SIGTERM, lambda signum, frame: token.cancel())
+    return RunControl(report if args.progress else None, args.max_seconds, args.max_states, token)
+
+
+def check_command(spec, args):
+    """
+    Check whether the strategies of a spec are SPE, see check_SPE_state_machine_by_graph.
+
+    :return: The exit status, 0 if the strategies are SPE and 1 otherwise.
+    """
+    from check_SPE_state_machine import check_SPE_state_machine_by_graph
+
+    n, games, transition_funcs, strategy_funcs = game_from_spec(spec)
+    stats = make_stats(args)
+    result = check_SPE_state_machine_by_graph(n, games, transition_funcs, strategy_funcs,
+                                              EPSILON=spec.get("EPSILON", 0.01),
+                                              unilateral=spec.get("unilateral", False), verbose=not args.quiet,
+                                              stop_at_first=spec.get("stop_at_first", False),
+                                              symmetric=spec.get("symmetric", False), stats=stats,
+                                              control=make_control(args))
+    write_stats(stats, args)
+    results = result if isinstance(result, list) else [result]
+    return 0 if all(results) else 1
+
+
+def br_command(spec, args):
+    """
+    Calculate the best-response of spec["player"] to the strategies of the other players, and print it as a JSON
+    state machine, see calc_BR_state_machine_player_i_ver.
+
+    :return: The exit status.
+    """
+    from calc_BR_state_machine import calc_BR_state_machine_player_i_ver
+    from check_SPE_state_machine import calculate_single_player_utility_by_graph
+
+    n, games, transition_funcs, strategy_funcs = game_from_spec(spec)
+    player = spec["player"]
+    for edge in list(games.keys()):
+        games[(edge[1], edge[0])] = games[edge]
+    actions_sets = [{"C", "D"} for i in range(n)]
+    utilities = [calculate_single_player_utility_by_graph(n, games, i, actions_sets) for i in range(n)]
+    if len(transition_funcs) == n:  # the strategy of the player is replaced by his best-response
+        transition_funcs = transition_funcs[:player] + transition_funcs[player + 1:]
+        strategy_funcs = strategy_funcs[:player] + strategy_funcs[player + 1:]
+
+    stats = make_stats(args)
+    transition_func, strategy_func = calc_BR_state_machine_player_i_ver(
+        player, transition_funcs, strategy_funcs, utilities, EPSILON=spec.get("EPSILON", 0.01), as_arrays=True,
+        single_player=True, stats=stats, control=make_control(args))
+    write_stats(stats, args)
+    json.dump({"transition_func": transition_func, "strategy_func": strategy_func}, args.output)
+    args.output.write("\n")
+    return 0
+
+
+def sweep_command(spec, args):
+    """
+    Check the points of a sweep spec and write the table of verdicts and margins as CSV, see
+    sweep_three_players_state_machines.
+
+    :return: The exit status.
+    """
+    import itertools
+
+    from creating_three_players_state_machines import sweep_three_players_state_machines
+
+    points = [tuple(point) for point in spec.get("points", [])]
+    if "grid" in spec:
+        grid = spec["grid"]
+        points += [(c, d, l, EPSILON) for c, d, l, EPSILON in
+                   itertools.product(grid["c"], grid["d"], grid["l"], grid["EPSILON"]) if d > c > 0]
+    processes = args.processes if args.processes is not None else spec.get("processes")
+    result = sweep_three_players_state_machines(points, processes=processes, batch_size=spec.get("batch_size", 256))
+
+    args.output.write(",".join(result._fields) + "\n")
+    for row in zip(*(column.tolist() for column in result)):
+        args.output.write(",".join(str(value) for value in row) + "\n")
+    return 0
+
+
+def main(argv=None):
+    """
+    :param argv: The command line arguments, sys.argv[1:] by default.
+
+    :return: The exit status.
+    """
+    parser = argparse.ArgumentParser(prog="python -m spe",
+                                     description='The algorithms of "Subgame-perfect Cooperation in Networks".')
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("check", help="check whether strategies are SPE, exit status 1 if not")
+    check.add_argument("--quiet", action="store_true", help="don't print the deviations and the verdict")
+    br = commands.add_parser("br", help="print the best-response of a player as a JSON state machine")
+    sweep = commands.add_parser("sweep", help="print the verdicts and margins of a parameter sweep as CSV")
+    sweep.add_argument("--processes", type=int, help="the number of worker processes")
+    for command in (check, br, sweep):
+        command.add_argument("spec", help='a JSON spec file, or "-" for stdin')
+    for command in (check, br):
+        command.add_argument("--stats", help="write the timings and counters of the phases to this JSON file")
+        command.add_argument("--max-seconds", type=float, help="stop with exit status 3 after this many seconds")
+        command.add_argument("--max-states", type=int,
+                             help="stop with exit status 3 after finding this many joint states")
+        command.add_argument("--progress", action="store_true", help="report the progress to stderr")
+    for command in (br, sweep):
+        command.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout,
+                             help="the output file, stdout by default")
+    args = parser.parse_args(argv)
+
+    spec = read_spec(args.spec)
+    from run_control import RunAborted
+
+    try:
+        return {"check": check_command, "br": br_command, "sweep": sweep_command}[args.command](spec, args)
+    except RunAborted as aborted:
+        print(aborted, file=sys.stderr)
+        return 3
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+import numpy as np
+
+from build_joint_state_machine import (JointStateMachineArrays, action_profile_strides, action_profiles,
+                                       construct_joint_state_machine_arrays, deviation_players, deviation_profiles,
+                                       has_tuple_keys, ordered_actions, single_player_successors, single_player_tables)
+from check_SPE_state_machine import (SPEResult, deviation_gains, joint_machine_deviations, joint_machine_on_path,
+                                     on_path_structure, player_deviation_gains, propagate_long_term_util,
+                                     report_SPE, update_long_term_util)
+from phase_stats import count
+
+
+class _ReverseIndex:
+    """
+    The predecessors of every joint state in a graph given by a table of successors, like the on-path graph or the
+    deviations. The index is sorted once, and the edges that an edit adds are kept aside until they are many enough
+    to sort again. Edges that an edit removes are left in the index, and dropped when they are looked up, by checking
+    them against the current table.
+    """
+
+    def __init__(self, successors):
+        self._build(successors)
+
+    def _build(self, successors):
+        flat = successors.ravel().astype(np.int64)
+        order = np.argsort(flat, kind="stable")
+        self._order = order // max(successors.shape[1], 1)
+        self._starts = np.searchsorted(flat[order], np.arange(len(successors) + 1))
+        self._added = {}
+
+    def add(self, rows, successors):
+        """
+        Add the edges from rows, whose successors are new, to the index.
+
+        :param rows: An int array of joint states.
+        :param successors: The table of successors of all the joint states, with their new successors.
+        """
+        if len(rows) + sum(len(parents) for parents in self._added.values()) > len(successors) // 8:
+            self._build(successors)
+            return
+        for row, targets in zip(rows.tolist(), successors[rows].tolist()):
+            for target in set(targets):
+                self._added.setdefault(target, set()).add(row)
+
+    def predecessors(self, states, successors):
+        """
+        :param states: A sorted int array of distinct joint states.
+        :param successors: The current table of successors.
+
+        :return: A sorted int array, the joint states that have an edge to one of states.
+        """
+        indexed = states[states < len(self._starts) - 1]
+        counts = self._starts[indexed + 1] - self._starts[indexed]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        parents = self._order[np.repeat(self._starts[indexed], counts) + offsets]
+        children = np.repeat(indexed, counts)
+        if self._added:
+            extra = [(parent, state) for state in states.tolist() for parent in self._added.get(state, ())]
+            if extra:
+                parents = np.concatenate([parents, np.array(extra, dtype=np.int64)[:, 0]])
+                children = np.concatenate([children, np.array(extra, dtype=np.int64)[:, 1]])
+        valid = np.any(successors[parents] == children[:, None], axis=1)
+        return np.unique(parents[valid])
+
+    def ancestors(self, states, successors):
+        """
+        :return: A sorted int array, the joint states from which one of states is reached, including them.
+        """
+        reached = np.zeros(len(successors), dtype=bool)
+        frontier = np.unique(states)
+        reached[frontier] = True
+        while len(frontier) != 0:
+            parents = self.predecessors(frontier, successors)
+            frontier = parents[~reached[parents]]
+            reached[frontier] = True
+        return np.flatnonzero(reached)
+
+
+class SPESession:
+    """
+    An incremental SPE analysis of the strategies of the players, for designing strategies by small edits of the
+    single-player state machines. The session holds the array-backed joint machine, the reverse indices of its on-path
+    graph and of its deviations, the long term utilities and the deviation margins. An edit re-expands only the joint
+    states of the edited single-player states and the joint states they newly reach, re-propagates the long term
+    utilities only backwards along the path of play from them, and re-checks only the deviations whose values moved.
+
+    Joint states that an edit makes unreachable are kept, but they are not part of the result.
+    """
+
+    def __init__(self, players_actions, transition_funcs, strategy_funcs, utils_by_actions, EPSILON=0.01,
+                 unilateral=False, stats=None):
+        """
+        :param players_actions: players_actions[i] is a list of possible actions for player i.
+        :param transition_funcs: The transition functions of the single player state machines, dicts as in
+        construct_joint_state_machine. They are copied, so the edits don't change them.
+        :param strategy_funcs: The strategy functions of the single player state machines.
+        :param utils_by_actions: The utilities of the players in the one-step game, see check_SPE_state_machine.
+        :param EPSILON: 1-DELTA.
+        :param unilateral: see construct_joint_state_machine.
+        :param stats: An optional PhaseStats, that counts the joint states "expanded", the "values_updated" and the
+        "states_checked" of every edit, besides the phases and counters of the first construction, see phase_stats.
+        """
+        self.players_actions = ordered_actions(players_actions)
+        self.transition_funcs = [{q: dict(transitions) for q, transitions in transition_func.items()}
+                                 for transition_func in transition_funcs]
+        self.strategy_funcs = [dict(strategy_func) for strategy_func in strategy_funcs]
+        self.utils_by_actions = utils_by_actions
+        self.EPSILON = EPSILON
+        self.unilateral = unilateral
+        self.stats = stats
+        num_players = len(self.players_actions)
+        self._profiles = action_profiles(self.players_actions,
+                                         has_tuple_keys(next(iter(self.transition_funcs[0].values()))))
+        self._dif_players = deviation_players(self.players_actions)
+
+        self.state_ids, self._tables, self._actions = single_player_tables(self.players_actions,
+                                                                           self.transition_funcs,
+                                                                           self.strategy_funcs)[:3]
+        self._positions = [{q: k for k, q in enumerate(ids)} for ids in self.state_ids]
+        joint = construct_joint_state_machine_arrays(self.players_actions, self.transition_funcs, self.strategy_funcs,
+                                                     unilateral=unilateral, stats=stats)
+        self.local_states = np.stack([[self._positions[i][q] for q in joint.states[:, i].tolist()]
+                                      for i in range(num_players)], axis=-1).astype(np.int32).reshape(-1, num_players)
+        self.transitions, self.strategy = joint.transitions, joint.strategy
+        self._known = {key: state for state, key in enumerate(self._keys(self.local_states))}
+
+        # copies, since they may be views of the transitions
+        next_states, self.stage_utils = joint_machine_on_path(joint, utils_by_actions)
+        dif_next_states, self.dif_utils = joint_machine_deviations(joint, utils_by_actions)[1:]
+        self.next_states, self.dif_next_states = next_states.astype(np.int64), dif_next_states.astype(np.int64)
+        self._on_path_index = _ReverseIndex(self.next_states[:, None])
+        self._deviation_index = _ReverseIndex(self.dif_next_states)
+        self.long_term_util = propagate_long_term_util([EPSILON], self.stage_utils,
+                                                       on_path_structure(self.next_states, stats))[0]
+        self.margins = self._margins(np.arange(len(self.strategy)))
+        self.reachable = np.ones(len(self.strategy), dtype=bool)
+
+    @staticmethod
+    def _keys(local_states):
+        return np.ascontiguousarray(local_states, dtype=np.int32).view(
+            np.dtype((np.void, 4 * local_states.shape[1]))).ravel().tolist()
+
+    def _margins(self, states):
+        DELTAS = np.array([1 - self.EPSILON])
+        gains = deviation_gains(DELTAS, self.long_term_util[None], self._dif_players, self.dif_next_states[states],
+                                self.dif_utils[states], states)
+        return player_deviation_gains(gains, self._dif_players, len(self.players_actions))[0]
+
+    def _edit_player(self, player, transitions, actions):
+        """
+        Apply an edit to the state machine of player and to his tables.
+
+        :return: An int array, the positions of the states of player whose transitions or action changed.
+        """
+        transition_func, strategy_func = self.transition_funcs[player], self.strategy_funcs[player]
+        for q, q_transitions in transitions.items():
+            transition_func.setdefault(q, {}).update(q_transitions)
+        strategy_func.update(actions)
+        for q in set(transitions) | set(actions):
+            if q not in self._positions[player]:
+                self._positions[player][q] = len(self.state_ids[player])
+                self.state_ids[player].append(q)
+        missing = [q for q in self.state_ids[player] if q not in strategy_func or
+                   len(transition_func.get(q, ())) != len(self._profiles)]
+        if missing:
+            raise ValueError("The states %r of player %d don't have an action and all the transitions" %
+                             (missing, player))
+        for q in transitions:
+            for next_q in transitions[q].values():
+                if next_q not in self._positions[player]:
+                    raise ValueError("Player %d has no state %r" % (player, next_q))
+
+        changed = sorted(self._positions[player][q] for q in set(transitions) | set(actions))
+        num_states = len(self.state_ids[player])
+        if num_states > len(self._tables[player]):
+            grown = num_states - len(self._tables[player])
+            self._tables[player] = np.concatenate([self._tables[player], np.zeros(
+                (grown, len(self._profiles)), dtype=np.int32)])
+            self._actions[player] = np.concatenate([self._actions[player], np.zeros(grown, dtype=np.int64)])
+        position = self._positions[player]
+        for k in changed:
+            q = self.state_ids[player][k]
+            self._tables[player][k] = [position[transition_func[q][profile]] for profile in self._profiles]
+            self._actions[player][k] = self.players_actions[player].index(strategy_func[q])
+        return np.array(changed, dtype=np.int64)
+
+    def _expand(self, rows):
+        """
+        Find the transitions and the actions of the joint states rows again, and those of the joint states that they
+        newly reach, which are added to the joint machine.
+
+        :return: An int array, the joint states expanded.
+        """
+        num_players = len(self.players_actions)
+        strides = action_profile_strides(self.players_actions)
+        expanded = [rows]
+        while len(rows) != 0:
+            local = self.local_states[rows]
+            strategy = sum(self._actions[i][local[:, i]] * strides[i] for i in range(num_players))
+            if self.unilateral:
+                profiles = np.column_stack([strategy, deviation_profiles(strategy, self.players_actions)])
+            else:
+                profiles = np.arange(len(self._profiles))[None]
+            successors = single_player_successors(self.players_actions, self._tables, [None] * num_players, local,
+                                                  profiles)
+            keys = self._keys(successors.reshape(-1, num_players))
+            ids = np.empty(len(keys), dtype=np.int64)
+            new_states = []
+            for k, key in enumerate(keys):
+                state = self._known.get(key)
+                if state is None:
+                    state = self._known[key] = len(self._known)
+                    new_states.append(k)
+                ids[k] = state
+            self.strategy[rows] = strategy
+            self.transitions[rows] = ids.reshape(successors.shape[:2])
+
+            rows = np.arange(len(self.strategy), len(self._known))
+            self._append(successors.reshape(-1, num_players)[new_states])
+            expanded.append(rows)
+        return np.concatenate(expanded)
+
+    def _append(self, local_states):
+        """
+        Add new joint states, whose transitions, values and margins are found later.
+        """
+        num_new = len(local_states)
+        if num_new == 0:
+            return
+
+        def grow(array, fill=0):
+            return np.concatenate([array, np.full((num_new,) + array.shape[1:], fill, dtype=array.dtype)])
+
+        self.local_states = np.concatenate([self.local_states, local_states.astype(np.int32)])
+        self.transitions, self.strategy = grow(self.transitions), grow(self.strategy)
+        self.next_states, self.stage_utils = grow(self.next_states), grow(self.stage_utils)
+        self.dif_next_states, self.dif_utils = grow(self.dif_next_states), grow(self.dif_utils)
+        self.long_term_util, self.margins = grow(self.long_term_util), grow(self.margins, np.nan)
+        self.reachable = grow(self.reachable, True)
+
+    def _find_reachable(self):
+        reachable = np.zeros(len(self.strategy), dtype=bool)
+        reachable[0] = True
+        frontier = np.zeros(1, dtype=np.int64)
+        while len(frontier) != 0:
+            successors = np.unique(self.transitions[frontier])
+            frontier = successors[~reachable[successors]]
+            reachable[frontier] = True
+        return reachable
+
+    def edit(self, player, transitions=None, actions=None, verbose=False):
+        """
+        Edit the state machine of a player, and update the analysis.
+
+        :param player: The player whose state machine is edited.
+        :param transitions: A dict from states of the player to dicts from action profiles to the states that he goes
+        to after them, which replace his transitions. A state that he doesn't have yet is added, and then needs all
+        the transitions and an action.
+        :param actions: A dict from states of the player to the actions that he plays in them.
+        :param verbose: If True, print the deviations and the verdict.
+
+        :return: The SPEResult of the edited strategies, see result.
+        """
+        changed = self._edit_player(player, transitions or {}, actions or {})
+        rows = np.flatnonzero(np.isin(self.local_states[:, player], changed))
+        old_rows = len(rows)
+        old_transitions = self.transitions[rows]
+        old_tables = (self.next_states[rows], self.stage_utils[rows], self.dif_next_states[rows], self.dif_utils[rows])
+        rows = self._expand(rows)
+        count(self.stats, "expanded", len(rows))
+
+        joint = JointStateMachineArrays(None, self.transitions[rows], self.strategy[rows], self.players_actions,
+                                        self.unilateral)
+        self.next_states[rows], self.stage_utils[rows] = joint_machine_on_path(joint, self.utils_by_actions)
+        self.dif_next_states[rows], self.dif_utils[rows] = joint_machine_deviations(joint, self.utils_by_actions)[1:]
+        if len(rows) != old_rows or not np.array_equal(self.transitions[rows[:old_rows]], old_transitions):
+            self.reachable = self._find_reachable()
+
+        # only the joint states whose path of play or deviations really changed, and the new ones, are updated
+        def differs(old, new):
+            return np.any(old != new, axis=tuple(range(1, old.ndim)))
+
+        kept, new_rows = rows[:old_rows], rows[old_rows:]
+        on_path_changed = np.concatenate([kept[differs(old_tables[0], self.next_states[kept]) |
+                                               differs(old_tables[1], self.stage_utils[kept])], new_rows])
+        deviations_changed = np.concatenate([kept[differs(old_tables[2], self.dif_next_states[kept]) |
+                                                  differs(old_tables[3], self.dif_utils[kept])], new_rows])
+        self._on_path_index.add(on_path_changed, self.next_states[:, None])
+        self._deviation_index.add(deviations_changed, self.dif_next_states)
+
+        # the long term utilities change where the path of play passes through a changed joint state, and the
+        # margins where a value or a deviation changed
+        updated = self._on_path_index.ancestors(on_path_changed, self.next_states[:, None])
+        if len(updated) != 0:
+            update_long_term_util(self.EPSILON, self.long_term_util, self.next_states, self.stage_utils, updated)
+        checked = np.union1d(np.union1d(deviations_changed, updated),
+                             self._deviation_index.predecessors(updated, self.dif_next_states))
+        self.margins[checked] = self._margins(checked)
+        count(self.stats, "values_updated", len(updated))
+        count(self.stats, "states_checked", len(checked))
+        return self.result(verbose)
+
+    def result(self, verbose=False):
+        """
+        :param verbose: If True, print the deviations and the verdict.
+
+        :return: The SPEResult of the current strategies, whose margins are those of the reachable joint states, in
+        the order of joint_state_machine.
+        """
+        reachable = np.flatnonzero(self.reachable)
+        margins = self.margins[reachable]
+        states, players = np.nonzero(margins > 0)
+        violations = list(zip(self._state_names(reachable[states]), players.tolist()))
+        result = SPEResult(len(violations) == 0, violations, margins, float(self.EPSILON))
+        if verbose:
+            report_SPE(result)
+        return result
+
+    def state_name(self, state):
+        """
+        :return: The joint state as a tuple of the states of the players.
+        """
+        return tuple(self.state_ids[i][k] for i, k in enumerate(self.local_states[state].tolist()))
+
+    def _state_names(self, states):
+        """
+        :return: A list with the name of every joint state of the array states, see state_name.
+        """
+        local = self.local_states[states].T.tolist()
+        columns = [[ids[k] for k in column] for ids, column in zip(self.state_ids, local)]
+        return list(zip(*columns))
+
+    def joint_state_machine(self):
+        """
+        :return: The reachable part of the joint machine as a JointStateMachineArrays, with the reachable joint states
+        in the order of the session.
+        """
+        reachable = np.flatnonzero(self.reachable)
+        ids = np.full(len(self.reachable), -1, dtype=np.int64)
+        ids[reachable] = np.arange(len(reachable))
+        states = np.array(self._state_names(reachable))
+        return JointStateMachineArrays(states, ids[self.transitions[reachable]].astype(np.int32),
+                                       self.strategy[reachable], self.players_actions, self.unilateral)
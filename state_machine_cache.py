@@ -0,0 +1,246 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _update_hash(digest, obj):
+    """
+    Feed a canonical serialization of obj to digest, where dicts and sets are serialized in a sorted order so equal
+    objects give the same hash no matter the order in which they were built.
+    """
+    if isinstance(obj, dict):
+        digest.update(b"d%d:" % len(obj))
+        for key in sorted(obj, key=repr):
+            _update_hash(digest, key)
+            _update_hash(digest, obj[key])
+    elif isinstance(obj, (set, frozenset)):
+        digest.update(b"s%d:" % len(obj))
+        for element in sorted(obj, key=repr):
+            _update_hash(digest, element)
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b"l%d:" % len(obj))
+        for element in obj:
+            _update_hash(digest, element)
+    elif isinstance(obj, np.ndarray):
+        array = np.ascontiguousarray(obj)
+        digest.update(b"a" + array.dtype.str.encode() + repr(array.shape).encode())
+        digest.update(array.tobytes())
+    else:
+        value = repr(obj).encode()
+        digest.update(b"v%d:" % len(value) + value)
+
+
+def canonical_hash(obj):
+    """
+    :param obj: Nested dicts, sets, lists, tuples and arrays of plain values, like state machines and games.
+
+    :return: A hex string that identifies the content of obj.
+    """
+    digest = hashlib.sha256()
+    _update_hash(digest, obj)
+    return digest.hexdigest()
+
+
+def _read_only(value):
+    """
+    Mark the arrays in value, at every depth of its tuples, lists and dicts, as read-only, so the callers that share a
+    cached value can't change it.
+    """
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for element in value:
+            _read_only(element)
+    elif isinstance(value, dict):
+        for element in value.values():
+            _read_only(element)
+
+
+def _read_only_copy(value):
+    """
+    :return: value with its writable arrays copied and marked as read-only, and the lists, dicts, sets and tuples that
+    hold them rebuilt, so the cache doesn't freeze the arrays of the caller that gave it the value.
+    """
+    if isinstance(value, np.ndarray):
+        if not value.flags.writeable:
+            return value
+        value = value.copy()
+        value.setflags(write=False)
+        return value
+    if isinstance(value, list):
+        return [_read_only_copy(element) for element in value]
+    if isinstance(value, dict):
+        return {key: _read_only_copy(element) for key, element in value.items()}
+    if isinstance(value, set):
+        return set(value)
+    if isinstance(value, tuple):
+        elements = [_read_only_copy(element) for element in value]
+        if all(copy is element for copy, element in zip(elements, value)):
+            return value
+        return value._make(elements) if hasattr(value, "_make") else tuple(elements)
+    return value
+
+
+def _copy_containers(value):
+    """
+    :return: value with its lists, dicts and sets copied at every depth, and the tuples that hold them rebuilt, so a
+    caller that changes them doesn't change the cached value. The arrays are shared, since they are read-only.
+    """
+    if isinstance(value, list):
+        return [_copy_containers(element) for element in value]
+    if isinstance(value, dict):
+        return {key: _copy_containers(element) for key, element in value.items()}
+    if isinstance(value, set):
+        return set(value)
+    if isinstance(value, tuple):
+        elements = [_copy_containers(element) for element in value]
+        if all(copy is element for copy, element in zip(elements, value)):
+            return value
+        return value._make(elements) if hasattr(value, "_make") else tuple(elements)
+    return value
+
+
+class StateMachineCache:
+    """
+    A content-addressed cache for the joint machines, on-path structures and utility tables that are computed again
+    and again for the same strategies. Values are kept in memory with a least-recently-used limit, and if a directory
+    is given also pickled to disk, where the least recently used files are evicted when the directory grows over
+    max_disk_bytes.
+
+    Every caller gets its own copy of the lists, dicts and sets of a cached value, like the dicts of a joint machine
+    or the violations of an SPEResult, while its arrays, like the margins, are shared and read-only.
+    """
+
+    def __init__(self, max_entries=128, directory=None, max_disk_bytes=None):
+        """
+        :param max_entries: The maximal number of values kept in memory.
+        :param directory: If given, the directory of the disk layer, which is shared by the caches that use it.
+        :param max_disk_bytes: If given, the maximal total size of the files in the disk layer.
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key, default=None):
+        """
+        :param key: A key, as returned by canonical_hash.
+
+        :return: The cached value, or default if it isn't cached.
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return _copy_containers(self._memory[key])
+        if self.directory is not None:
+            # another process that shares the directory may evict the file at any time
+            try:
+                with open(self._path(key), "rb") as file:
+                    value = pickle.load(file)
+                os.utime(self._path(key))  # mark the file as recently used
+            except FileNotFoundError:
+                pass
+            else:
+                _read_only(value)
+                self._remember(key, value)
+                self.hits += 1
+                return _copy_containers(value)
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """
+        Cache a value in memory, and on disk if the cache has a directory. The cache keeps read-only copies of the
+        arrays of value, so the caller can still change its own.
+        """
+        self._put(key, _read_only_copy(value))
+
+    def _put(self, key, value):
+        self._remember(key, value)
+        if self.directory is not None:
+            temp_path = self._path(key) + ".%d.tmp" % os.getpid()
+            with open(temp_path, "wb") as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+            self._evict_disk()
+
+    def get_or_compute(self, key, compute):
+        """
+        :param key: Any object that canonical_hash accepts, usually a tuple of a name and the inputs of compute.
+        :param compute: A function without arguments that computes the value.
+
+        :return: The cached value of key, after computing and caching it if it isn't cached.
+        """
+        key = canonical_hash(key)
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = _read_only_copy(compute())
+            self._put(key, value)
+            value = _copy_containers(value)
+        return value
+
+    def clear(self):
+        """
+        Remove all the values from memory and from the disk layer.
+        """
+        self._memory.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".pkl"):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        if self.max_disk_bytes is None:
+            return
+        # the files that another process sharing the directory removes meanwhile are skipped
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def cached(cache, key, compute):
+    """
+    :param cache: A StateMachineCache, or None to always compute.
+    :param key: The key of the value, see StateMachineCache.get_or_compute.
+    :param compute: A function without arguments that computes the value.
+
+    :return: The value, from the cache if it is there.
+    """
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(key, compute)
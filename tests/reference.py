@@ -0,0 +1,123 @@
+"""
+Small randomized strategies, and straightforward versions of the baseline dict algorithms that the fast paths are
+compared with: the long term utilities from a linear system instead of the cycles of the path of play, the deviation
+margins from a loop over every state, player and action, and Moore's partition refinement.
+"""
+
+import itertools
+
+import numpy as np
+
+# the actions of the players in the random games, chosen by the seed of every test
+PLAYERS_ACTIONS = [[("C", "D")] * 2, [("C", "D")] * 3, [("C", "D", "E"), ("C", "D")]]
+
+
+def random_state_machines(rng, num_players, num_states, players_actions, tuple_keys=False):
+    """
+    :return: (transition_funcs, strategy_funcs, utilities), random single-player state machines over all the action
+    profiles, and random utilities, which are continuous so the verdicts have no ties.
+    """
+    profiles = list(itertools.product(*players_actions))
+    if not tuple_keys:
+        profiles = ["".join(profile) for profile in profiles]
+    transition_funcs = [{q: {profile: int(rng.integers(num_states)) for profile in profiles}
+                         for q in range(num_states)} for i in range(num_players)]
+    strategy_funcs = [{q: players_actions[i][int(rng.integers(len(players_actions[i])))] for q in range(num_states)}
+                      for i in range(num_players)]
+    utilities = [{profile: float(rng.normal()) for profile in profiles} for i in range(num_players)]
+    return transition_funcs, strategy_funcs, utilities
+
+
+def with_duplicate_states(rng, transition_funcs, strategy_funcs):
+    """
+    :return: (transition_funcs, strategy_funcs), where every state q of the machines gets a copy q + n that plays like
+    it, and the transitions go randomly to a state or to its copy, so the machines can be minimized.
+    """
+    duplicated_transitions, duplicated_strategies = [], []
+    for transition_func, strategy_func in zip(transition_funcs, strategy_funcs):
+        num_states = len(transition_func)
+
+        def mixed(row):
+            return {profile: q + num_states * int(rng.integers(2)) for profile, q in row.items()}
+
+        duplicated_transitions.append({**{q: mixed(row) for q, row in transition_func.items()},
+                                       **{q + num_states: mixed(row) for q, row in transition_func.items()}})
+        duplicated_strategies.append({**strategy_func, **{q + num_states: a for q, a in strategy_func.items()}})
+    return duplicated_transitions, duplicated_strategies
+
+
+def replace_player_action(profile, i, action):
+    if isinstance(profile, tuple):
+        return profile[:i] + (action,) + profile[i + 1:]
+    return profile[:i] + action + profile[i + 1:]
+
+
+def reference_long_term_util(EPSILON, joint_Q, joint_f, joint_s, utilities):
+    """
+    :return: A dict from the joint states to the long term utilities V = u + DELTA * V(next) along the path of play,
+    solved as a linear system.
+    """
+    DELTA = 1 - EPSILON
+    position = {state: k for k, state in enumerate(joint_Q)}
+    transition = np.eye(len(joint_Q))
+    for state in joint_Q:
+        transition[position[state], position[joint_f[state][joint_s[state]]]] -= DELTA
+    stage = np.array([[utility[joint_s[state]] for utility in utilities] for state in joint_Q])
+    values = np.linalg.solve(transition, stage)
+    return {state: values[position[state]] for state in joint_Q}
+
+
+def reference_margins(EPSILON, joint_Q, joint_f, joint_s, utilities, players_actions):
+    """
+    :return: A dict from the joint states to the largest gain of every player from a one-shot deviation, as in the
+    loop of the baseline check_SPE_state_machine.
+    """
+    DELTA = 1 - EPSILON
+    values = reference_long_term_util(EPSILON, joint_Q, joint_f, joint_s, utilities)
+    margins = {}
+    for state in joint_Q:
+        profile = joint_s[state]
+        margins[state] = np.array([
+            max(utilities[i][deviation] + DELTA * values[joint_f[state][deviation]][i] - values[state][i]
+                for deviation in (replace_player_action(profile, i, action) for action in players_actions[i]
+                                  if action != profile[i]))
+            for i in range(len(utilities))])
+    return margins
+
+
+def moore_partition(table, outputs):
+    """
+    :return: The groups of Moore's partition refinement, which splits all the groups in every round.
+    """
+    labels = np.unique(outputs, return_inverse=True)[1].ravel()
+    while True:
+        refined = np.unique(np.column_stack([labels, labels[table]]), axis=0, return_inverse=True)[1].ravel()
+        if refined.max() == labels.max():
+            return refined
+        labels = refined
+
+
+def same_partition(labels, other_labels):
+    """
+    :return: True if the two arrays of labels group the states in the same way.
+    """
+    pairs = len(np.unique(np.column_stack([labels, other_labels]), axis=0))
+    return pairs == len(np.unique(labels)) == len(np.unique(other_labels))
+
+
+def state_names(joint):
+    """
+    :return: The joint states of a JointStateMachineArrays as tuples of the states of the players.
+    """
+    return [tuple(state) for state in np.asarray(joint.states).tolist()]
+
+
+def canonical_arrays(joint):
+    """
+    :return: A dict from the joint states of a JointStateMachineArrays to their actions and successors, which doesn't
+    depend on the order of the joint states.
+    """
+    names = state_names(joint)
+    transitions = np.asarray(joint.transitions).tolist()
+    return {name: (int(joint.strategy[k]), tuple(names[state] for state in transitions[k]))
+            for k, name in enumerate(names)}
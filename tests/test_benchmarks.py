@@ -0,0 +1,48 @@
+import importlib.util
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def run_benchmarks():
+    spec = importlib.util.spec_from_file_location("run_benchmarks", os.path.join(ROOT, "benchmarks",
+                                                                                 "run_benchmarks.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def results(times, peak_memory=1 << 21):
+    return {"results": {"case": {"phase": {"time": sorted(times)[len(times) // 2], "times": times,
+                                           "peak_memory": peak_memory}}}}
+
+
+def test_compare_results_ignores_noise(run_benchmarks):
+    baseline = results([0.1, 0.1, 0.3])
+    # the median is 70% slower, but the runs overlap those of the baseline
+    rows, regressions = run_benchmarks.compare_results(results([0.16, 0.17, 0.2]), baseline)
+    assert len(rows) == 1 and regressions == []
+    # runs faster than min_time and memory below min_memory never count
+    assert run_benchmarks.compare_results(results([0.005] * 3, 1000), results([0.001] * 3, 100))[1] == []
+
+
+def test_compare_results_finds_regressions(run_benchmarks):
+    baseline = results([0.1, 0.11, 0.12])
+    assert run_benchmarks.compare_results(results([0.2, 0.21, 0.22]), baseline)[1] == [("case", "phase",
+                                                                                         0.21 / 0.11, 1.0)]
+    assert run_benchmarks.compare_results(results([0.1, 0.11, 0.12], 1 << 22), baseline)[1] == [("case", "phase",
+                                                                                                  1.0, 2.0)]
+    # the cases and phases that the baseline doesn't have aren't compared
+    assert run_benchmarks.compare_results(results([1.0]), {"results": {}}) == ([], [])
+
+
+def test_benchmark_results_match_themselves(run_benchmarks):
+    measured = run_benchmarks.run_benchmarks(repeat=2, quick=True, select="line/n=4")
+    phases = measured["results"]["line/n=4"]
+    assert phases["construct"]["joint_states"] == phases["check_SPE_arrays"]["joint_states"] > 0
+    assert all(len(measurement["times"]) == 2 for measurement in phases.values())
+    rows, regressions = run_benchmarks.compare_results(measured, measured)
+    assert len(rows) == len(phases) and regressions == []
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from build_joint_state_machine import construct_joint_state_machine
+from calc_BR_state_machine import calc_BR_state_machine_player_i_ver
+from check_SPE_state_machine import calc_long_term_util
+from reference import PLAYERS_ACTIONS, random_state_machines, reference_margins
+
+EPSILON = 0.1
+
+
+def random_others(seed):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs, utilities = random_state_machines(rng, len(players_actions), 4,
+                                                                        players_actions)
+    player_i = int(rng.integers(len(players_actions)))
+    return (players_actions, player_i, transition_funcs[:player_i] + transition_funcs[player_i + 1:],
+            strategy_funcs[:player_i] + strategy_funcs[player_i + 1:], utilities)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_best_response_has_no_deviations(seed):
+    players_actions, player_i, transition_funcs, strategy_funcs, utilities = random_others(seed)
+    joint_Q, joint_f, joint_s = calc_BR_state_machine_player_i_ver(player_i, transition_funcs, strategy_funcs,
+                                                                   utilities, EPSILON,
+                                                                   players_actions=players_actions)
+    margins = reference_margins(EPSILON, joint_Q, joint_f, joint_s, utilities, players_actions)
+    assert max(margins[state][player_i] for state in joint_Q) <= 1e-9
+
+    joint = calc_BR_state_machine_player_i_ver(player_i, transition_funcs, strategy_funcs, utilities, EPSILON,
+                                               as_arrays=True, players_actions=players_actions)
+    assert np.allclose(calc_long_term_util(EPSILON, joint, utilities)[0],
+                       calc_long_term_util(EPSILON, joint_Q, utilities, joint_f, joint_s)[joint_Q[0]])
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("as_arrays", [False, True])
+def test_single_player_best_response_has_no_deviations(seed, as_arrays):
+    players_actions, player_i, transition_funcs, strategy_funcs, utilities = random_others(seed)
+    transition_func, strategy_func = calc_BR_state_machine_player_i_ver(player_i, transition_funcs, strategy_funcs,
+                                                                        utilities, EPSILON, as_arrays=as_arrays,
+                                                                        players_actions=players_actions,
+                                                                        single_player=True)
+    assert set(transition_func) == set(strategy_func) == set(range(len(transition_func)))
+    joint_Q, joint_f, joint_s = construct_joint_state_machine(
+        players_actions, transition_funcs[:player_i] + [transition_func] + transition_funcs[player_i:],
+        strategy_funcs[:player_i] + [strategy_func] + strategy_funcs[player_i:])
+    margins = reference_margins(EPSILON, joint_Q, joint_f, joint_s, utilities, players_actions)
+    assert max(margins[state][player_i] for state in joint_Q) <= 1e-9
@@ -0,0 +1,247 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from build_joint_state_machine import construct_joint_state_machine, local_state_machine_to_dicts
+from check_SPE_state_machine import (calc_critical_discount_factors, calculate_single_player_utility_by_graph,
+                                     check_SPE_state_machine, check_SPE_state_machine_by_graph)
+from creating_three_players_state_machines import create_three_players_state_machines
+from generate_network_state_machines import network_edges, network_games, punish_trust_gain_state_machines
+from reduce_symmetric_state_machine import construct_orbit_state_machine, strategy_automorphisms
+from run_control import RunAborted, RunControl
+from reference import PLAYERS_ACTIONS, random_state_machines, reference_margins, state_names, with_duplicate_states
+
+EPSILONS = [0.5, 0.1, 0.01]
+
+
+def random_joint(seed, unilateral=False, duplicates=False):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs, utilities = random_state_machines(rng, len(players_actions), 4,
+                                                                        players_actions)
+    if duplicates:
+        transition_funcs, strategy_funcs = with_duplicate_states(rng, transition_funcs, strategy_funcs)
+    joint_Q, joint_f, joint_s = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs,
+                                                              unilateral=unilateral)
+    joint = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True,
+                                          unilateral=unilateral)
+    return players_actions, (joint_Q, joint_f, joint_s), joint, utilities
+
+
+def assert_matches_reference(results, names, players_actions, dicts, utilities):
+    for result, EPSILON in zip(results, EPSILONS):
+        expected = reference_margins(EPSILON, *dicts, utilities, players_actions)
+        assert np.allclose(result.margins, [expected[state] for state in names])
+        assert sorted(result.violations) == sorted((state, i) for state in names
+                                                   for i in np.flatnonzero(expected[state] > 0).tolist())
+        assert bool(result) == (len(result.violations) == 0)
+
+
+@pytest.mark.parametrize("seed", range(12))
+@pytest.mark.parametrize("unilateral", [False, True])
+def test_dicts_and_arrays_match_reference(seed, unilateral):
+    players_actions, dicts, joint, utilities = random_joint(seed, unilateral)
+    results = check_SPE_state_machine(*dicts, utilities, EPSILON=EPSILONS, verbose=False,
+                                      players_actions=players_actions)
+    assert_matches_reference(results, dicts[0], players_actions, dicts, utilities)
+    results = check_SPE_state_machine(joint, utils_by_actions=utilities, EPSILON=EPSILONS, verbose=False)
+    assert_matches_reference(results, state_names(joint), players_actions, dicts, utilities)
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("unilateral", [False, True])
+def test_quotient_matches_reference(seed, unilateral):
+    players_actions, dicts, joint, utilities = random_joint(seed, unilateral, duplicates=True)
+    results = check_SPE_state_machine(*dicts, utilities, EPSILON=EPSILONS, verbose=False,
+                                      players_actions=players_actions, quotient=True)
+    assert_matches_reference(results, dicts[0], players_actions, dicts, utilities)
+    results = check_SPE_state_machine(joint, utils_by_actions=utilities, EPSILON=EPSILONS, verbose=False,
+                                      quotient=True)
+    assert_matches_reference(results, state_names(joint), players_actions, dicts, utilities)
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_processes_match_reference(seed):
+    players_actions, dicts, joint, utilities = random_joint(seed)
+    results = check_SPE_state_machine(joint, utils_by_actions=utilities, EPSILON=EPSILONS, verbose=False,
+                                      chunk_size=4, processes=2)
+    assert_matches_reference(results, state_names(joint), players_actions, dicts, utilities)
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_stop_at_first_matches_reference(seed, capsys):
+    players_actions, dicts, joint, utilities = random_joint(seed)
+    result = check_SPE_state_machine(joint, utils_by_actions=utilities, EPSILON=0.1, verbose=False,
+                                     stop_at_first=True, chunk_size=2)
+    expected = reference_margins(0.1, *dicts, utilities, players_actions)
+    expected = np.array([expected[state] for state in state_names(joint)])
+    checked = ~np.isnan(result.margins[:, 0])
+    assert np.allclose(result.margins[checked], expected[checked])
+    assert bool(result) == result.SPE == bool(np.all(expected <= 0))
+    assert result.EPSILON == 0.1
+    assert capsys.readouterr().out == ""
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_critical_discount_factors_match_reference(seed):
+    players_actions, dicts, joint, utilities = random_joint(seed)
+    critical = calc_critical_discount_factors(*dicts[:1], utilities, *dicts[1:])
+    assert critical.critical_DELTA == critical.thresholds.max()
+    assert critical.thresholds[dicts[0].index(critical.state), critical.player] == critical.critical_DELTA
+    assert np.allclose(calc_critical_discount_factors(joint, utilities).thresholds,
+                       [critical.thresholds[dicts[0].index(state)] for state in state_names(joint)])
+
+    # every player stops gaining from deviations just above his threshold, and still gains just below it, away from
+    # DELTA = 1 where the reference linear solve loses its precision
+    for k, state in enumerate(dicts[0]):
+        for i, threshold in enumerate(critical.thresholds[k]):
+            if threshold < 1 - 1e-4:
+                margins = reference_margins(1 - threshold - 1e-6, *dicts, utilities, players_actions)
+                assert margins[state][i] <= 1e-9
+            if 1e-5 < threshold < 1 - 1e-4:
+                margins = reference_margins(1 - threshold + 1e-6, *dicts, utilities, players_actions)
+                assert margins[state][i] > 0
+
+
+@pytest.mark.parametrize("c, d, l", [(1, 2, 4), (1, 3, 10)])
+def test_critical_discount_factor_of_three_players(c, d, l):
+    transition_funcs, strategy_funcs = create_three_players_state_machines(c, d, l, verbose=False)
+    game = {"CC": c, "CD": -l, "DC": d, "DD": 0}
+    games = {(0, 1): game, (1, 0): game, (1, 2): game, (2, 1): game}
+    players_actions = [{"C", "D"}] * 3
+    utilities = [calculate_single_player_utility_by_graph(3, games, i, players_actions) for i in range(3)]
+    joint_Q, joint_f, joint_s = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs)
+
+    critical = calc_critical_discount_factors(joint_Q, utilities, joint_f, joint_s)
+    below, above = check_SPE_state_machine(joint_Q, joint_f, joint_s, utilities, verbose=False,
+                                           EPSILON=[1 - critical.critical_DELTA + 1e-7,
+                                                    1 - critical.critical_DELTA - 1e-7])
+    assert not below and above
+    assert (critical.state, critical.player) in below.violations
+
+
+def random_network_state_machines(rng, n, num_states, symmetric):
+    # every player watches himself and his two neighbors on a cycle, with the same strategy for all of them
+    local = list(itertools.product("CD", repeat=3))
+    transitions = {q: {element: int(rng.integers(num_states)) for element in local} for q in range(num_states)}
+    if symmetric:
+        for q in range(num_states):
+            for own, left, right in local:
+                transitions[q][(own, right, left)] = transitions[q][(own, left, right)]
+    strategy = {q: "CD"[int(rng.integers(2))] for q in range(num_states)}
+    profiles = ["".join(element) for element in itertools.product("CD", repeat=n)]
+    transition_funcs = [{q: {action: transitions[q][(action[i], action[i - 1], action[(i + 1) % n])]
+                             for action in profiles} for q in range(num_states)} for i in range(n)]
+    return transition_funcs, [dict(strategy) for i in range(n)]
+
+
+def random_network_game(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(3, 6))
+    transition_funcs, strategy_funcs = random_network_state_machines(rng, n, 3, seed % 2 == 0)
+    game = {action: float(rng.normal()) for action in ("CC", "CD", "DC", "DD")}
+    return n, {(i, (i + 1) % n): game for i in range(n)}, transition_funcs, strategy_funcs
+
+
+def network_reference(n, games, transition_funcs, strategy_funcs, unilateral):
+    all_games = dict(games)
+    all_games.update({(j, i): value for (i, j), value in games.items()})
+    players_actions = [{"C", "D"}] * n
+    utilities = [calculate_single_player_utility_by_graph(n, all_games, i, players_actions) for i in range(n)]
+    dicts = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, unilateral=unilateral)
+    return check_SPE_state_machine(*dicts, utilities, EPSILON=EPSILONS, verbose=False,
+                                   players_actions=players_actions)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("unilateral", [False, True])
+def test_by_graph_matches_dicts(seed, unilateral):
+    n, games, transition_funcs, strategy_funcs = random_network_game(seed)
+    given_games = dict(games)
+    results = check_SPE_state_machine_by_graph(n, games, transition_funcs, strategy_funcs, EPSILON=EPSILONS,
+                                               unilateral=unilateral, verbose=False)
+    assert games == given_games
+
+    expected = network_reference(n, games, transition_funcs, strategy_funcs, unilateral)
+    for result, expected_result in zip(results, expected):
+        assert sorted(result.violations) == sorted(expected_result.violations)
+        assert bool(result) == bool(expected_result)
+        assert np.isclose(np.max(result.margins), np.max(expected_result.margins))
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("unilateral", [False, True])
+def test_symmetric_matches_dicts(seed, unilateral):
+    n, games, transition_funcs, strategy_funcs = random_network_game(seed)
+    results = check_SPE_state_machine_by_graph(n, games, transition_funcs, strategy_funcs, EPSILON=EPSILONS,
+                                               unilateral=unilateral, verbose=False, symmetric=True)
+    expected = network_reference(n, games, transition_funcs, strategy_funcs, unilateral)
+    players_actions = [{"C", "D"}] * n
+    all_games = {**games, **{(j, i): value for (i, j), value in games.items()}}
+    symmetries = strategy_automorphisms(n, all_games, transition_funcs, strategy_funcs, players_actions)
+    orbit = construct_orbit_state_machine(players_actions, transition_funcs, strategy_funcs, symmetries, unilateral)
+    joint_Q = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, unilateral=unilateral)[0]
+
+    # the representatives are joint states of the full machine, with the same margins
+    for result, expected_result in zip(results, expected):
+        assert bool(result) == bool(expected_result)
+        assert np.isclose(np.max(result.margins), np.max(expected_result.margins))
+        assert np.allclose(result.margins, [expected_result.margins[joint_Q.index(tuple(state))]
+                                            for state in orbit.states.tolist()])
+
+
+@pytest.mark.parametrize("family, n", [("cycle", 5), ("star", 5), ("clique", 5)])
+@pytest.mark.parametrize("unilateral", [False, True])
+def test_symmetric_local_state_machines_match_dicts(family, n, unilateral):
+    edges = network_edges(family, n)
+    machines = punish_trust_gain_state_machines(n, edges, 2, 1)
+    dicts = [local_state_machine_to_dicts(machine, [("C", "D")] * n) for machine in machines]
+    transition_funcs, strategy_funcs = [funcs[0] for funcs in dicts], [funcs[1] for funcs in dicts]
+    games = network_games(edges, 3, 5, 1)
+
+    local = check_SPE_state_machine_by_graph(n, games, machines, None, EPSILON=EPSILONS, unilateral=unilateral,
+                                             verbose=False, symmetric=True)
+    expanded = check_SPE_state_machine_by_graph(n, games, transition_funcs, strategy_funcs, EPSILON=EPSILONS,
+                                                unilateral=unilateral, verbose=False, symmetric=True)
+    expected = network_reference(n, games, transition_funcs, strategy_funcs, unilateral)
+    for local_result, expanded_result, expected_result in zip(local, expanded, expected):
+        assert sorted(local_result.violations) == sorted(expanded_result.violations)
+        assert bool(local_result) == bool(expected_result)
+        assert np.isclose(np.max(local_result.margins), np.max(expected_result.margins))
+
+
+def test_symmetric_clique_tries_max_automorphisms():
+    n = 7
+    edges = network_edges("clique", n)
+    machines = punish_trust_gain_state_machines(n, edges, 2, 1)
+    games = network_games(edges, 3, 5, 1)
+    all_games = {**games, **{(j, i): value for (i, j), value in games.items()}}
+
+    # all the 7! permutations of the clique are symmetries, only the first ones are tried
+    symmetries = strategy_automorphisms(n, all_games, machines, None, [("C", "D")] * n, max_automorphisms=24)
+    assert len(symmetries) == 24
+    assert np.array_equal(symmetries[0][0], np.arange(n))
+    expected = check_SPE_state_machine_by_graph(n, games, machines, None, EPSILON=EPSILONS, unilateral=True,
+                                                verbose=False)
+    for max_automorphisms in (1, 24):
+        results = check_SPE_state_machine_by_graph(n, games, machines, None, EPSILON=EPSILONS, unilateral=True,
+                                                   verbose=False, symmetric=True, max_automorphisms=max_automorphisms)
+        for result, expected_result in zip(results, expected):
+            assert bool(result) == bool(expected_result)
+            assert np.isclose(np.max(result.margins), np.max(expected_result.margins))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_symmetric_stop_at_first_and_control(seed):
+    n, games, transition_funcs, strategy_funcs = random_network_game(seed)
+    expected = network_reference(n, games, transition_funcs, strategy_funcs, False)
+    result = check_SPE_state_machine_by_graph(n, games, transition_funcs, strategy_funcs, EPSILON=EPSILONS[1],
+                                              verbose=False, symmetric=True, stop_at_first=True)
+    assert bool(result) == bool(expected[1])
+
+    with pytest.raises(RunAborted) as aborted:
+        check_SPE_state_machine_by_graph(n, games, transition_funcs, strategy_funcs, verbose=False, symmetric=True,
+                                         control=RunControl(max_states=1))
+    assert aborted.value.reason == "states" and aborted.value.progress.phase == "construct"
+    assert len(aborted.value.partial.transitions) <= len(aborted.value.partial.states)
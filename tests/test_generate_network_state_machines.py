@@ -0,0 +1,79 @@
+import itertools
+
+import pytest
+
+from build_joint_state_machine import construct_joint_state_machine, local_state_machine_to_dicts
+from generate_network_state_machines import (grim_trigger_state_machines, network_edges, network_neighbors,
+                                             punish_trust_gain_state_machines)
+from reference import canonical_arrays
+
+FAMILIES = [("line", 5), ("cycle", 5), ("star", 5), ("clique", 4), ("V", 3)]
+
+
+def test_network_edges():
+    assert len(network_edges("line", 5)) == 4
+    assert len(network_edges("cycle", 5)) == 5 and network_edges("cycle", 2) == [(0, 1)]
+    assert network_edges("star", 4) == [(0, 1), (0, 2), (0, 3)]
+    assert len(network_edges("clique", 5)) == 10
+    assert network_edges("V", 3) == [(0, 1), (1, 2)]
+    with pytest.raises(ValueError):
+        network_edges("V", 4)
+    with pytest.raises(ValueError):
+        network_edges("tree", 4)
+    with pytest.raises(ValueError):
+        punish_trust_gain_state_machines(3, network_edges("V", 3), 0, 1)
+
+
+def play(transition_func, strategy_func, profiles):
+    """
+    :return: The actions that a state machine plays along a sequence of action profiles.
+    """
+    q, actions = 0, []
+    for profile in profiles:
+        actions.append(strategy_func[q])
+        q = transition_func[q][profile]
+    return "".join(actions)
+
+
+@pytest.mark.parametrize("family, n", FAMILIES)
+@pytest.mark.parametrize("punish_num, trust_gain_num", [(1, 0), (2, 1), (3, 2)])
+def test_punish_trust_gain_plays_as_described(family, n, punish_num, trust_gain_num):
+    edges = network_edges(family, n)
+    machines = punish_trust_gain_state_machines(n, edges, punish_num, trust_gain_num)
+    grim_machines = grim_trigger_state_machines(n, edges)
+    cooperate, length = "C" * n, 2 + punish_num + trust_gain_num
+    for i, neighbors in enumerate(network_neighbors(n, edges)):
+        transition_func, strategy_func = local_state_machine_to_dicts(machines[i], [("C", "D")] * n)
+        grim_transition_func, grim_strategy_func = local_state_machine_to_dicts(grim_machines[i], [("C", "D")] * n)
+        assert len(transition_func) == 1 + punish_num + trust_gain_num
+        for j in range(n):
+            defect = cooperate[:j] + "D" + cooperate[j + 1:]
+            # only the defections of the player and his neighbors count
+            if j != i and j not in neighbors:
+                assert play(transition_func, strategy_func, [defect] + [cooperate] * length) == "C" * (length + 1)
+                assert play(grim_transition_func, grim_strategy_func, [defect, cooperate]) == "CC"
+                continue
+            assert play(transition_func, strategy_func, [defect] + [cooperate] * length) == (
+                "C" + "D" * punish_num + "C" * trust_gain_num + "CC")
+            assert play(grim_transition_func, grim_strategy_func, [defect] + [cooperate] * length) == (
+                "C" + "D" * length)
+            # a neighbor that defects while the player gains trust back starts the punishment again
+            if trust_gain_num and j != i:
+                profiles = [defect] + [cooperate] * punish_num + [defect] + [cooperate] * length
+                assert play(transition_func, strategy_func, profiles).startswith(
+                    "C" + "D" * punish_num + "C" + "D" * punish_num)
+
+
+@pytest.mark.parametrize("family, n", FAMILIES)
+@pytest.mark.parametrize("unilateral, minimize", list(itertools.product([False, True], repeat=2)))
+def test_generated_machines_match_dicts(family, n, unilateral, minimize):
+    edges = network_edges(family, n)
+    players_actions = [{"C", "D"}] * n
+    for machines in (grim_trigger_state_machines(n, edges), punish_trust_gain_state_machines(n, edges, 2, 1)):
+        dicts = [local_state_machine_to_dicts(machine, players_actions) for machine in machines]
+        joint = construct_joint_state_machine(players_actions, machines, None, as_arrays=True, unilateral=unilateral,
+                                              minimize=minimize)
+        dict_joint = construct_joint_state_machine(players_actions, [machine[0] for machine in dicts],
+                                                   [machine[1] for machine in dicts], as_arrays=True,
+                                                   unilateral=unilateral, minimize=minimize)
+        assert canonical_arrays(joint) == canonical_arrays(dict_joint)
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+import out_of_core_joint_state_machine
+from build_joint_state_machine import (LocalStateMachine, construct_joint_state_machine,
+                                       joint_state_machine_to_arrays, local_state_machine_to_dicts)
+from joint_state_machine_file import load_joint_state_machine, save_joint_state_machine
+from out_of_core_joint_state_machine import construct_joint_state_machine_out_of_core
+from reference import PLAYERS_ACTIONS, canonical_arrays, random_state_machines, with_duplicate_states
+
+
+@pytest.mark.parametrize("seed", range(12))
+@pytest.mark.parametrize("unilateral", [False, True])
+def test_arrays_match_dicts(seed, unilateral):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs = random_state_machines(rng, len(players_actions), 4, players_actions,
+                                                             tuple_keys=seed % 2 == 1)[:2]
+
+    joint_Q, joint_f, joint_s = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs,
+                                                              unilateral=unilateral)
+    joint = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True,
+                                          unilateral=unilateral)
+    assert joint.unilateral == unilateral
+    assert tuple(joint.states[0]) == joint_Q[0]
+    assert canonical_arrays(joint) == canonical_arrays(joint_state_machine_to_arrays(players_actions, joint_Q, joint_f,
+                                                                                     joint_s))
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_unilateral_keeps_the_deviations(seed):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs = random_state_machines(rng, len(players_actions), 4, players_actions)[:2]
+    joint_Q, joint_f, joint_s = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs)
+    unilateral_Q, unilateral_f, unilateral_s = construct_joint_state_machine(players_actions, transition_funcs,
+                                                                             strategy_funcs, unilateral=True)
+
+    # the unilateral machine is the part of the full machine that the path of play and single deviations reach
+    assert set(unilateral_Q) <= set(joint_Q)
+    for state in unilateral_Q:
+        assert unilateral_s[state] == joint_s[state]
+        assert all(joint_f[state][action] == next_state for action, next_state in unilateral_f[state].items())
+        assert len(unilateral_f[state]) == 1 + sum(len(actions) - 1 for actions in players_actions)
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_minimize_state_maps(seed):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs = with_duplicate_states(
+        rng, *random_state_machines(rng, len(players_actions), 3, players_actions)[:2])
+
+    joint = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True)
+    minimized, state_maps = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs,
+                                                          as_arrays=True, minimize=True, return_state_maps=True)
+    assert len(minimized.strategy) <= len(joint.strategy)
+
+    # every joint state is merged into a joint state that plays the same and moves to the merged successors
+    merged = canonical_arrays(minimized)
+    for state, (action, successors) in canonical_arrays(joint).items():
+        assert merged[tuple(state_maps[i][q] for i, q in enumerate(state))] == (
+            action, tuple(tuple(state_maps[i][q] for i, q in enumerate(successor)) for successor in successors))
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("mmap", [True, False])
+def test_file_round_trip(tmp_path, seed, mmap):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs = random_state_machines(rng, len(players_actions), 5, players_actions)[:2]
+    joint = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True,
+                                          unilateral=seed % 2 == 0)
+    values = rng.normal(size=(len(joint.strategy), len(players_actions)))
+
+    save_joint_state_machine(str(tmp_path / "joint.bin"), joint, values)
+    loaded, loaded_values = load_joint_state_machine(str(tmp_path / "joint.bin"), mmap=mmap)
+    for name in ("states", "transitions", "strategy"):
+        assert np.array_equal(getattr(loaded, name), getattr(joint, name))
+        assert getattr(loaded, name).dtype == getattr(joint, name).dtype
+    assert loaded.players_actions == joint.players_actions
+    assert loaded.unilateral == joint.unilateral
+    assert np.array_equal(loaded_values, values)
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("unilateral", [False, True])
+def test_out_of_core_matches_in_memory(tmp_path, monkeypatch, seed, unilateral):
+    # a tiny memory budget and merge chunk, so the queue spills and the index merges runs on disk
+    monkeypatch.setattr(out_of_core_joint_state_machine, "_MERGE_CHUNK", 2)
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs = random_state_machines(rng, len(players_actions), 6, players_actions)[:2]
+
+    joint = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True,
+                                          unilateral=unilateral)
+    out_of_core = construct_joint_state_machine_out_of_core(players_actions, transition_funcs, strategy_funcs,
+                                                            str(tmp_path / "joint.bin"), unilateral=unilateral,
+                                                            memory_budget=4096)
+    assert out_of_core.unilateral == unilateral
+    assert canonical_arrays(out_of_core) == canonical_arrays(joint)
+    assert canonical_arrays(load_joint_state_machine(str(tmp_path / "joint.bin"))[0]) == canonical_arrays(joint)
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("unilateral", [False, True])
+def test_local_state_machines_match_dicts(seed, unilateral):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    num_players = len(players_actions)
+    machines = []
+    for i in range(num_players):
+        watched = np.union1d([i], rng.choice(num_players, num_players - 1, replace=False))
+        num_states = int(rng.integers(1, 4))
+        num_local_profiles = int(np.prod([len(players_actions[j]) for j in watched]))
+        machines.append(LocalStateMachine(i, watched, rng.integers(num_states, size=(num_states, num_local_profiles),
+                                                                   dtype=np.int32),
+                                          rng.integers(len(players_actions[i]), size=num_states)))
+    dicts = [local_state_machine_to_dicts(machine, players_actions) for machine in machines]
+
+    joint = construct_joint_state_machine(players_actions, machines, None, as_arrays=True, unilateral=unilateral)
+    dict_joint = construct_joint_state_machine(players_actions, [machine[0] for machine in dicts],
+                                               [machine[1] for machine in dicts], as_arrays=True,
+                                               unilateral=unilateral)
+    assert canonical_arrays(joint) == canonical_arrays(dict_joint)
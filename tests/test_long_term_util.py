@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from build_joint_state_machine import construct_joint_state_machine
+from check_SPE_state_machine import (calc_long_term_util, calc_long_term_util_batch, on_path_ancestors,
+                                     on_path_predecessors, on_path_structure, propagate_long_term_util,
+                                     update_long_term_util)
+from reference import (PLAYERS_ACTIONS, random_state_machines, reference_long_term_util, state_names,
+                       with_duplicate_states)
+
+EPSILONS = [0.5, 0.1, 0.01]
+
+
+def random_machine(seed, duplicates=False):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs, utilities = random_state_machines(rng, len(players_actions), 4,
+                                                                        players_actions)
+    if duplicates:
+        transition_funcs, strategy_funcs = with_duplicate_states(rng, transition_funcs, strategy_funcs)
+    return players_actions, transition_funcs, strategy_funcs, utilities
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_dicts_and_arrays_match_linear_solve(seed):
+    players_actions, transition_funcs, strategy_funcs, utilities = random_machine(seed)
+    joint_Q, joint_f, joint_s = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs)
+    joint = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True)
+    names = state_names(joint)
+
+    batch = calc_long_term_util_batch(EPSILONS, joint, utilities)
+    dict_batch = calc_long_term_util_batch(EPSILONS, joint_Q, utilities, joint_f, joint_s)
+    for e, EPSILON in enumerate(EPSILONS):
+        expected = reference_long_term_util(EPSILON, joint_Q, joint_f, joint_s, utilities)
+        long_term_util = calc_long_term_util(EPSILON, joint_Q, utilities, joint_f, joint_s)
+        arrays = calc_long_term_util(EPSILON, joint, utilities)
+        for k, state in enumerate(joint_Q):
+            assert np.allclose(long_term_util[state], expected[state])
+            assert np.allclose(dict_batch[e, k], expected[state])
+        for k, state in enumerate(names):
+            assert np.allclose(arrays[k], expected[state])
+            assert np.allclose(batch[e, k], expected[state])
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_quotient_matches_linear_solve(seed):
+    players_actions, transition_funcs, strategy_funcs, utilities = random_machine(seed, duplicates=True)
+    joint_Q, joint_f, joint_s = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs)
+
+    quotient = calc_long_term_util_batch(EPSILONS, joint_Q, utilities, joint_f, joint_s, quotient=True)
+    for e, EPSILON in enumerate(EPSILONS):
+        expected = reference_long_term_util(EPSILON, joint_Q, joint_f, joint_s, utilities)
+        assert np.allclose(quotient[e], [expected[state] for state in joint_Q])
+
+
+@pytest.mark.parametrize("length", [1, 2, 1000, 4097])
+def test_long_chain_matches_backward_sum(length):
+    # a path of play into a cycle of 3 states, where the doubling takes log(length) steps
+    rng = np.random.default_rng(length)
+    next_states = np.append(np.arange(1, length + 3), length)
+    stage_utils = rng.normal(size=(length + 3, 2))
+    long_term_util = propagate_long_term_util([0.01, 0.3], stage_utils, on_path_structure(next_states))
+
+    for e, DELTA in enumerate([0.99, 0.7]):
+        expected = np.zeros_like(stage_utils)
+        cycle = [length, length + 1, length + 2]
+        for k, state in enumerate(cycle):
+            expected[state] = sum(DELTA ** j * stage_utils[cycle[(k + j) % 3]] for j in range(3)) / (1 - DELTA ** 3)
+        for state in range(length - 1, -1, -1):
+            expected[state] = stage_utils[state] + DELTA * expected[state + 1]
+        assert np.allclose(long_term_util[e], expected)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_on_path_graph_matches_linear_solve(seed):
+    rng = np.random.default_rng(seed)
+    num_states = 200
+    next_states = rng.integers(num_states, size=num_states)
+    stage_utils = rng.normal(size=(num_states, 3))
+    long_term_util = propagate_long_term_util([0.05], stage_utils, on_path_structure(next_states))[0]
+
+    transition = np.eye(num_states)
+    transition[np.arange(num_states), next_states] -= 0.95
+    assert np.allclose(long_term_util, np.linalg.solve(transition, stage_utils))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_update_matches_full_recalculation(seed):
+    rng = np.random.default_rng(seed)
+    num_states = 40
+    next_states = rng.integers(num_states, size=num_states)
+    stage_utils = rng.normal(size=(num_states, 2))
+    long_term_util = propagate_long_term_util([0.1], stage_utils, on_path_structure(next_states))[0]
+
+    changed = rng.choice(num_states, 3, replace=False)
+    next_states[changed] = rng.integers(num_states, size=3)
+    stage_utils[changed] = rng.normal(size=(3, 2))
+    update_long_term_util(0.1, long_term_util, next_states, stage_utils,
+                          on_path_ancestors(changed, on_path_predecessors(next_states)))
+    assert np.allclose(long_term_util, propagate_long_term_util([0.1], stage_utils,
+                                                                on_path_structure(next_states))[0])
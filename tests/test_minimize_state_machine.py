@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from minimize_state_machine import minimize_state_machine, refine_partition
+from reference import moore_partition, random_state_machines, same_partition, with_duplicate_states
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_refine_partition_matches_moore(seed):
+    rng = np.random.default_rng(seed)
+    num_states = int(rng.integers(1, 60))
+    table = rng.integers(num_states, size=(num_states, int(rng.integers(1, 5))))
+    outputs = rng.integers(int(rng.integers(1, 4)), size=num_states)
+
+    labels = refine_partition(table, outputs)
+    assert same_partition(labels, moore_partition(table, outputs))
+    # the groups are numbered in the order of their first states
+    assert np.array_equal(np.sort(np.unique(labels, return_index=True)[1]), np.unique(labels, return_index=True)[1])
+
+
+def test_refine_partition_long_chain():
+    # a chain of punishments, where Moore's refinement needs a round for every state
+    num_states = 3000
+    table = np.minimum(np.arange(num_states) + 1, num_states - 1)[:, None]
+    outputs = (np.arange(num_states) == num_states - 1).astype(np.int64)
+    labels = refine_partition(np.column_stack([table, table]), outputs)
+    assert len(np.unique(labels)) == num_states
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_minimized_machine_plays_the_same(seed):
+    rng = np.random.default_rng(seed)
+    players_actions = [("C", "D")] * 2
+    transition_funcs, strategy_funcs = with_duplicate_states(
+        rng, *random_state_machines(rng, 1, 4, players_actions)[:2])
+    transition_func, strategy_func = transition_funcs[0], strategy_funcs[0]
+    min_transition, min_strategy, state_map = minimize_state_machine(transition_func, strategy_func)
+    assert len(min_transition) <= 4
+
+    for q, k in state_map.items():
+        assert min_strategy[k] == strategy_func[q]
+        for profile, next_q in transition_func[q].items():
+            assert min_transition[k][profile] == state_map[next_q]
@@ -0,0 +1,88 @@
+import json
+
+import numpy as np
+import pytest
+
+from build_joint_state_machine import construct_joint_state_machine, on_path_next_states
+from calc_BR_state_machine import calc_BR_state_machine_player_i_ver
+from check_SPE_state_machine import check_SPE_state_machine
+from phase_stats import PhaseStats, count, phase, record_histogram, record_max
+from reference import PLAYERS_ACTIONS, random_state_machines
+
+EPSILONS = [0.5, 0.1]
+
+
+def test_phases_and_counters():
+    ended = []
+    stats = PhaseStats(callback=lambda name, seconds: ended.append(name))
+    for attempt in range(2):
+        with phase(stats, "outer"):
+            with phase(stats, "inner"):
+                count(stats, "items", 3)
+    record_max(stats, "high", 5)
+    record_max(stats, "high", 2)
+    record_histogram(stats, "lengths", np.array([1, 3, 1]))
+    record_histogram(stats, "lengths", np.array([3]))
+
+    assert ended == ["inner", "outer"] * 2
+    assert stats.phases["outer"]["calls"] == stats.phases["inner"]["calls"] == 2
+    assert stats.phases["outer"]["time"] >= stats.phases["inner"]["time"] >= 0
+    assert stats.counters == {"items": 6, "high": 5}
+    assert stats.histograms == {"lengths": {1: 2, 3: 2}}
+    assert json.loads(stats.to_json(indent=1)) == stats.to_dict()
+    assert stats.to_dict()["histograms"] == {"lengths": {"1": 2, "3": 2}}
+
+    # without stats nothing is recorded
+    with phase(None, "outer"):
+        count(None, "items")
+        record_max(None, "high", 1)
+        record_histogram(None, "lengths", np.array([1]))
+
+
+def on_path_cycle_lengths(next_states):
+    """
+    :return: The lengths of the cycles of the path of play, found by walking from every state.
+    """
+    lengths = set()
+    for state in range(len(next_states)):
+        path = []
+        while state not in path:
+            path.append(state)
+            state = next_states[state]
+        cycle = path[path.index(state):]
+        lengths.add((min(cycle), len(cycle)))
+    return sorted(length for first, length in lengths)
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("as_arrays", [False, True])
+def test_check_counters(seed, as_arrays):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs, utilities = random_state_machines(rng, len(players_actions), 4,
+                                                                        players_actions)
+    stats = PhaseStats()
+    joint = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True,
+                                          stats=stats)
+    num_states = len(joint.strategy)
+    check_SPE_state_machine(joint, utils_by_actions=utilities, EPSILON=EPSILONS, verbose=False, stats=stats)
+
+    num_deviations = sum(len(actions) - 1 for actions in players_actions)
+    lengths = on_path_cycle_lengths(on_path_next_states(joint).tolist())
+    assert stats.counters["joint_states"] == num_states
+    assert 1 <= stats.counters["bfs_queue_max"] <= num_states
+    assert stats.counters["states_checked"] == num_states
+    assert stats.counters["deviations_checked"] == num_states * num_deviations * len(EPSILONS)
+    assert stats.counters["cycles"] == len(lengths)
+    assert stats.histograms["cycle_lengths"] == {length: lengths.count(length) for length in set(lengths)}
+    assert {"construct", "on_path", "deviations", "on_path_structure", "long_term_util",
+            "deviation_gains"} <= set(stats.phases)
+    assert all(stats.phases[name]["calls"] == 1 for name in ("construct", "long_term_util", "deviation_gains"))
+
+    stats = PhaseStats()
+    others = slice(1, None)
+    calc_BR_state_machine_player_i_ver(0, transition_funcs[others], strategy_funcs[others], utilities,
+                                       as_arrays=as_arrays, players_actions=players_actions, stats=stats)
+    assert stats.counters["br_iterations"] >= 1
+    assert {"construct", "best_response"} <= set(stats.phases)
+    assert json.loads(stats.to_json())["counters"] == stats.counters
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+import build_joint_state_machine
+from build_joint_state_machine import construct_joint_state_machine
+from calc_BR_state_machine import calc_BR_state_machine_player_i_ver
+from check_SPE_state_machine import check_SPE_state_machine
+from reference import PLAYERS_ACTIONS, random_state_machines
+from run_control import CancellationToken, RunAborted, RunControl
+
+
+def random_game(seed, num_states=6):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    return (players_actions,) + random_state_machines(rng, len(players_actions), num_states, players_actions)
+
+
+def cancel_after(phase, done):
+    """
+    :return: A RunControl that reports every checkpoint, and whose progress callback cancels its token when done units
+    of work of the phase are reported, so the run stops at the next checkpoint.
+    """
+    token = CancellationToken()
+    reports = []
+
+    def progress(report):
+        reports.append(report)
+        if report.phase == phase and report.done >= done:
+            token.cancel()
+
+    control = RunControl(progress, token=token, interval=0)
+    control.reports = reports
+    return control
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_construct_stops_at_the_state_budget(monkeypatch, seed):
+    # small chunks, so the budget runs out in the middle of the BFS
+    monkeypatch.setattr(build_joint_state_machine, "_EXPAND_CHUNK", 8)
+    players_actions, transition_funcs, strategy_funcs = random_game(seed)[:3]
+    joint = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True)
+    max_states = len(joint.strategy) // 2
+
+    with pytest.raises(RunAborted) as aborted:
+        construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True,
+                                      control=RunControl(max_states=max_states))
+    partial = aborted.value.partial
+    assert aborted.value.reason == "states" and aborted.value.progress.states == max_states + 1
+    # the partial machine is the start of the full one, and only the expanded joint states have transitions
+    assert np.array_equal(partial.states, joint.states[:max_states + 1])
+    assert np.array_equal(partial.transitions, joint.transitions[:len(partial.transitions)])
+    assert len(partial.transitions) < len(partial.states)
+
+    with pytest.raises(RunAborted) as aborted:
+        construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs,
+                                      control=RunControl(max_states=max_states))
+    joint_Q, joint_f, joint_s = aborted.value.partial
+    assert aborted.value.reason == "states" and len(joint_Q) > max_states
+    assert set(joint_f) == set(joint_s) < set(joint_Q)
+
+
+def test_dict_construct_checks_every_few_states(monkeypatch):
+    monkeypatch.setattr(build_joint_state_machine, "_CHECKPOINT_STATES", 3)
+    players_actions, transition_funcs, strategy_funcs = random_game(1)[:3]
+    reports = []
+    joint_Q = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs,
+                                            control=RunControl(reports.append, interval=0))[0]
+    assert [report.done for report in reports] == list(range(0, len(joint_Q), 3)) + [len(joint_Q)]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_check_stops_with_the_margins_so_far(seed):
+    players_actions, transition_funcs, strategy_funcs, utilities = random_game(seed)
+    joint = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs, as_arrays=True)
+    expected = check_SPE_state_machine(joint, utils_by_actions=utilities, EPSILON=0.1, verbose=False)
+    control = cancel_after("check_SPE", 4)
+    with pytest.raises(RunAborted) as aborted:
+        check_SPE_state_machine(joint, utils_by_actions=utilities, EPSILON=0.1, verbose=False, chunk_size=2,
+                                control=control)
+    margins = aborted.value.partial[0]
+    assert aborted.value.reason == "cancelled" and aborted.value.progress.done == 6
+    assert np.allclose(margins[:6], expected.margins[:6]) and np.all(np.isnan(margins[6:]))
+    assert [report.done for report in control.reports if report.phase == "check_SPE"] == [0, 2, 4, 6]
+
+    # with a control that never stops, the check is the same
+    result = check_SPE_state_machine(joint, utils_by_actions=utilities, EPSILON=0.1, verbose=False, chunk_size=2,
+                                     control=RunControl(max_seconds=1e6))
+    assert np.array_equal(result.margins, expected.margins)
+    with pytest.raises(RunAborted) as aborted:
+        check_SPE_state_machine(joint, utils_by_actions=utilities, verbose=False, control=RunControl(max_seconds=0))
+    assert aborted.value.reason == "time"
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("as_arrays", [False, True])
+def test_best_response_stops_with_its_actions(seed, as_arrays):
+    players_actions, transition_funcs, strategy_funcs, utilities = random_game(seed)
+    others = slice(1, None)
+    control = cancel_after("best_response", 0)
+    try:
+        calc_BR_state_machine_player_i_ver(0, transition_funcs[others], strategy_funcs[others], utilities,
+                                           as_arrays=as_arrays, players_actions=players_actions, control=control)
+    except RunAborted as aborted:
+        # the partial result is the joint machine with the actions of the first iteration
+        assert aborted.reason == "cancelled" and aborted.progress[:3] == ("best_response", 1, None)
+        if as_arrays:
+            assert len(aborted.partial.strategy) == len(aborted.partial.states) == len(aborted.partial.transitions)
+        else:
+            joint_Q, joint_f, joint_s = aborted.partial
+            assert set(joint_f) == set(joint_s) == set(joint_Q)
+    else:
+        # the best-response was found in a single iteration
+        assert [report[1:3] for report in control.reports if report.phase == "best_response"] == [(0, None), (1, 0)]
@@ -0,0 +1,77 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+import spe
+
+THREE_PLAYERS = {"three_players": {"c": 1, "d": 2, "l": 4}}
+
+
+@pytest.fixture(autouse=True)
+def keep_sigterm():
+    # the command line cancels its runs on SIGTERM
+    handler = signal.getsignal(signal.SIGTERM)
+    yield
+    signal.signal(signal.SIGTERM, handler)
+
+
+def test_imports_run_nothing():
+    # importing the modules prints nothing, and the command line alone doesn't import NumPy
+    code = ("import sys, spe; assert 'numpy' not in sys.modules; "
+            "import examples, creating_three_players_state_machines, check_SPE_state_machine, calc_BR_state_machine")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+    assert process.returncode == 0 and process.stdout == ""
+
+
+def write_spec(tmp_path, spec):
+    path = tmp_path / "spec.json"
+    path.write_text(json.dumps(spec))
+    return str(path)
+
+
+def test_check_exit_status_is_0_for_SPE(tmp_path, capsys):
+    assert spe.main(["check", write_spec(tmp_path, {**THREE_PLAYERS, "EPSILON": 0.01})]) == 0
+    assert "SPE" in capsys.readouterr().out
+
+
+def test_check_exit_status_is_1_for_violations(tmp_path, capsys):
+    spec = write_spec(tmp_path, {**THREE_PLAYERS, "EPSILON": [0.01, 0.5]})
+    assert spe.main(["check", "--quiet", spec]) == 1
+    assert capsys.readouterr().out == ""
+
+
+def test_check_and_br_exit_status_is_3_over_budget(tmp_path, capsys):
+    spec = write_spec(tmp_path, {**THREE_PLAYERS, "player": 1})
+    assert spe.main(["check", "--quiet", "--max-states", "2", spec]) == 3
+    assert "stopped (states)" in capsys.readouterr().err
+    assert spe.main(["br", "--max-seconds", "0", spec]) == 3
+    assert "stopped (time)" in capsys.readouterr().err
+
+
+def test_spec_with_state_machines(tmp_path, capsys):
+    # grim-trigger on a line of two players, with the states as strings like JSON gives them back
+    transition_func = {"0": {"CC": 0, "CD": 1, "DC": 1, "DD": 1}, "1": {"CC": 1, "CD": 1, "DC": 1, "DD": 1}}
+    spec = {"players": 2, "games": [{"edge": [0, 1], "game": {"CC": 2, "CD": -1, "DC": 3, "DD": 0}}],
+            "transition_funcs": [transition_func] * 2, "strategy_funcs": [{"0": "C", "1": "D"}] * 2,
+            "EPSILON": 0.1, "player": 0}
+    path = write_spec(tmp_path, spec)
+    assert spe.main(["check", "--quiet", path]) == 0
+
+    assert spe.main(["br", path]) == 0
+    best_response = json.loads(capsys.readouterr().out)
+    assert set(best_response) == {"transition_func", "strategy_func"}
+
+
+def test_sweep_writes_csv(tmp_path):
+    output = tmp_path / "sweep.csv"
+    spec = write_spec(tmp_path, {"points": [[1, 2, 4, 0.01]], "grid": {"c": [1], "d": [2, 3], "l": [4],
+                                                                       "EPSILON": [0.5]}})
+    assert spe.main(["sweep", "--output", str(output), spec]) == 0
+    lines = output.read_text().splitlines()
+    assert lines[0] == "c,d,l,EPSILON,punish_num,trust_gain_num,SPE,margin"
+    assert [line.split(",")[6] for line in lines[1:]] == ["True", "False", "False"]
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from build_joint_state_machine import action_profiles, construct_joint_state_machine
+from check_SPE_state_machine import check_SPE_state_machine
+from reference import PLAYERS_ACTIONS, random_state_machines, state_names
+from spe_session import SPESession
+
+EPSILON = 0.1
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("unilateral", [False, True])
+def test_edits_match_checks_from_scratch(seed, unilateral):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs, utilities = random_state_machines(rng, len(players_actions), 3,
+                                                                        players_actions)
+    session = SPESession(players_actions, transition_funcs, strategy_funcs, utilities, EPSILON=EPSILON,
+                         unilateral=unilateral)
+    profiles = action_profiles(players_actions)
+    expected = check_SPE_state_machine(*construct_joint_state_machine(players_actions, transition_funcs,
+                                                                      strategy_funcs, unilateral=unilateral),
+                                       utilities, EPSILON=EPSILON, verbose=False, players_actions=players_actions)
+    assert sorted(session.result().violations) == sorted(expected.violations)
+
+    for step in range(30):
+        i = int(rng.integers(len(players_actions)))
+        q = int(rng.integers(len(transition_funcs[i])))
+        kind = rng.random()
+        if kind < 0.4:
+            action = players_actions[i][int(rng.integers(len(players_actions[i])))]
+            strategy_funcs[i][q] = action
+            result = session.edit(i, actions={q: action})
+        elif kind < 0.9:
+            profile = profiles[int(rng.integers(len(profiles)))]
+            transition_funcs[i][q][profile] = int(rng.integers(len(transition_funcs[i])))
+            result = session.edit(i, transitions={q: {profile: transition_funcs[i][q][profile]}})
+        else:
+            # a new state, and a transition into it
+            new_q = len(transition_funcs[i])
+            transition_funcs[i][new_q] = {profile: int(rng.integers(new_q)) for profile in profiles}
+            strategy_funcs[i][new_q] = players_actions[i][0]
+            profile = profiles[int(rng.integers(len(profiles)))]
+            transition_funcs[i][q][profile] = new_q
+            result = session.edit(i, transitions={new_q: dict(transition_funcs[i][new_q]), q: {profile: new_q}},
+                                  actions={new_q: players_actions[i][0]})
+
+        joint_Q, joint_f, joint_s = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs,
+                                                                  unilateral=unilateral)
+        expected = check_SPE_state_machine(joint_Q, joint_f, joint_s, utilities, EPSILON=EPSILON, verbose=False,
+                                           players_actions=players_actions)
+        expected_margins = dict(zip(joint_Q, expected.margins))
+        names = state_names(session.joint_state_machine())
+        assert sorted(names) == sorted(joint_Q)
+        assert np.allclose(result.margins, [expected_margins[state] for state in names])
+        assert sorted(result.violations) == sorted(expected.violations)
+        assert bool(result) == bool(expected)
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+
+from build_joint_state_machine import construct_joint_state_machine
+from check_SPE_state_machine import calc_long_term_util
+from reference import PLAYERS_ACTIONS, random_state_machines
+from state_machine_cache import StateMachineCache
+
+
+@pytest.mark.parametrize("directory", [False, True])
+def test_cached_values_are_protected(tmp_path, directory):
+    cache = StateMachineCache(directory=str(tmp_path) if directory else None)
+    value = ([1, 2], {"a": {3}}, np.arange(3))
+    first = cache.get_or_compute(("value",), lambda: value)
+    first[0].append(3)
+    first[1]["a"].add(4)
+    with pytest.raises(ValueError):
+        first[2][0] = 5
+
+    if directory:
+        cache._memory.clear()
+    second = cache.get_or_compute(("value",), lambda: None)
+    assert second[0] == [1, 2] and second[1] == {"a": {3}}
+    assert np.array_equal(second[2], np.arange(3))
+    assert cache.hits == 1 and cache.misses == 1
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_cached_joint_machine_and_values_match(seed):
+    rng = np.random.default_rng(seed)
+    players_actions = PLAYERS_ACTIONS[seed % len(PLAYERS_ACTIONS)]
+    transition_funcs, strategy_funcs, utilities = random_state_machines(rng, len(players_actions), 4,
+                                                                        players_actions)
+    cache = StateMachineCache()
+
+    joint_Q, joint_f, joint_s = construct_joint_state_machine(players_actions, transition_funcs, strategy_funcs)
+    for attempt in range(2):
+        cached_Q, cached_f, cached_s = construct_joint_state_machine(players_actions, transition_funcs,
+                                                                     strategy_funcs, cache=cache)
+        assert (cached_Q, cached_f, cached_s) == (joint_Q, joint_f, joint_s)
+        cached_s[joint_Q[0]] = None
+        long_term_util = calc_long_term_util(0.1, joint_Q, utilities, joint_f, joint_s, cache=cache)
+        expected = calc_long_term_util(0.1, joint_Q, utilities, joint_f, joint_s)
+        assert all(np.allclose(long_term_util[state], expected[state]) for state in joint_Q)
+    assert cache.hits == 2
+
+
+def test_callers_arrays_stay_writable(tmp_path):
+    cache = StateMachineCache(directory=str(tmp_path))
+    value = (np.arange(3), [np.ones(2)])
+    cache.put("key", value)
+    value[0][0] = 5
+    value[1][0][0] = 5
+    assert np.array_equal(cache.get("key")[0], np.arange(3))
+
+    computed = np.arange(4)
+    assert not cache.get_or_compute(("computed",), lambda: computed).flags.writeable
+    computed[0] = 5
+
+
+def test_files_evicted_by_another_process_are_skipped(tmp_path, monkeypatch):
+    cache = StateMachineCache(max_entries=0, directory=str(tmp_path), max_disk_bytes=1)
+    other = StateMachineCache(max_entries=0, directory=str(tmp_path))
+    other.put("first", np.arange(3))
+    assert other.get("first") is not None
+
+    # the file disappears between the listing of the directory and its removal
+    remove = os.remove
+
+    def remove_twice(path):
+        remove(path)
+        remove(path)
+
+    monkeypatch.setattr(os, "remove", remove_twice)
+    cache.put("second", np.arange(3))
+    monkeypatch.undo()
+    assert cache.get("first") is None and cache.get("second") is None
+    assert cache.misses == 2
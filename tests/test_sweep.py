@@ -0,0 +1,25 @@
+import numpy as np
+
+from creating_three_players_state_machines import (create_three_players_state_machines, three_players_parameters,
+                                                   sweep_three_players_state_machines)
+
+POINTS = [(c, d, l, EPSILON) for c in (1, 2) for d in (2, 3, 5) for l in (1, 4) for EPSILON in (0.01, 0.2, 0.5)
+          if d > c]
+
+
+def test_sweep_matches_single_checks():
+    sweep = sweep_three_players_state_machines(POINTS, batch_size=5)
+    assert np.array_equal(np.column_stack([sweep.c, sweep.d, sweep.l, sweep.EPSILON]), POINTS)
+    for k, (c, d, l, EPSILON) in enumerate(POINTS):
+        assert (sweep.punish_num[k], sweep.trust_gain_num[k]) == three_players_parameters(c, d, l)
+        result = create_three_players_state_machines(c, d, l, EPSILON=EPSILON, verbose=False, return_result=True)[2]
+        assert sweep.SPE[k] == bool(result)
+        assert np.isclose(sweep.margin[k], np.nanmax(result.margins))
+
+
+def test_sweep_processes_match():
+    sweep = sweep_three_players_state_machines(POINTS)
+    pooled = sweep_three_players_state_machines(POINTS[::-1], processes=2, batch_size=3)
+    assert np.array_equal(pooled.SPE, sweep.SPE[::-1])
+    assert np.allclose(pooled.margin, sweep.margin[::-1])
+    assert len(sweep_three_players_state_machines([]).SPE) == 0